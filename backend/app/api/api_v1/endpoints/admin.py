@@ -33,7 +33,7 @@ async def get_candidate_news(news_engine=Depends(get_news_engine)):
 @router.post("/news/activate/{news_id}")
 async def activate_news(news_id: int, news_engine=Depends(get_news_engine)):
     """Manually activate a news event"""
-    news_engine.active_news_ids.add(news_id)
+    news_engine.activate_news(news_id)
     return {"message": f"News {news_id} activated", "active_news": list(news_engine.active_news_ids)}
 
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
 from app.services.order_book import OrderBook
 from dependencies import get_order_book
@@ -7,13 +7,24 @@ router = APIRouter()
 
 
 @router.get("/{ticker}")
-def get_orderbook(ticker: str, orderbook: OrderBook = Depends(get_order_book)):
-
+async def get_orderbook(
+    ticker: str,
+    depth: int = Query(default=10, ge=1, le=20),
+    orderbook: OrderBook = Depends(get_order_book),
+):
+    """
+    Aggregated (L2) depth for a ticker: one entry per price level with the
+    total resting quantity and number of orders, best price first
+    Async so the book is read on the event loop the matching engine writes from,
+    never from a threadpool worker
+    """
     if not orderbook.has_ticker(ticker):
         raise HTTPException(status_code=404, detail=f"Ticker '{ticker}' does not exist")
 
+    snapshot = orderbook.depth_snapshot(ticker, depth)
     return {
         "ticker": ticker,
-        "bids": orderbook.get_bids(ticker),
-        "asks": orderbook.get_asks(ticker),
+        "version": snapshot["version"],
+        "bids": snapshot["bids"],
+        "asks": snapshot["asks"],
     }
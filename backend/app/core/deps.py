@@ -88,7 +88,15 @@ def get_current_user_optional(
     if credentials is None:
         return None
 
-    username = verify_token(credentials.credentials)
+    return get_user_from_token(db, credentials.credentials)
+
+
+def get_user_from_token(db: Session, token: str) -> Optional[UserInDB]:
+    """
+    Resolve a JWT to its user, None if the token or the user is invalid
+    Used where there is no Authorization header, e.g. WebSocket connections
+    """
+    username = verify_token(token)
     if username is None:
         return None
 
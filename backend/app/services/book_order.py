@@ -0,0 +1,106 @@
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID
+
+from app.schemas.order import OrderModel, OrderSide
+
+
+class BookOrder:
+    """
+    Compact order record used inside the matching engine
+
+    OrderModel (pydantic, validate_assignment) is only used at the API boundary,
+    every quantity update inside match_order would otherwise run validation.
+    __slots__ keeps each resting order small and attribute access cheap.
+
+    created_at is a unix timestamp (float), converted to a datetime only when
+    the order is handed back to the API
+
+    id is the sequence number the order book assigns when it accepts the order,
+    it is the internal key everywhere in the engine and the time priority
+    tiebreaker (lower id = arrived first). external_id is the UUID the API
+    handed out, only orders placed through the API carry one
+
+    peg_offset is set on pegged orders, their price follows the ticker's peg
+    reference (reference + offset) and is updated by the order book
+    """
+
+    __slots__ = (
+        "id",
+        "external_id",
+        "price",
+        "quantity",
+        "ticker",
+        "side",
+        "user_id",
+        "created_at",
+        "peg_offset",
+    )
+
+    def __init__(
+        self,
+        price: float,
+        quantity: int,
+        ticker: str,
+        side: OrderSide,
+        user_id: str,
+        id: Optional[int] = None,
+        external_id: Optional[UUID] = None,
+        created_at: Optional[float] = None,
+        peg_offset: Optional[float] = None,
+    ):
+        self.price = price
+        self.quantity = quantity
+        self.ticker = ticker
+        self.side = side
+        self.user_id = user_id
+        self.id = id
+        self.external_id = external_id
+        self.created_at = created_at if created_at is not None else time.time()
+        self.peg_offset = peg_offset
+
+    def __repr__(self) -> str:
+        return (
+            f"BookOrder(id={self.id}, {self.side.value} {self.quantity} "
+            f"{self.ticker} @ {self.price}, user_id={self.user_id})"
+        )
+
+    @classmethod
+    def from_model(cls, model: OrderModel) -> "BookOrder":
+        """Take an already validated API order into the engine"""
+        created_at = model.created_at
+        if created_at.tzinfo is None:
+            # OrderModel defaults to a naive utcnow()
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return cls(
+            price=model.price,
+            quantity=model.quantity,
+            ticker=model.ticker,
+            side=model.side,
+            user_id=model.user_id,
+            external_id=model.id,
+            created_at=created_at.timestamp(),
+        )
+
+    @property
+    def public_id(self) -> str:
+        """Id shown to clients, the API UUID when there is one"""
+        if self.external_id is not None:
+            return str(self.external_id)
+        return str(self.id)
+
+    def created_at_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.created_at, tz=timezone.utc)
+
+    def to_model(self) -> OrderModel:
+        """Hand the order back to the API without running validation again"""
+        return OrderModel.model_construct(
+            price=self.price,
+            quantity=self.quantity,
+            ticker=self.ticker,
+            side=self.side,
+            user_id=self.user_id,
+            id=self.external_id,
+            created_at=self.created_at_datetime(),
+        )
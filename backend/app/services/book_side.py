@@ -0,0 +1,194 @@
+import bisect
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from app.services.book_order import BookOrder
+
+
+class PriceLevel:
+    """
+    All resting orders at a single price, kept in arrival (FIFO) order
+
+    orders is an OrderedDict keyed by order id, which is a dict on top of a
+    doubly linked list: popping the head and unlinking any order by id are O(1)
+    ids are sequence numbers handed out on arrival, so the queue is in
+    ascending id order, except for pegged orders which join the back of a
+    level again whenever they are repriced
+
+    quantity is the running total resting at this price (L2 depth), it is
+    kept up to date on every add, fill and cancel
+    """
+
+    def __init__(self, price: float):
+        self.price = price
+        self.orders: "OrderedDict[int, BookOrder]" = OrderedDict()
+        self.quantity = 0
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __iter__(self) -> Iterator[BookOrder]:
+        return iter(self.orders.values())
+
+    def append(self, order: BookOrder) -> None:
+        self.orders[order.id] = order
+        self.quantity += order.quantity
+
+    def head(self) -> Optional[BookOrder]:
+        if not self.orders:
+            return None
+        return next(iter(self.orders.values()))
+
+    def popleft(self) -> BookOrder:
+        order = self.orders.popitem(last=False)[1]
+        self.quantity -= order.quantity
+        return order
+
+    def remove(self, order_id: int) -> bool:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        self.quantity -= order.quantity
+        return True
+
+
+class BookSide:
+    """
+    One side (bids or asks) of a ticker's book as a ladder of price levels
+
+    prices is a sorted index of the live level prices, ascending for both
+    sides so bisect can be used: the best price is the last entry for bids
+    and the first for asks, and the best level inside a limit (the clamp) is
+    one bisect away. Adding or dropping a level finds its slot with a bisect
+    in O(log L) and then shifts the tail of the list, a memmove of pointers
+    that stays cheap at the ladder sizes this book sees
+
+    levels maps price -> PriceLevel (FIFO queue of orders at that price)
+
+    order_levels maps order id -> PriceLevel the order rests in, this is the
+    handle used to cancel an order without searching the ladder
+
+    version is bumped whenever an order enters, leaves or is partially filled,
+    callers use it to know when anything they cached from this side is stale
+    """
+
+    def __init__(self, is_bid: bool):
+        self.is_bid = is_bid
+        self.prices: List[float] = []
+        self.levels: Dict[float, PriceLevel] = {}
+        self.order_levels: Dict[int, PriceLevel] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.order_levels)
+
+    def __bool__(self) -> bool:
+        return bool(self.order_levels)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self.order_levels
+
+    def __iter__(self) -> Iterator[BookOrder]:
+        """Iterate resting orders in price-time priority (best first)"""
+        for level in self.iter_levels():
+            yield from level
+
+    def iter_levels(self) -> Iterator[PriceLevel]:
+        """Iterate price levels from best to worst"""
+        prices = reversed(self.prices) if self.is_bid else iter(self.prices)
+        for price in prices:
+            yield self.levels[price]
+
+    def best_level(self) -> Optional[PriceLevel]:
+        if not self.prices:
+            return None
+        best_price = self.prices[-1] if self.is_bid else self.prices[0]
+        return self.levels[best_price]
+
+    def best_order(self) -> Optional[BookOrder]:
+        level = self.best_level()
+        return level.head() if level else None
+
+    def best_level_within(self, limit: float) -> Optional[PriceLevel]:
+        """
+        Best level that is not through the limit price, found with a bisect
+        bids: highest price <= limit
+        asks: lowest price >= limit
+        """
+        if self.is_bid:
+            idx = bisect.bisect_right(self.prices, limit) - 1
+            if idx < 0:
+                return None
+        else:
+            idx = bisect.bisect_left(self.prices, limit)
+            if idx >= len(self.prices):
+                return None
+        return self.levels[self.prices[idx]]
+
+    def add(self, order: BookOrder) -> None:
+        self._insert(order)
+        self.version += 1
+
+    def _insert(self, order: BookOrder) -> None:
+        level = self.levels.get(order.price)
+        if level is None:
+            level = PriceLevel(order.price)
+            self.levels[order.price] = level
+            bisect.insort(self.prices, order.price)
+        level.append(order)
+        self.order_levels[order.id] = level
+
+    def apply(self, remove_ids: Iterable[int], add_orders: Iterable[BookOrder]) -> None:
+        """
+        Cancel and add a batch of orders as one change: the version is bumped
+        once, so caches built on this side are invalidated once per batch
+        """
+        for order_id in remove_ids:
+            self._unlink(order_id)
+        for order in add_orders:
+            self._insert(order)
+        self.version += 1
+
+    def pop_best(self) -> BookOrder:
+        """Remove and return the order at the front of the best level"""
+        level = self.best_level()
+        order = level.popleft()
+        del self.order_levels[order.id]
+        self.version += 1
+        if not level:
+            self._drop_level(level.price)
+        return order
+
+    def fill(self, order: BookOrder, quantity: int) -> bool:
+        """
+        Take quantity off a resting order, dropping it once nothing is left
+        Returns True if the order was fully filled
+        """
+        order.quantity -= quantity
+        self.order_levels[order.id].quantity -= quantity
+        self.version += 1
+        if order.quantity > 0:
+            return False
+        self.remove(order.id)
+        return True
+
+    def remove(self, order_id: int) -> bool:
+        """Cancel a resting order through its handle, O(1) unless its level empties"""
+        if not self._unlink(order_id):
+            return False
+        self.version += 1
+        return True
+
+    def _unlink(self, order_id: int) -> bool:
+        level = self.order_levels.pop(order_id, None)
+        if level is None:
+            return False
+        level.remove(order_id)
+        if not level:
+            self._drop_level(level.price)
+        return True
+
+    def _drop_level(self, price: float) -> None:
+        del self.levels[price]
+        idx = bisect.bisect_left(self.prices, price)
+        del self.prices[idx]
@@ -0,0 +1,686 @@
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import stat
+import struct
+from collections import OrderedDict
+from datetime import date, datetime
+from enum import Enum
+from typing import Callable, Dict, Iterable, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from app.core.deps import get_logger
+from app.models.news_event import NewsEvent
+from app.schemas.order import OrderCreate, OrderSide
+from app.services.execution import Execution
+from app.services.market_replica import MarketReplica, changed_states
+from app.services.news import NewsShockSimulator
+from app.services.order_book import OrderBook
+from app.services.trading_service import pending, rejected
+
+logger = get_logger(__name__)
+
+"""
+Wire format between the engine process and the API workers, over a Unix socket:
+every frame is a 4 byte length and a JSON array
+
+    ["call", call_id, method, args]      worker -> engine, call_id null for no reply
+    ["reply", call_id, ok, result]       engine -> worker, result is {type, message} if not ok
+    ["event", kind, data]                engine -> worker: execution, market or news
+
+Frames are data only, models travel as their JSON dump (see MODEL_ARGS). Both
+sides prove they know the authkey before the first frame (HMAC challenges),
+and the socket lives in a directory only the owner can enter
+"""
+HEADER = struct.Struct("!I")
+CHALLENGE_SIZE = 32
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+"""
+Methods a worker may call, TradingService's plus news and metrics
+"""
+ENGINE_METHODS = (
+    "new_order",
+    "cancel_order",
+    "amend_order",
+    "orders",
+    "order_seqs",
+    "portfolios",
+    "portfolio",
+    "add_news_ad_hoc",
+    "activate_news",
+    "metrics",
+)
+
+"""
+Method arguments rebuilt into models on the engine side, by position
+"""
+MODEL_ARGS = {
+    "new_order": {1: OrderCreate},
+    "add_news_ad_hoc": {0: NewsEvent},
+}
+
+"""
+Exceptions a worker raises again when the engine call failed with them,
+anything else becomes a RuntimeError
+"""
+REMOTE_ERRORS = {
+    error.__name__: error
+    for error in (ValueError, KeyError, LookupError, PermissionError, ConnectionError)
+}
+
+
+def _to_json(value):
+    """Values json can't encode on its own"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if hasattr(value, "item"):
+        return value.item()  # numpy scalar
+    raise TypeError(f"{type(value).__name__} can't be sent to the engine")
+
+
+def encode_frame(message) -> bytes:
+    data = json.dumps(message, default=_to_json, separators=(",", ":")).encode()
+    return HEADER.pack(len(data)) + data
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+
+def _digest(authkey: bytes, role: bytes, challenge: bytes) -> bytes:
+    # the role keeps one side's answer from being replayed as the other's
+    return hmac.new(authkey, role + challenge, hashlib.sha256).digest()
+
+
+def _decode_args(method: str, args: list) -> list:
+    args = list(args)
+    for position, model in MODEL_ARGS.get(method, {}).items():
+        if position < len(args) and args[position] is not None:
+            args[position] = model.model_validate(args[position])
+    return args
+
+
+def _encode_error(error: Exception) -> dict:
+    return {"type": type(error).__name__, "message": str(error)}
+
+
+def _decode_error(error: dict) -> Exception:
+    return REMOTE_ERRORS.get(error["type"], RuntimeError)(error["message"])
+
+
+def private_directory(path: str, create: bool = False) -> str:
+    """
+    Directory of the socket at path, refused unless only this user can enter
+    it, so no one else can bind the socket before the engine does
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+    ):
+        raise PermissionError(
+            f"{directory} must be a directory owned by this user with mode 0700"
+        )
+    return directory
+
+
+class EngineNoReply(ConnectionError):
+    """A call reached the engine but no reply came back, it may or may not have run"""
+
+
+class _Peer:
+    """One connected API worker, frames wait in a bounded queue for its writer task"""
+
+    def __init__(self, writer: asyncio.StreamWriter, max_pending: int):
+        self.writer = writer
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.tasks = set()
+        self.closed = False
+
+    def send(self, frame: bytes):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # it reconnects and starts over from a fresh snapshot
+            logger.warning("API worker fell behind the engine, disconnecting it")
+            self.close()
+
+    async def write_frames(self):
+        while not self.closed:
+            frame = await self.queue.get()
+            self.writer.write(frame)
+            if self.queue.empty():
+                await self.writer.drain()
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for task in list(self.tasks):
+            task.cancel()
+        self.writer.close()
+
+
+class EngineServer:
+    """
+    Engine process side: serves TradingService calls from the API workers and
+    streams executions, top of book / depth and news state to them
+
+    Order entry from every worker goes through the one TradingService, so all
+    workers trade against the same book. Market state is pushed every
+    MARKET_INTERVAL seconds for the tickers whose book or mid moved, a worker
+    that connects gets all of it first. Pushing only peeks at the mids, the
+    previous mid the spread clamp starts from moves every MID_INTERVAL as it
+    does under the in-process price engine
+    """
+
+    MARKET_INTERVAL = 0.1
+    MID_INTERVAL = 0.5  # the price engine's tick, see take_mids
+    MAX_PENDING = 10000  # frames waiting per API worker
+    AUTH_TIMEOUT = 5.0
+
+    def __init__(
+        self,
+        path: str,
+        authkey: bytes,
+        trading,
+        order_book,
+        instrument_manager,
+        news_engine=None,
+        metrics: Optional[Callable[[], dict]] = None,
+    ):
+        self.path = path
+        self.authkey = authkey
+        self.order_book = order_book
+        self.instrument_manager = instrument_manager
+        self.news_engine = news_engine
+        self.methods = {
+            name: getattr(trading, name)
+            for name in ENGINE_METHODS
+            if hasattr(trading, name)
+        }
+        if news_engine is not None:
+            self.methods["add_news_ad_hoc"] = news_engine.add_news_ad_hoc
+            self.methods["activate_news"] = news_engine.activate_news
+        self.methods["metrics"] = self._metrics
+        self.engine_metrics = metrics
+        self.loaded_news = len(news_engine.news_objects) if news_engine else 0
+
+        self.peers = set()
+        self.market: Dict[str, dict] = {}
+        self.news: Optional[dict] = None
+        self.server = None
+        self.loop = None
+        self.calls = 0
+        self.disconnected_slow = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        private_directory(self.path, create=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over from a previous run
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+        os.chmod(self.path, 0o600)
+        self.order_book.executions.subscribe(self._on_execution)
+        self.publish_market()
+        self.news = self._news_state()
+        logger.info(f"Engine listening on {self.path}")
+
+    async def stop(self):
+        self.order_book.executions.unsubscribe(self._on_execution)
+        for peer in list(self.peers):
+            peer.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _authenticate(self, reader, writer) -> bool:
+        """The worker answers our challenge, then we answer the one it sent along"""
+        challenge = os.urandom(CHALLENGE_SIZE)
+        writer.write(challenge)
+        answer = await asyncio.wait_for(
+            reader.readexactly(DIGEST_SIZE + CHALLENGE_SIZE), self.AUTH_TIMEOUT
+        )
+        digest, worker_challenge = answer[:DIGEST_SIZE], answer[DIGEST_SIZE:]
+        if not hmac.compare_digest(digest, _digest(self.authkey, b"worker", challenge)):
+            return False
+        writer.write(_digest(self.authkey, b"engine", worker_challenge))
+        await writer.drain()
+        return True
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = _Peer(writer, self.MAX_PENDING)
+        try:
+            if not await self._authenticate(reader, writer):
+                logger.warning("Refused an engine connection with a bad authkey")
+                return
+            self.peers.add(peer)
+            peer.send(encode_frame(("event", "market", self.market)))
+            peer.send(encode_frame(("event", "news", self.news)))
+            peer.spawn(peer.write_frames())
+            while not peer.closed:
+                _, call_id, method, args = await read_frame(reader)
+                # commands start in arrival order, order entry is queued on
+                # the matching engine before the next one is read
+                peer.spawn(self._call(peer, call_id, method, args))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error serving API worker: {e}", exc_info=True)
+        finally:
+            self.peers.discard(peer)
+            peer.close()
+
+    async def _call(self, peer: _Peer, call_id, method: str, args: tuple):
+        self.calls += 1
+        try:
+            handler = self.methods.get(method)
+            if handler is None:
+                raise ValueError(f"Unknown engine method: {method}")
+            result = handler(*_decode_args(method, args))
+            if asyncio.iscoroutine(result):
+                result = await result
+            reply = ("reply", call_id, True, result)
+        except Exception as e:
+            reply = ("reply", call_id, False, _encode_error(e))
+        if call_id is None:
+            if not reply[2]:
+                logger.error(f"Engine notification {method} failed: {reply[3]['message']}")
+            return
+        try:
+            frame = encode_frame(reply)
+        except TypeError as e:
+            # the result has a type the wire format doesn't carry
+            frame = encode_frame(("reply", call_id, False, _encode_error(RuntimeError(e))))
+        peer.send(frame)
+
+    def _broadcast(self, frame: bytes):
+        for peer in list(self.peers):
+            peer.send(frame)
+            if peer.closed:
+                self.disconnected_slow += 1
+
+    def _on_execution(self, execution: Execution):
+        """Executions are published while matching, possibly off the event loop"""
+        event = (
+            execution.seq,
+            execution.timestamp,
+            execution.ticker,
+            execution.price,
+            execution.quantity,
+            execution.taker_order_id,
+            execution.taker_user_id,
+            execution.taker_side.value,
+            execution.maker_order_id,
+            execution.maker_user_id,
+            self.order_book.public_order_id(
+                execution.taker_user_id, execution.taker_order_id
+            ),
+            self.order_book.public_order_id(
+                execution.maker_user_id, execution.maker_order_id
+            ),
+        )
+        frame = encode_frame(("event", "execution", event))
+        self.loop.call_soon_threadsafe(self._broadcast, frame)
+
+    def _tickers(self):
+        return [instrument.id for instrument in self.instrument_manager.get_all_instruments()]
+
+    def publish_market(self):
+        """Book state of every ticker whose book or mid moved since the last push"""
+        changed = changed_states(self.order_book, self._tickers(), self.market)
+        if changed and self.peers:
+            self._broadcast(encode_frame(("event", "market", changed)))
+
+    def _news_state(self) -> Optional[dict]:
+        if self.news_engine is None:
+            return None
+        return {
+            "active": sorted(self.news_engine.active_news_ids),
+            "activated": sorted(self.news_engine.activated_news_ids),
+            "sim_start_time": self.news_engine.sim_start_time,
+            "ad_hoc": list(self.news_engine.news_objects[self.loaded_news:]),
+        }
+
+    def publish_news(self):
+        news = self._news_state()
+        if news == self.news:
+            return
+        self.news = news
+        if self.peers:
+            self._broadcast(encode_frame(("event", "news", news)))
+
+    def _metrics(self) -> dict:
+        metrics = self.engine_metrics() if self.engine_metrics else {}
+        metrics["engine_server"] = {
+            "workers": len(self.peers),
+            "calls": self.calls,
+            "slow_workers_disconnected": self.disconnected_slow,
+        }
+        return metrics
+
+    def take_mids(self):
+        """Move the clamp's previous mid, which the API workers' price engines can't"""
+        for ticker in self._tickers():
+            self.order_book.mid_price(ticker)
+
+    async def run(self):
+        """Push market and news state to the API workers"""
+        self.is_running = True
+        next_mids = self.loop.time()
+        while self.is_running:
+            try:
+                if self.loop.time() >= next_mids:
+                    self.take_mids()
+                    next_mids = self.loop.time() + self.MID_INTERVAL
+                self.publish_market()
+                self.publish_news()
+                await asyncio.sleep(self.MARKET_INTERVAL)
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            except Exception as e:
+                logger.error(f"Error publishing engine state: {e}", exc_info=True)
+                await asyncio.sleep(self.MARKET_INTERVAL)
+
+
+class EngineClient:
+    """
+    API worker side of the engine process, same interface as TradingService
+
+    Calls go over the socket and wait at most CALL_TIMEOUT seconds. While the
+    engine is unreachable order entry is rejected with ENGINE_UNAVAILABLE and
+    reads raise ConnectionError, run() keeps reconnecting with backoff. An
+    order sent without a reply (timeout, connection lost) is PENDING, not
+    rejected, its fills and state still come through the user stream. Events
+    are handed to the handlers registered for their kind (see RemoteOrderBook
+    and RemoteNewsEngine)
+    """
+
+    CALL_TIMEOUT = 5.0
+    MIN_RECONNECT_SECONDS = 0.1
+    MAX_RECONNECT_SECONDS = 2.0
+
+    def __init__(self, path: str, authkey: bytes):
+        self.path = path
+        self.authkey = authkey
+        self.handlers: Dict[str, Callable] = {}
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.call_ids = itertools.count(1)
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reconnect_delay = self.MIN_RECONNECT_SECONDS
+        self.order_book = RemoteOrderBook(self)
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None
+
+    async def _session(self):
+        """One connection to the engine, returns when it drops"""
+        private_directory(self.path)
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            await self._authenticate(reader, writer)
+            self.writer = writer
+            self.reconnect_delay = self.MIN_RECONNECT_SECONDS
+            logger.info(f"Connected to engine at {self.path}")
+
+            while True:
+                message = await read_frame(reader)
+                if message[0] == "reply":
+                    _, call_id, ok, result = message
+                    future = self.pending.pop(call_id, None)
+                    if future is None or future.done():
+                        continue
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(_decode_error(result))
+                else:
+                    _, kind, data = message
+                    handler = self.handlers.get(kind)
+                    if handler is not None:
+                        handler(data)
+        finally:
+            self.writer = None
+            writer.close()
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(EngineNoReply("Engine connection lost"))
+
+    async def _authenticate(self, reader, writer):
+        """Answer the engine's challenge, and have it answer ours"""
+        challenge = os.urandom(CHALLENGE_SIZE)
+        engine_challenge = await reader.readexactly(CHALLENGE_SIZE)
+        writer.write(_digest(self.authkey, b"worker", engine_challenge) + challenge)
+        try:
+            digest = await asyncio.wait_for(
+                reader.readexactly(DIGEST_SIZE), EngineServer.AUTH_TIMEOUT
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            raise ConnectionError("Engine refused the authkey (check SECRET_KEY)")
+        if not hmac.compare_digest(digest, _digest(self.authkey, b"engine", challenge)):
+            raise ConnectionError(f"Process at {self.path} does not know the authkey")
+
+    async def run(self):
+        """Stay connected to the engine process"""
+        self.is_running = True
+        while self.is_running:
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            except (OSError, EOFError, asyncio.IncompleteReadError) as e:
+                logger.warning(f"Engine unavailable at {self.path}: {e}")
+            except Exception as e:
+                logger.error(f"Error in engine connection: {e}", exc_info=True)
+            try:
+                await asyncio.sleep(self.reconnect_delay)
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            self.reconnect_delay = min(
+                self.reconnect_delay * 2, self.MAX_RECONNECT_SECONDS
+            )
+
+    async def call(self, method: str, *args):
+        """Run method in the engine process and return its result"""
+        if self.writer is None:
+            raise ConnectionError("Engine is not connected")
+        call_id = next(self.call_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[call_id] = future
+        try:
+            self.writer.write(encode_frame(("call", call_id, method, args)))
+            await self.writer.drain()
+            return await asyncio.wait_for(future, self.CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise EngineNoReply(f"Engine did not answer {method} in time")
+        finally:
+            self.pending.pop(call_id, None)
+
+    def notify(self, method: str, *args):
+        """Run method in the engine process without waiting for it"""
+        if self.writer is None:
+            raise ConnectionError("Engine is not connected")
+        self.writer.write(encode_frame(("call", None, method, args)))
+
+    async def _order_entry(self, method: str, *args) -> dict:
+        try:
+            return await self.call(method, *args)
+        except EngineNoReply as e:
+            # the order may have reached the book, only the user stream can tell
+            return pending(str(e))
+        except ConnectionError as e:
+            return rejected("ENGINE_UNAVAILABLE", str(e))
+
+    async def new_order(self, user_id: str, order_data: OrderCreate) -> dict:
+        return await self._order_entry("new_order", user_id, order_data)
+
+    async def cancel_order(self, user_id: str, order_id: str) -> dict:
+        return await self._order_entry("cancel_order", user_id, order_id)
+
+    async def amend_order(
+        self,
+        user_id: str,
+        order_id: str,
+        price: Optional[float] = None,
+        quantity: Optional[int] = None,
+    ) -> dict:
+        return await self._order_entry("amend_order", user_id, order_id, price, quantity)
+
+    async def orders(
+        self, user_id: str, limit: Optional[int] = None, since: Optional[int] = None
+    ) -> dict:
+        return await self.call("orders", user_id, limit, since)
+
+    async def order_seqs(self, user_ids: Iterable[str]) -> Dict[str, int]:
+        return await self.call("order_seqs", list(user_ids))
+
+    async def portfolios(
+        self, user_ids: Iterable[str], prices: Optional[Dict[str, float]] = None
+    ) -> Dict[str, dict]:
+        return await self.call("portfolios", list(user_ids), prices)
+
+    async def portfolio(self, user_id: str) -> dict:
+        return await self.call("portfolio", user_id)
+
+    async def metrics(self) -> dict:
+        return await self.call("metrics")
+
+
+class RemoteOrderBook(MarketReplica, OrderBook):
+    """
+    Read-only replica of the engine process' book in an API worker
+
+    Serves what the price engine, /ws/user and the REST snapshots read: the
+    market state (see MarketReplica), executions and the public ids of
+    recently filled orders. Orders go to the engine through EngineClient,
+    never to this book
+    """
+
+    PUBLIC_IDS = 10000  # recently filled orders whose public id is kept
+
+    def __init__(self, engine: EngineClient):
+        super().__init__()
+        self.tickers: Dict[str, dict] = {}
+        self.public_ids: "OrderedDict[int, str]" = OrderedDict()
+        engine.handlers["market"] = self.apply_market
+        engine.handlers["execution"] = self.apply_execution
+
+    def _remember(self, order_id: int, public_id: str):
+        self.public_ids[order_id] = public_id
+        self.public_ids.move_to_end(order_id)
+        if len(self.public_ids) > self.PUBLIC_IDS:
+            self.public_ids.popitem(last=False)
+
+    def apply_execution(self, event: list):
+        (
+            seq,
+            timestamp,
+            ticker,
+            price,
+            quantity,
+            taker_order_id,
+            taker_user_id,
+            taker_side,
+            maker_order_id,
+            maker_user_id,
+            taker_public_id,
+            maker_public_id,
+        ) = event
+        self.last_traded_price[ticker] = price
+        self._remember(taker_order_id, taker_public_id)
+        self._remember(maker_order_id, maker_public_id)
+        self.executions.relay(
+            Execution(
+                ticker=ticker,
+                price=price,
+                quantity=quantity,
+                taker_order_id=taker_order_id,
+                taker_user_id=taker_user_id,
+                taker_side=OrderSide(taker_side),
+                maker_order_id=maker_order_id,
+                maker_user_id=maker_user_id,
+                seq=seq,
+                timestamp=timestamp,
+            )
+        )
+
+    def public_order_id(self, user_id: str, order_id: int) -> str:
+        return self.public_ids.get(order_id, str(order_id))
+
+    def match_order(self, order, is_liquidity_bot: bool = False):
+        raise RuntimeError("Orders go to the engine process, see EngineClient")
+
+    def add_order(self, order) -> None:
+        raise RuntimeError("Orders go to the engine process, see EngineClient")
+
+    def remove_order(self, order) -> bool:
+        raise RuntimeError("Orders go to the engine process, see EngineClient")
+
+
+class RemoteNewsEngine(NewsShockSimulator):
+    """
+    News as seen by an API worker: the news and factors are loaded from the
+    database as usual, which news are active (and the simulation clock) comes
+    from the engine process, where news is activated
+    """
+
+    def __init__(self, engine: EngineClient):
+        super().__init__()
+        self.engine = engine
+        self.loaded_news = list(self.news_objects)
+        engine.handlers["news"] = self.apply_state
+
+    def apply_state(self, state: Optional[dict]):
+        if state is None:
+            return
+        self.active_news_ids = set(state["active"])
+        self.activated_news_ids = set(state["activated"])
+        self.sim_start_time = state["sim_start_time"]
+        self.news_objects = self.loaded_news + [
+            NewsEvent.model_validate(news) for news in state["ad_hoc"]
+        ]
+
+    def add_news_ad_hoc(self, news_object):
+        super().add_news_ad_hoc(news_object)
+        if news_object is not None:
+            self.engine.notify("add_news_ad_hoc", news_object)
+
+    def activate_news(self, news_id: int):
+        super().activate_news(news_id)
+        self.engine.notify("activate_news", news_id)
@@ -0,0 +1,196 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from app.core.deps import get_logger
+from app.schemas.order import OrderSide
+
+logger = get_logger(__name__)
+
+
+class Execution:
+    """
+    One fill between an incoming (taker) order and a resting (maker) order
+
+    seq is assigned by the ExecutionBus and increases by one per execution,
+    a consumer that sees a gap knows it missed events
+    """
+
+    __slots__ = (
+        "seq",
+        "timestamp",
+        "ticker",
+        "price",
+        "quantity",
+        "taker_order_id",
+        "taker_user_id",
+        "taker_side",
+        "maker_order_id",
+        "maker_user_id",
+    )
+
+    def __init__(
+        self,
+        ticker: str,
+        price: float,
+        quantity: int,
+        taker_order_id: int,
+        taker_user_id: str,
+        taker_side: OrderSide,
+        maker_order_id: int,
+        maker_user_id: str,
+        seq: int = 0,
+        timestamp: Optional[float] = None,
+    ):
+        self.ticker = ticker
+        self.price = price
+        self.quantity = quantity
+        self.taker_order_id = taker_order_id
+        self.taker_user_id = taker_user_id
+        self.taker_side = taker_side
+        self.maker_order_id = maker_order_id
+        self.maker_user_id = maker_user_id
+        self.seq = seq
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def __repr__(self) -> str:
+        return (
+            f"Execution(seq={self.seq}, {self.ticker} {self.quantity} @ {self.price}, "
+            f"taker={self.taker_user_id}, maker={self.maker_user_id})"
+        )
+
+    @property
+    def maker_side(self) -> OrderSide:
+        return OrderSide.SELL if self.taker_side == OrderSide.BUY else OrderSide.BUY
+
+    def side_for(self, user_id: str) -> Optional[OrderSide]:
+        """Side user_id traded on in this execution, None if they weren't part of it"""
+        if user_id == self.taker_user_id:
+            return self.taker_side
+        if user_id == self.maker_user_id:
+            return self.maker_side
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "seq": self.seq,
+            "timestamp": self.timestamp,
+            "ticker": self.ticker,
+            "price": self.price,
+            "quantity": self.quantity,
+            "taker_order_id": self.taker_order_id,
+            "taker_user_id": self.taker_user_id,
+            "taker_side": self.taker_side.value,
+            "maker_order_id": self.maker_order_id,
+            "maker_user_id": self.maker_user_id,
+            "maker_side": self.maker_side.value,
+        }
+
+
+ExecutionCallback = Callable[[Execution], None]
+
+
+class ExecutionQueue:
+    """
+    Bounded asyncio queue fed from publish, for consumers running on an event loop
+
+    publish may be called from a threadpool worker (sync FastAPI endpoints), so
+    events are handed to the loop with call_soon_threadsafe. When the consumer
+    falls behind the oldest event is dropped and counted in dropped
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def __call__(self, execution: Execution) -> None:
+        self.loop.call_soon_threadsafe(self._put, execution)
+
+    def _put(self, execution: Execution) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(execution)
+
+    async def get(self) -> Execution:
+        return await self.queue.get()
+
+
+class ExecutionBus:
+    """
+    In-process fan-out of executions published by the matching engine
+
+    Callbacks run inline on the publishing thread and must be quick, anything
+    slow should subscribe_queue and consume on the event loop instead.
+    A failing subscriber is logged and never interrupts matching.
+
+    Subscribers either see every execution or, with user_id, only the ones that
+    user is taker or maker on. recent keeps the last TAPE_SIZE executions as a
+    trade tape
+    """
+
+    TAPE_SIZE = 1000
+
+    def __init__(self):
+        self.seq = itertools.count(1)
+        self.subscribers: List[ExecutionCallback] = []
+        self.user_subscribers: Dict[str, List[ExecutionCallback]] = {}
+        self.recent: Deque[Execution] = deque(maxlen=self.TAPE_SIZE)
+
+    def subscribe(
+        self, callback: ExecutionCallback, user_id: Optional[str] = None
+    ) -> ExecutionCallback:
+        if user_id is None:
+            self.subscribers.append(callback)
+        else:
+            self.user_subscribers.setdefault(user_id, []).append(callback)
+        return callback
+
+    def unsubscribe(
+        self, callback: ExecutionCallback, user_id: Optional[str] = None
+    ) -> None:
+        callbacks = (
+            self.subscribers
+            if user_id is None
+            else self.user_subscribers.get(user_id, [])
+        )
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if user_id is not None and not callbacks:
+            self.user_subscribers.pop(user_id, None)
+
+    def subscribe_queue(
+        self, maxsize: int = 1000, user_id: Optional[str] = None
+    ) -> ExecutionQueue:
+        """Subscribe from a coroutine, events are then awaited with queue.get()"""
+        queue = ExecutionQueue(asyncio.get_running_loop(), maxsize)
+        self.subscribe(queue, user_id)
+        return queue
+
+    def publish(self, execution: Execution) -> Execution:
+        execution.seq = next(self.seq)
+        return self.relay(execution)
+
+    def relay(self, execution: Execution) -> Execution:
+        """Deliver an execution sequenced by another bus (the engine process'), seq is kept"""
+        self.recent.append(execution)
+
+        for callback in self.subscribers:
+            self._deliver(callback, execution)
+        if self.user_subscribers:
+            for callback in self.user_subscribers.get(execution.taker_user_id, ()):
+                self._deliver(callback, execution)
+            if execution.maker_user_id != execution.taker_user_id:
+                for callback in self.user_subscribers.get(execution.maker_user_id, ()):
+                    self._deliver(callback, execution)
+        return execution
+
+    @staticmethod
+    def _deliver(callback: ExecutionCallback, execution: Execution) -> None:
+        try:
+            callback(execution)
+        except Exception as e:
+            logger.error(f"Error in execution subscriber: {e}", exc_info=True)
@@ -6,7 +6,9 @@ from app.services.instrument_manager import InstrumentManager
 
 
 class GBMManager:
-    def __init__(self, instrument_manager: InstrumentManager, news_engine=None):
+    def __init__(
+        self, instrument_manager: InstrumentManager, news_engine=None, order_book=None
+    ):
         self.instruments: list[Instrument] = instrument_manager.get_all_instruments()
         self.news_engine = news_engine
         self.gbmas_instances = {
@@ -15,6 +17,16 @@ class GBMManager:
             )
             for instrument in self.instruments
         }
+        # The GBM price is the reference pegged orders follow
+        self.order_book = order_book
+        for ticker in self.gbmas_instances:
+            self._publish_reference(ticker)
+
+    def _publish_reference(self, ticker: str):
+        if self.order_book is not None:
+            self.order_book.set_peg_reference(
+                ticker, self.get_ticker_current_gbm_price(ticker)
+            )
 
     async def run(self):
         self.is_running = True
@@ -31,6 +43,7 @@ class GBMManager:
                     
                     # This updates the current_price field of the gbm_instance
                     gbm_instance()
+                    self._publish_reference(ticker)
                 await asyncio.sleep(1)
             except asyncio.CancelledError:
                 self.is_running = False
@@ -1,12 +1,20 @@
 import asyncio
 
+from app.core.deps import get_logger
 from app.models.instrument import Instrument
-from app.schemas.order import OrderModel, OrderSide
+from app.schemas.order import OrderSide
+from app.services.execution import Execution
 from app.services.liquidity_bot import LiquidityBot
 from app.services.order_book import OrderBook
 
+logger = get_logger(__name__)
+
 
 class LiquidityBotManager:
+    # Pegged offsets within this fraction of the reference of the resting ones
+    # are kept as they are, so quote noise alone does not requote a level
+    REQUOTE_THRESHOLD = 0.001
+
     def __init__(self, instruments: list[Instrument], order_book: OrderBook, gbm_manager=None):
         # Maps instrument id to liquidity bot
         self.liquidity_bots = {
@@ -17,124 +25,112 @@ class LiquidityBotManager:
         }
         self.order_book = order_book
         self.gbm_manager = gbm_manager
-        # Track liquidity bot orders by ticker with original quantity
-        self.liquidity_bot_orders = {}
-        # Track original quantities to detect fills
-        self.original_quantities = {}
+        """(ticker, side) -> offsets of the bot's resting pegged levels, best first"""
+        self.quoted_offsets: dict[tuple[str, OrderSide], list[float]] = {}
 
-    def clear_old_liquidity_orders(self, ticker: str):
-        """
-        Remove all previous liquidity bot orders for a ticker.
-        Also update bot inventory based on filled orders.
-        """
-        if ticker not in self.liquidity_bot_orders:
-            return
-        
+        # Bots hear about their fills as they happen instead of diffing their orders
+        for ticker in self.liquidity_bots:
+            self.order_book.executions.subscribe(
+                self._on_execution, user_id=self.bot_user_id(ticker)
+            )
+
+    @staticmethod
+    def bot_user_id(ticker: str) -> str:
+        return f"liquidity_bot_{ticker}"
+
+    def _on_execution(self, execution: Execution):
+        """Apply one of a bot's fills to its inventory"""
+        ticker = execution.ticker
         liquidity_bot = self.liquidity_bots.get(ticker)
         if not liquidity_bot:
             return
-        
-        for order in self.liquidity_bot_orders[ticker]:
-            original_qty = self.original_quantities.get(order.id, order.quantity)
-            
-            # Check if order still exists in order book (might be filled)
-            if order.id in self.order_book.order_mapping:
-                current_order = self.order_book.order_mapping[order.id]
-                filled_quantity = original_qty - current_order.quantity
-                
-                if filled_quantity > 0:
-                    # Order was partially or fully filled
-                    if order.side == OrderSide.BUY:
-                        # Bot bought (inventory increases)
-                        liquidity_bot.update_inventory(filled_quantity)
-                        print(f"[{ticker}] Bot bought {filled_quantity} @ {order.price:.2f}, inventory now: {liquidity_bot.inventory}")
-                    else:
-                        # Bot sold (inventory decreases)
-                        liquidity_bot.update_inventory(-filled_quantity)
-                        print(f"[{ticker}] Bot sold {filled_quantity} @ {order.price:.2f}, inventory now: {liquidity_bot.inventory}")
-                
-                # Remove the order
-                try:
-                    self.order_book.remove_order(order)
-                except Exception:
-                    pass
-            else:
-                # Order was fully filled and removed
-                if order.side == OrderSide.BUY:
-                    liquidity_bot.update_inventory(original_qty)
-                    print(f"[{ticker}] Bot bought {original_qty} @ {order.price:.2f}, inventory now: {liquidity_bot.inventory}")
-                else:
-                    liquidity_bot.update_inventory(-original_qty)
-                    print(f"[{ticker}] Bot sold {original_qty} @ {order.price:.2f}, inventory now: {liquidity_bot.inventory}")
-            
-            # Clean up tracked quantity
-            if order.id in self.original_quantities:
-                del self.original_quantities[order.id]
-        
-        self.liquidity_bot_orders[ticker] = []
+
+        side = execution.side_for(self.bot_user_id(ticker))
+        if side == OrderSide.BUY:
+            # Bot bought (inventory increases)
+            liquidity_bot.update_inventory(execution.quantity)
+            logger.debug(f"[{ticker}] Bot bought {execution.quantity} @ {execution.price:.2f}, inventory now: {liquidity_bot.inventory}")
+        elif side == OrderSide.SELL:
+            # Bot sold (inventory decreases)
+            liquidity_bot.update_inventory(-execution.quantity)
+            logger.debug(f"[{ticker}] Bot sold {execution.quantity} @ {execution.price:.2f}, inventory now: {liquidity_bot.inventory}")
 
     def process_book_snapshot(self, snapshot: dict):
+        """
+        Swap the bot's resting quotes for the new snapshot in one book update
+        When the book has a peg reference for the ticker (the GBM price) the
+        levels are placed as pegged orders at their offset from it, they then
+        follow the reference on their own and only change when the bot's offsets
+        move by more than REQUOTE_THRESHOLD (see _stable_offsets).
+        Levels that did not change stay in the book, fills were already applied
+        to the bot's inventory by _on_execution
+        """
         ticker = snapshot["instrumentId"]
-        
-        # Clear old liquidity bot orders for this ticker
-        self.clear_old_liquidity_orders(ticker)
-        
-        # Add new orders using is_liquidity_bot=True to prevent matching
-        for bid_price, depth in snapshot["bids"]:
-            order = OrderModel(
-                price=bid_price,
-                quantity=depth,
-                side=OrderSide.BUY,
-                user_id=f"liquidity_bot_{ticker}",
-                ticker=ticker,
-            )
-            # Use is_liquidity_bot=True to add directly to book without matching
-            self.order_book.match_order(order, is_liquidity_bot=True)
-            
-            # Track this order and its original quantity
-            if ticker not in self.liquidity_bot_orders:
-                self.liquidity_bot_orders[ticker] = []
-            self.liquidity_bot_orders[ticker].append(order)
-            self.original_quantities[order.id] = depth
-            
-        for ask_price, depth in snapshot["asks"]:
-            order = OrderModel(
-                price=ask_price,
-                quantity=depth,
-                side=OrderSide.SELL,
-                user_id=f"liquidity_bot_{ticker}",
-                ticker=ticker,
-            )
-            # Use is_liquidity_bot=True to add directly to book without matching
-            self.order_book.match_order(order, is_liquidity_bot=True)
-            
-            # Track this order and its original quantity
-            if ticker not in self.liquidity_bot_orders:
-                self.liquidity_bot_orders[ticker] = []
-            self.liquidity_bot_orders[ticker].append(order)
-            self.original_quantities[order.id] = depth
+        if ticker not in self.liquidity_bots:
+            return
+
+        bids = snapshot["bids"]
+        asks = snapshot["asks"]
+        reference = self.order_book.peg_references.get(ticker)
+        if reference is not None:
+            bids = self._stable_offsets(ticker, OrderSide.BUY, bids, reference)
+            asks = self._stable_offsets(ticker, OrderSide.SELL, asks, reference)
+        else:
+            self.quoted_offsets.pop((ticker, OrderSide.BUY), None)
+            self.quoted_offsets.pop((ticker, OrderSide.SELL), None)
+
+        self.order_book.replace_quotes(
+            self.bot_user_id(ticker),
+            ticker,
+            bids,
+            asks,
+            pegged=reference is not None,
+        )
+
+    def _stable_offsets(
+        self, ticker: str, side: OrderSide, ladder: list, reference: float
+    ) -> list:
+        """
+        Turn a [price, depth] ladder into [offset, depth] from the reference,
+        keeping the previous offset of a level when the new one is within
+        REQUOTE_THRESHOLD of it so replace_quotes leaves that level alone
+        """
+        previous = self.quoted_offsets.get((ticker, side), [])
+        threshold = abs(reference) * self.REQUOTE_THRESHOLD
+        offsets = []
+        for level, (price, depth) in enumerate(ladder):
+            offset = round(price - reference, 2)
+            if level < len(previous) and abs(offset - previous[level]) <= threshold:
+                offset = previous[level]
+            offsets.append([offset, depth])
+        self.quoted_offsets[(ticker, side)] = [offset for offset, _ in offsets]
+        return offsets
+
+    def quote_all(self):
+        """Requote every bot once"""
+        for ticker, liquidity_bot in self.liquidity_bots.items():
+            # Update liquidity bot mid price from GBM (which includes news drift)
+            if self.gbm_manager:
+                gbm_price = self.gbm_manager.get_ticker_current_gbm_price(ticker)
+                if gbm_price is not None:
+                    liquidity_bot.adjust_mid_price(gbm_price)
+
+            # drift_term = 0 for liquidity bots (they don't respond to news directly)
+            # News affects them through GBM price updates above
+            book_snapshot = liquidity_bot.generate_order_book(0)
+            logger.debug(f"Liquidity bot generated snapshot for {ticker}: {book_snapshot}")
+            self.process_book_snapshot(book_snapshot)
 
     async def run(self):
         self.is_running = True
         while self.is_running:
             try:
-                for ticker, liquidity_bot in self.liquidity_bots.items():
-                    # Update liquidity bot mid price from GBM (which includes news drift)
-                    if self.gbm_manager:
-                        gbm_price = self.gbm_manager.get_ticker_current_gbm_price(ticker)
-                        liquidity_bot.adjust_mid_price(gbm_price)
-                    
-                    # drift_term = 0 for liquidity bots (they don't respond to news directly)
-                    # News affects them through GBM price updates above
-                    book_snapshot = liquidity_bot.generate_order_book(0)
-                    print("Liquidity bot generated snapshot for", ticker)
-                    print(book_snapshot)
-                    self.process_book_snapshot(book_snapshot)
+                self.quote_all()
                 # Update every 0.5 seconds for fast price reaction to trades
                 await asyncio.sleep(0.5)
             except asyncio.CancelledError:
                 self.is_running = False
                 break
             except Exception as e:
-                print(f"Error in liquidity bot manager: {e}")
+                logger.error(f"Error in liquidity bot manager: {e}", exc_info=True)
                 await asyncio.sleep(0.5)
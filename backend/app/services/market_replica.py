@@ -0,0 +1,98 @@
+from typing import Dict, Iterable, Optional
+
+from app.schemas.order import OrderSide
+from app.services.book_order import BookOrder
+
+
+def ticker_state(order_book, ticker: str, mid: Optional[float]) -> dict:
+    """Everything a MarketReplica serves for one ticker, read from the book that owns it"""
+    best_bid = order_book.best_bid(ticker)
+    best_ask = order_book.best_ask(ticker)
+    snapshot = order_book.depth_snapshot(ticker)
+    return {
+        "version": snapshot["version"],
+        "has_ticker": order_book.has_ticker(ticker),
+        "mid": mid,
+        "spread": order_book.clamped_spread(ticker),
+        "best_bid": (best_bid.price, best_bid.quantity) if best_bid else None,
+        "best_ask": (best_ask.price, best_ask.quantity) if best_ask else None,
+        "bids": snapshot["bids"],
+        "asks": snapshot["asks"],
+    }
+
+
+def changed_states(
+    order_book, tickers: Iterable[str], reported: Dict[str, dict]
+) -> Dict[str, dict]:
+    """
+    State of every ticker whose book or mid moved since it was last reported,
+    reported is updated. Reads only, the mid is peeked so the clamp's previous
+    mid stays where the owner's own ticks put it
+    """
+    changed = {}
+    for ticker in tickers:
+        version = order_book.book_version(ticker)
+        mid = order_book.peek_mid_price(ticker)
+        state = reported.get(ticker)
+        if state is not None and state["version"] == version and state["mid"] == mid:
+            continue
+        changed[ticker] = ticker_state(order_book, ticker, mid)
+    reported.update(changed)
+    return changed
+
+
+class MarketReplica:
+    """
+    Book reads (top of book, mid, clamped spread, book versions and L2 depth
+    to SNAPSHOT_MAX_DEPTH levels) answered from ticker states pushed by the
+    process that owns the book, so reading never waits on that process.
+    Mixed into an OrderBook subclass that sets self.tickers = {}
+    """
+
+    tickers: Dict[str, dict]
+
+    def apply_market(self, states: Dict[str, dict]):
+        self.tickers.update(states)
+
+    def has_ticker(self, ticker: str) -> bool:
+        state = self.tickers.get(ticker)
+        return bool(state and state["has_ticker"])
+
+    def book_version(self, ticker: str) -> int:
+        state = self.tickers.get(ticker)
+        return state["version"] if state else 0
+
+    def mid_price(self, ticker: str) -> Optional[float]:
+        state = self.tickers.get(ticker)
+        return state["mid"] if state else None
+
+    def peek_mid_price(self, ticker: str) -> Optional[float]:
+        return self.mid_price(ticker)
+
+    def clamped_spread(self, ticker: str) -> Optional[float]:
+        state = self.tickers.get(ticker)
+        return state["spread"] if state else None
+
+    def _top(self, ticker: str, key: str, side: OrderSide) -> Optional[BookOrder]:
+        state = self.tickers.get(ticker)
+        if not state or state[key] is None:
+            return None
+        price, quantity = state[key]
+        return BookOrder(price=price, quantity=quantity, ticker=ticker, side=side, user_id="")
+
+    def best_bid(self, ticker: str) -> Optional[BookOrder]:
+        return self._top(ticker, "best_bid", OrderSide.BUY)
+
+    def best_ask(self, ticker: str) -> Optional[BookOrder]:
+        return self._top(ticker, "best_ask", OrderSide.SELL)
+
+    def depth_snapshot(self, ticker: str, depth: Optional[int] = None) -> dict:
+        depth = min(depth or self.SNAPSHOT_MAX_DEPTH, self.SNAPSHOT_MAX_DEPTH)
+        state = self.tickers.get(ticker)
+        if not state:
+            return {"version": 0, "bids": [], "asks": []}
+        return {
+            "version": state["version"],
+            "bids": state["bids"][:depth],
+            "asks": state["asks"][:depth],
+        }
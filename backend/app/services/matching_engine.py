@@ -0,0 +1,121 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from app.core.deps import get_logger
+
+logger = get_logger(__name__)
+
+Command = Tuple[Callable[..., Any], tuple, dict, asyncio.Future]
+
+
+class MatchingEngine:
+    """
+    Single writer for the order book. Order entry from the API and the user
+    WebSocket is queued as commands and applied one after another on the
+    event loop, callers await the result through a future.
+
+    The loop drains up to max_batch commands per wakeup so bursts are matched
+    back to back without yielding in between. Background tasks that already
+    run on the event loop (bots, generator, archiver) are serialized with the
+    engine by the loop itself. The order endpoints are async and, like
+    /ws/user, await execute(), nothing may mutate the book from threadpool
+    workers.
+
+    Commands may be coroutine functions, they are awaited in turn. On an
+    in-process book they never suspend (see OrderBook.match_order_async), so
+    a batch still runs without yielding.
+
+    The queue is bounded by max_queue, execute() raises asyncio.QueueFull
+    once it is reached so callers can shed load instead of queueing forever
+    """
+
+    def __init__(self, max_batch: int = 256, max_queue: int = 10000):
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.queue: Optional[asyncio.Queue] = None
+        self.is_running = False
+        self.processed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.busy_seconds = 0.0
+
+    def _queue(self) -> asyncio.Queue:
+        # created on first use so it belongs to the running loop
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+        return self.queue
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> asyncio.Future:
+        """Queue fn(*args, **kwargs), returns the future for its result"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue().put_nowait((fn, args, kwargs, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        return future
+
+    async def execute(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the engine and wait for its result"""
+        return await self.submit(fn, *args, **kwargs)
+
+    def _next_batch(self, first: Command) -> List[Command]:
+        batch = [first]
+        queue = self._queue()
+        while len(batch) < self.max_batch and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    async def _apply(self, batch: List[Command]):
+        started = time.perf_counter()
+        for fn, args, kwargs, future in batch:
+            if future.cancelled():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+        self.busy_seconds += time.perf_counter() - started
+        self.processed += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "busy_seconds": round(self.busy_seconds, 6),
+        }
+
+    async def run(self):
+        self.is_running = True
+        queue = self._queue()
+        while self.is_running:
+            try:
+                batch = self._next_batch(await queue.get())
+                await self._apply(batch)
+                # let the callers and the other loop tasks run between batches
+                await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            except Exception as e:
+                logger.error(f"Error in matching engine: {e}", exc_info=True)
+                await asyncio.sleep(0.01)
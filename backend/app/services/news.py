@@ -159,6 +159,10 @@ class NewsShockSimulator:
         # News added ad-hoc are immediately active
         self.active_news_ids.add(news_object.id)
 
+    def activate_news(self, news_id: int):
+        """Manually activate a news event"""
+        self.active_news_ids.add(news_id)
+
     def update_simulation_time(self):
         """Update simulation time based on real elapsed time"""
         elapsed_real_seconds = time.time() - self.sim_start_time
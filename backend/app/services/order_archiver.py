@@ -0,0 +1,47 @@
+import asyncio
+
+from app.core.deps import get_logger
+from app.services.order_book import OrderBook
+
+logger = get_logger(__name__)
+
+
+class OrderArchiver:
+    """
+    Periodically moves filled and cancelled orders out of the order book's
+    hot dicts (see OrderBook.archive_terminal_orders) so memory tracks the
+    number of live orders rather than every order placed in the session.
+    A retention of 0 or less disables archiving
+    """
+
+    def __init__(
+        self,
+        order_book: OrderBook,
+        retention_seconds: float,
+        interval_seconds: float,
+    ):
+        self.order_book = order_book
+        self.retention_seconds = retention_seconds
+        self.interval_seconds = interval_seconds
+        self.is_running = False
+
+    def archive(self) -> dict:
+        return self.order_book.archive_terminal_orders(self.retention_seconds)
+
+    async def run(self):
+        if self.retention_seconds <= 0:
+            logger.info("Order archiving disabled")
+            return
+        self.is_running = True
+        while self.is_running:
+            try:
+                moved = self.archive()
+                if any(moved.values()):
+                    logger.debug(f"Archived {moved}")
+                await asyncio.sleep(self.interval_seconds)
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            except Exception as e:
+                logger.error(f"Error archiving orders: {e}", exc_info=True)
+                await asyncio.sleep(self.interval_seconds)
@@ -1,8 +1,16 @@
-import heapq
-from collections import defaultdict
-from typing import Dict, List, Optional, Set, Tuple
+import itertools
+import json
+import time
+from collections import defaultdict, deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
+from uuid import UUID
 
 from app.schemas.order import OrderModel, OrderSide, OrderStatus
+from app.services.book_order import BookOrder
+from app.services.book_side import BookSide
+from app.services.execution import Execution, ExecutionBus
+from app.services.order_log import FILLED, OrderLog
 from app.services.user import UserState
 
 
@@ -20,39 +28,48 @@ class OrderBook:
 
     def __init__(self):
         """
-        Use heap to always get the best bid / best ask first
+        Each ticker has a ladder of price levels per side (see BookSide)
         Refer to "Number of items in backlog" for reference
 
         Mapping is
-        ticker -> HEAP of orders
+        ticker -> BookSide
 
-        buys will be max heap (to get highest bid)
-        -> (-price, quantity, <ORDER_OBJ>)
+        price levels are kept in a sorted price index so the best bid / best
+        ask is O(1) and a price level (or the best one inside the clamp) is
+        found with an O(log L) bisect
 
-        sells will be min heap (to get lowest ask)
-        -> (price, quantity, <ORDER_OBJ>)
+        each price level holds a FIFO queue of orders (price-time priority)
+        """
+        self.buys: Dict[str, BookSide] = {}
+        self.sells: Dict[str, BookSide] = {}
 
-        price is index 0
-        quantity is index 1
-        order object is index 2
         """
-        self.buys: Dict[str, List[Tuple[float, int, OrderModel]]] = {}
-        self.sells: Dict[str, List[Tuple[float, int, OrderModel]]] = {}
+        Every accepted order gets the next sequence number as its id
+        Ids are plain ints (cheap to hash and compare) and give price-time
+        priority a deterministic tiebreaker
+        """
+        self.order_seq = itertools.count(1)
+
+        """
+        API order UUID -> internal id, only orders placed through the API
+        """
+        self.external_ids: Dict[UUID, int] = {}
 
         """
         Order mapping gives us quick access if we have order id 
         """
-        self.order_mapping: Dict[str, OrderModel] = {}
+        self.order_mapping: Dict[int, BookOrder] = {}
         
         """
-        All orders ever placed (for history tracking)
+        Per trader order history (see OrderLog), status is kept up to date as
+        orders fill or get cancelled so history reads don't touch the book
         """
-        self.all_orders: Dict[str, OrderModel] = {}
+        self.order_logs: Dict[str, OrderLog] = {}
 
         """
         Trader mapping gives us quick access if we have trader id 
         """
-        self.trader_mapping: Dict[str, Set[str]] = {}
+        self.trader_mapping: Dict[str, Set[int]] = {}
 
         """
         User state mapping gives us quick access to user state
@@ -62,7 +79,24 @@ class OrderBook:
         """
         Gives us quick check if order is fulfilled 
         """
-        self.fulfilled_orders: Set[str] = set()
+        self.fulfilled_orders: Set[int] = set()
+
+        """
+        Every fill is published here as an Execution once the book and user
+        state reflect it (see ExecutionBus)
+        """
+        self.executions = ExecutionBus()
+
+        """
+        (time, order id, user id) of orders that were filled or cancelled, oldest
+        first. archive_terminal_orders drains it to drop them from the hot dicts
+        """
+        self.terminal_orders: Deque[Tuple[float, int, str]] = deque()
+
+        """
+        Users with fills since the last sweep, only their fills are archived
+        """
+        self.users_with_fills: Set[str] = set()
 
         """
         Used to compute clamp 
@@ -76,11 +110,40 @@ class OrderBook:
         self.CLAMPED_DELTA_COEFF: float = 2.5
 
         """
-        Indices used to access heap 
+        (ticker, side) -> (side version, clamp price, best order within clamp)
         """
-        self.PRICE_IDX = 0
-        self.QUANTITY_IDX = 1
-        self.ORDER_OBJ_IDX = 2
+        self.clamp_cache: Dict[
+            Tuple[str, OrderSide], Tuple[int, float, Optional[BookOrder]]
+        ] = {}
+
+        """
+        Depth snapshots, materialized once per book version
+        ticker -> {"version", "bids", "asks"} aggregated to SNAPSHOT_MAX_DEPTH levels
+        (ticker, depth) -> (version, mid price, serialized JSON bytes)
+        """
+        self.SNAPSHOT_MAX_DEPTH = 20
+        self.snapshot_cache: Dict[str, dict] = {}
+        self.snapshot_json_cache: Dict[
+            Tuple[str, int], Tuple[int, Optional[float], bytes]
+        ] = {}
+
+        """
+        Resting quotes placed through replace_quotes
+        (owner, ticker) -> side -> price -> (order, quantity quoted or left at the last replace)
+        """
+        self.quotes: Dict[
+            Tuple[str, str], Dict[OrderSide, Dict[float, Tuple[BookOrder, int]]]
+        ] = {}
+
+        """
+        Pegged orders rest in the normal ladders at reference + peg_offset
+        peg_references: ticker -> reference price (the GBM price, see GBMManager)
+        pegged_orders: ticker -> order id -> resting pegged order
+        Pegs are repriced when the reference moves (a write), reads of the book
+        never change it
+        """
+        self.peg_references: Dict[str, float] = {}
+        self.pegged_orders: Dict[str, Dict[int, BookOrder]] = {}
 
     def _get_user_state(self, user_id: str) -> UserState:
         # init user if not exist
@@ -106,63 +169,181 @@ class OrderBook:
         }
 
         user_state.add_fulfilled_trades(trade)
+        self.users_with_fills.add(user_id)
 
         if side == OrderSide.BUY:
             user_state.cash -= quantity * price
         else:
             user_state.cash += quantity * price
 
-    def _get_book(
-        self, ticker: str, side: OrderSide
-    ) -> List[Tuple[float, int, OrderModel]]:
-        """Helper to get or init the correct per-ticker list."""
+    def _get_book(self, ticker: str, side: OrderSide) -> BookSide:
+        """Helper to get or init the correct per-ticker side."""
         if side == OrderSide.BUY:
             if ticker not in self.buys:
-                self.buys[ticker] = []
+                self.buys[ticker] = BookSide(is_bid=True)
             return self.buys[ticker]
         else:
             if ticker not in self.sells:
-                self.sells[ticker] = []
+                self.sells[ticker] = BookSide(is_bid=False)
             return self.sells[ticker]
 
-    def get_bids(self, ticker: str):
-        return [
-            entry[self.ORDER_OBJ_IDX]
-            for entry in sorted(self.buys.get(ticker, []), key=lambda x: -x[0])
-        ]
+    def get_bids(self, ticker: str) -> List[BookOrder]:
+        return list(self.buys.get(ticker, ()))
 
-    def get_asks(self, ticker: str):
-        return [
-            entry[self.ORDER_OBJ_IDX]
-            for entry in sorted(self.sells.get(ticker, []), key=lambda x: x[0])
-        ]
+    def get_asks(self, ticker: str) -> List[BookOrder]:
+        return list(self.sells.get(ticker, ()))
 
     def has_ticker(self, ticker: str) -> bool:
         return ticker in self.buys or ticker in self.sells
 
-    def _add_order_to_trader_mapping(self, order: OrderModel, execution_price: float = None):
+    def book_version(self, ticker: str) -> int:
+        """
+        Monotonically increasing version of a ticker's book
+        Both side versions only ever grow, so their sum does too
+        """
+        version = 0
+        if ticker in self.buys:
+            version += self.buys[ticker].version
+        if ticker in self.sells:
+            version += self.sells[ticker].version
+        return version
+
+    @staticmethod
+    def _aggregate_levels(book: Optional[BookSide], depth: int) -> List[dict]:
+        """L2 view: total quantity and order count per price, best first"""
+        if book is None:
+            return []
+        return [
+            {"price": level.price, "quantity": level.quantity, "orders": len(level)}
+            for level in islice(book.iter_levels(), depth)
+        ]
+
+    def depth_snapshot(self, ticker: str, depth: Optional[int] = None) -> dict:
+        """
+        Aggregated top-N bid / ask levels for a ticker
+        Levels are rebuilt only when the book version moves, every other call
+        slices the cached ladders
+        """
+        depth = min(depth or self.SNAPSHOT_MAX_DEPTH, self.SNAPSHOT_MAX_DEPTH)
+        version = self.book_version(ticker)
+
+        cached = self.snapshot_cache.get(ticker)
+        if cached is None or cached["version"] != version:
+            cached = {
+                "version": version,
+                "bids": self._aggregate_levels(
+                    self.buys.get(ticker), self.SNAPSHOT_MAX_DEPTH
+                ),
+                "asks": self._aggregate_levels(
+                    self.sells.get(ticker), self.SNAPSHOT_MAX_DEPTH
+                ),
+            }
+            self.snapshot_cache[ticker] = cached
+
+        return {
+            "version": version,
+            "bids": cached["bids"][:depth],
+            "asks": cached["asks"][:depth],
+        }
+
+    def depth_snapshot_json(
+        self, ticker: str, depth: int, mid_price: Optional[float]
+    ) -> bytes:
+        """
+        Serialized REST snapshot (mid, top of book and depth) for a ticker
+        The bytes are reused by every request until the book or the mid changes
+        """
+        version = self.book_version(ticker)
+        key = (ticker, depth)
+        cached = self.snapshot_json_cache.get(key)
+        if cached and cached[0] == version and cached[1] == mid_price:
+            return cached[2]
+
+        best_bid = self.best_bid(ticker)
+        best_ask = self.best_ask(ticker)
+        snapshot = self.depth_snapshot(ticker, depth)
+        payload = {
+            "symbol": ticker,
+            "version": version,
+            "mid_price": mid_price,
+            "best_bid": (
+                {"price": best_bid.price, "quantity": best_bid.quantity}
+                if best_bid
+                else None
+            ),
+            "best_ask": (
+                {"price": best_ask.price, "quantity": best_ask.quantity}
+                if best_ask
+                else None
+            ),
+            "bids": snapshot["bids"],
+            "asks": snapshot["asks"],
+        }
+        encoded = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        self.snapshot_json_cache[key] = (version, mid_price, encoded)
+        return encoded
+
+    @staticmethod
+    def _to_book_order(order: Union[OrderModel, BookOrder]) -> BookOrder:
+        """API orders are converted once on the way in, engine callers pass BookOrder"""
+        if isinstance(order, BookOrder):
+            return order
+        return BookOrder.from_model(order)
+
+    def _accept_order(self, order: BookOrder) -> None:
+        """Assign the next sequence number to an order entering the book"""
+        if order.id is not None:
+            return
+        order.id = next(self.order_seq)
+        if order.external_id is not None:
+            self.external_ids[order.external_id] = order.id
+
+    def _resolve_order_id(self, order: Union[OrderModel, BookOrder]) -> Optional[int]:
+        """Internal id for an engine order, or for an API order through its UUID"""
+        if isinstance(order, BookOrder):
+            if order.id is not None:
+                return order.id
+            return self.external_ids.get(order.external_id)
+        return self.external_ids.get(order.id)
+
+    def find_order(self, external_id: UUID) -> Optional[BookOrder]:
+        """Engine order for the UUID the API handed out, None once archived"""
+        order_id = self.external_ids.get(external_id)
+        if order_id is None:
+            return None
+        return self.order_mapping.get(order_id)
+
+    def public_order_id(self, user_id: str, order_id: int) -> str:
+        """Id a client knows one of user_id's orders by (see BookOrder.public_id)"""
+        order_log = self.order_logs.get(user_id)
+        row = order_log.get(order_id) if order_log is not None else None
+        return row["order_id"] if row else str(order_id)
+
+    def _add_order_to_trader_mapping(
+        self,
+        order: BookOrder,
+        quantity: int,
+        execution_price: float = None,
+        filled_quantity: int = 0,
+    ):
         user_id = order.user_id
         if user_id not in self.trader_mapping:
             self.trader_mapping[user_id] = set()
         self.trader_mapping[user_id].add(order.id)
-        # Store a copy with execution price if provided, otherwise original
-        if execution_price and execution_price > 0:
-            order_copy = OrderModel(
-                id=order.id,
-                price=execution_price,
-                quantity=order.quantity,
-                ticker=order.ticker,
-                side=order.side,
-                user_id=order.user_id,
-            )
-            self.all_orders[order.id] = order_copy
-        else:
-            self.all_orders[order.id] = order
+        # History shows the execution price if there was a fill, otherwise the limit price
+        if user_id not in self.order_logs:
+            self.order_logs[user_id] = OrderLog()
+        price = execution_price if execution_price and execution_price > 0 else order.price
+        self.order_logs[user_id].append(order, quantity, price, filled_quantity)
+
+    def _track_open_order(self, order: BookOrder) -> None:
+        """Add a resting user order to the user's unfulfilled trades"""
+        self._get_user_state(order.user_id).add_unfulfilled_trade(order)
 
-    def _get_trader_orders(self, user_id: str) -> Set[str]:
+    def _get_trader_orders(self, user_id: str) -> Set[int]:
         return self.trader_mapping.get(user_id, set())
 
-    def get_trader_unfulfilled_orders(self, user_id: str) -> List[OrderModel]:
+    def get_trader_unfulfilled_orders(self, user_id: str) -> List[BookOrder]:
         trader_orders = self._get_trader_orders(user_id)
 
         # here we take the set difference to get unfulfilled orders
@@ -170,10 +351,12 @@ class OrderBook:
 
         unfulfilled_orders = []
         for unfulfilled_order_id in unfulfilled_order_ids:
-            unfulfilled_orders.append(self.order_mapping[unfulfilled_order_id])
+            # archived orders have left order_mapping
+            if unfulfilled_order_id in self.order_mapping:
+                unfulfilled_orders.append(self.order_mapping[unfulfilled_order_id])
         return unfulfilled_orders
 
-    def get_trader_fulfilled_orders(self, user_id: str) -> List[OrderModel]:
+    def get_trader_fulfilled_orders(self, user_id: str) -> List[BookOrder]:
         trader_orders = self._get_trader_orders(user_id)
 
         # here we take the set intersection to get fulfilled orders
@@ -181,83 +364,138 @@ class OrderBook:
 
         fulfilled_orders = []
         for fulfilled_order_id in fulfilled_order_ids:
-            fulfilled_orders.append(self.order_mapping[fulfilled_order_id])
+            if fulfilled_order_id in self.order_mapping:
+                fulfilled_orders.append(self.order_mapping[fulfilled_order_id])
         return fulfilled_orders
 
     def get_portfolio(self, user_id: str):
-        # note we do not delete from the map to maintain a history of orders
+        """
+        Net position per ticker for one user, read from the user's incrementally
+        maintained positions so the cost is O(that user's tickers) rather than a
+        scan of every fill in the market
+        """
         portfolio = defaultdict(int)
-        for fulfilled_order_id in list(self.fulfilled_orders):
-            current_order = self.order_mapping[fulfilled_order_id]
-            if current_order.user_id == user_id:
-                if current_order.side == OrderSide.BUY:
-                    portfolio[current_order.ticker] += current_order.quantity
-                else:
-                    portfolio[current_order.ticker] -= current_order.quantity
+        user_state = self.user_state_mapping.get(user_id)
+        if user_state is None:
+            return portfolio
+        for ticker, position in user_state.positions.items():
+            if position:
+                portfolio[ticker] = position
         return portfolio
 
-    def get_trader_orders_with_status(self, user_id: str) -> List[dict]:
-        """Return all orders for a trader with proper status (open/partially_filled/filled), sorted by timestamp."""
-        orders: List[dict] = []
-        for order_id in self._get_trader_orders(user_id):
-            # Get order from all_orders (includes filled orders)
-            if order_id not in self.all_orders:
-                continue
-            original_order = self.all_orders[order_id]
-            
-            # Determine status
-            if order_id in self.fulfilled_orders:
-                status = "filled"
-                remaining_qty = 0
-            elif order_id in self.order_mapping:
-                current_order = self.order_mapping[order_id]
-                if current_order.quantity < original_order.quantity:
-                    status = "partially_filled"
-                else:
-                    status = "open"
-                remaining_qty = current_order.quantity
-            else:
-                # Order no longer in book but not in fulfilled - probably cancelled
-                continue
-            
-            orders.append(
-                {
-                    "order_id": str(original_order.id),
-                    "symbol": original_order.ticker,
-                    "quantity": original_order.quantity,
-                    "filled_quantity": original_order.quantity - remaining_qty,
-                    "price": original_order.price,
-                    "type": original_order.side.value,
-                    "status": status,
-                    "created_at": original_order.created_at.isoformat() if hasattr(original_order, 'created_at') else None,
-                }
-            )
-        # Sort by timestamp, newest first
-        orders.sort(key=lambda x: x.get("created_at") or "", reverse=True)
-        return orders
+    def get_trader_orders_with_status(
+        self, user_id: str, limit: Optional[int] = None, since: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Return a trader's orders with status (open/partially_filled/filled/cancelled)
+        Without since: newest first, at most limit orders
+        With since: orders created or changed after that seq, oldest change first
+        """
+        order_log = self.order_logs.get(user_id)
+        if order_log is None:
+            return []
+        if since is not None:
+            return order_log.changed_since(since, limit)
+        return order_log.latest(limit)
+
+    def check_order_status(self, order: Union[OrderModel, BookOrder]) -> OrderStatus:
+        order_id = self._resolve_order_id(order)
 
-    def check_order_status(self, order: OrderModel) -> OrderStatus:
         # Check if the order was fulfiled
-        if order.id in self.fulfilled_orders:
+        if order_id in self.fulfilled_orders:
             return OrderStatus.FILLED
 
         # Check if the order even exists in the book
-        if order.id not in self.order_mapping:
-            raise ValueError("Order not found")
+        if order_id not in self.order_mapping:
+            archived = self._archived_order(order, order_id)
+            if archived is None:
+                raise ValueError("Order not found")
+            if archived["status"] == FILLED:
+                return OrderStatus.FILLED
 
         return OrderStatus.OPEN
 
-    def check_order_fulfilled_amount(self, order: OrderModel) -> int:
+    def check_order_fulfilled_amount(self, order: Union[OrderModel, BookOrder]) -> int:
+        order_id = self._resolve_order_id(order)
+
         # Check how much of the order has been fulfilled
-        if order.id not in self.order_mapping:
-            raise ValueError("Order not found")
+        if order_id not in self.order_mapping:
+            archived = self._archived_order(order, order_id)
+            if archived is None:
+                raise ValueError("Order not found")
+            return archived["filled_quantity"]
 
         # fulfilled amount = initial amount - remaining amount
-        fulfilled_amount = order.quantity - self.order_mapping[order.id].quantity
+        fulfilled_amount = order.quantity - self.order_mapping[order_id].quantity
 
         return fulfilled_amount
 
-    def add_order(self, order: OrderModel) -> None:
+    def _archived_order(
+        self, order: Union[OrderModel, BookOrder], order_id: Optional[int]
+    ) -> Optional[dict]:
+        """History row of an order that has left the hot dicts, read from its trader's log"""
+        order_log = self.order_logs.get(order.user_id)
+        if order_id is None or order_log is None:
+            return None
+        return order_log.get(order_id)
+
+    def _mark_terminal(self, order_id: int, user_id: str) -> None:
+        self.terminal_orders.append((time.time(), order_id, user_id))
+
+    def archive_terminal_orders(
+        self, retention_seconds: float, now: Optional[float] = None
+    ) -> Dict[str, int]:
+        """
+        Retention sweep: orders that were filled or cancelled more than
+        retention_seconds ago leave order_mapping, fulfilled_orders and
+        trader_mapping, old terminal history moves into each trader's archive
+        and fills into each user's fill archive.
+        Status and history lookups read through to the archives afterwards
+
+        Only the users of orders that aged out (and users with new fills) are
+        visited, so a sweep costs what changed since the last one. Every terminal
+        order ages out of terminal_orders once, which revisits its trader
+        Returns how many orders, history rows and fills were moved
+        """
+        if now is None:
+            now = time.time()
+        cutoff = now - retention_seconds
+
+        orders = 0
+        touched: Set[str] = set()
+        while self.terminal_orders and self.terminal_orders[0][0] < cutoff:
+            _, order_id, user_id = self.terminal_orders.popleft()
+            self.order_mapping.pop(order_id, None)
+            self.fulfilled_orders.discard(order_id)
+            if user_id in self.trader_mapping:
+                self.trader_mapping[user_id].discard(order_id)
+            touched.add(user_id)
+            orders += 1
+
+        history = 0
+        for user_id in touched:
+            order_log = self.order_logs.get(user_id)
+            if order_log is not None:
+                history += order_log.archive_terminal(cutoff)
+            user_state = self.user_state_mapping.get(user_id)
+            if user_state is not None and user_state.unfulfilled_trades:
+                user_state.unfulfilled_trades = [
+                    order
+                    for order in user_state.unfulfilled_trades
+                    if order.id in self.order_mapping
+                ]
+
+        fills = 0
+        users_with_fills, self.users_with_fills = self.users_with_fills, set()
+        for user_id in users_with_fills:
+            user_state = self.user_state_mapping.get(user_id)
+            if user_state is not None:
+                fills += user_state.archive_fills()
+
+        return {"orders": orders, "history": history, "fills": fills}
+
+    def add_order(self, order: Union[OrderModel, BookOrder]) -> None:
+        order = self._to_book_order(order)
         price = order.price
         side = order.side
         ticker = order.ticker
@@ -266,46 +504,169 @@ class OrderBook:
         if quantity <= 0:
             return
 
+        if side not in (OrderSide.BUY, OrderSide.SELL):
+            raise ValueError("Invalid side")
+
         # ID will be automatically set if not provided
+        self._accept_order(order)
         book = self._get_book(ticker, side)
+        self.order_mapping[order.id] = order
+        # Don't call _add_order_to_trader_mapping here - already called in match_order
+        if order.peg_offset is not None:
+            order.price = self.peg_price(ticker, order.peg_offset)
+            self.pegged_orders.setdefault(ticker, {})[order.id] = order
+        book.add(order)
+
+    def remove_order(self, order: Union[OrderModel, BookOrder]) -> bool:
+        """
+        Remove order from order book
+        The side keeps an order id -> price level handle so this is O(1)
+        """
+        order_id = self._resolve_order_id(order)
+        if order_id is None:
+            return False
+        if not self._get_book(order.ticker, order.side).remove(order_id):
+            return False
+        self.pegged_orders.get(order.ticker, {}).pop(order_id, None)
+        self._mark_terminal(order_id, order.user_id)
+        order_log = self.order_logs.get(order.user_id)
+        if order_log is not None:
+            order_log.record_cancel(order_id)
+        return True
+
+    async def match_order_async(
+        self, order: Union[OrderModel, BookOrder], is_liquidity_bot: bool = False
+    ) -> tuple[OrderStatus, int, float]:
+        """match_order for callers on the event loop, a sharded book awaits its shard here"""
+        return self.match_order(order, is_liquidity_bot)
 
-        if side == OrderSide.BUY:
-            self.order_mapping[order.id] = order
-            # Don't call _add_order_to_trader_mapping here - already called in match_order
-            heapq.heappush(book, (-price, quantity, order))
-        elif side == OrderSide.SELL:
-            self.order_mapping[order.id] = order
-            # Don't call _add_order_to_trader_mapping here - already called in match_order
-            heapq.heappush(book, (price, quantity, order))
-        else:
-            raise ValueError("Invalid side")
+    async def remove_order_async(self, order: Union[OrderModel, BookOrder]) -> bool:
+        """remove_order for callers on the event loop, see match_order_async"""
+        return self.remove_order(order)
 
-    def remove_order(self, order: OrderModel) -> bool:
+    def replace_quotes(
+        self,
+        owner: str,
+        ticker: str,
+        bids: List[Tuple[float, int]],
+        asks: List[Tuple[float, int]],
+        pegged: bool = False,
+    ) -> List[Tuple[OrderSide, float, int]]:
         """
-        Remove order from order book
-        Has to be linear scan since multiple orders can have same price
+        Replace everything owner quotes on ticker with new [price, quantity] ladders
+        With pegged the ladders hold [offset, quantity] and the quotes are pegged
+        orders following the ticker's peg reference, so a moving reference needs
+        no requote at all.
+        The old and new ladders are diffed per price: a quote still resting with
+        exactly the wanted quantity is left alone (and keeps its time priority),
+        everything else is cancelled or added in one batch per side, so each side's
+        version is bumped once and there is no moment where the owner's side is empty.
+        Like liquidity bot orders, quotes are added without matching.
+        Returns the fills the previous quotes received since the last call, as
+        (side, price, quantity)
         """
-        side = order.side
-        ticker = order.ticker
-        orders = self._get_book(ticker, side)
-
-        for i, entry in enumerate(orders):
-            _, _, order_obj = entry
-            if order_obj.id == order.id:
-                orders.pop(i)
-                heapq.heapify(orders)  # maintain the heap property
-                return True
-        return False
-
-    def best_bid(self, ticker: str) -> Optional[OrderModel]:
-        if ticker not in self.buys or not self.buys[ticker]:
+        owner_quotes = self.quotes.setdefault(
+            (owner, ticker), {OrderSide.BUY: {}, OrderSide.SELL: {}}
+        )
+        fills: List[Tuple[OrderSide, float, int]] = []
+
+        for side, ladder in ((OrderSide.BUY, bids), (OrderSide.SELL, asks)):
+            book = self._get_book(ticker, side)
+            wanted: Dict[float, int] = {}
+            for price, quantity in ladder:
+                if quantity > 0:
+                    wanted[price] = wanted.get(price, 0) + quantity
+
+            kept: Dict[float, Tuple[BookOrder, int]] = {}
+            remove_ids: List[int] = []
+            for price, (order, quoted) in owner_quotes[side].items():
+                if order.quantity < quoted:
+                    fills.append((side, order.price, quoted - order.quantity))
+                if order.id not in book:
+                    continue  # fully filled or cancelled elsewhere
+                if (
+                    wanted.get(price) == order.quantity
+                    and (order.peg_offset is not None) == pegged
+                ):
+                    kept[price] = (order, order.quantity)
+                else:
+                    remove_ids.append(order.id)
+                    self._forget_peg(order)
+
+            add_orders: List[BookOrder] = []
+            for price, quantity in wanted.items():
+                if price in kept:
+                    continue
+                order = BookOrder(
+                    price=self.peg_price(ticker, price) if pegged else price,
+                    quantity=quantity,
+                    ticker=ticker,
+                    side=side,
+                    user_id=owner,
+                    peg_offset=price if pegged else None,
+                )
+                self._accept_order(order)
+                self.order_mapping[order.id] = order
+                if pegged:
+                    self.pegged_orders.setdefault(ticker, {})[order.id] = order
+                add_orders.append(order)
+                kept[price] = (order, quantity)
+
+            if remove_ids or add_orders:
+                book.apply(remove_ids, add_orders)
+            for order_id in remove_ids:
+                self._mark_terminal(order_id, owner)
+            owner_quotes[side] = kept
+
+        return fills
+
+    def peg_price(self, ticker: str, offset: float) -> float:
+        """Price a pegged order rests at, snapped to the cent like every other quote"""
+        reference = self.peg_references.get(ticker)
+        if reference is None:
+            raise ValueError(f"No peg reference for {ticker}")
+        return round(reference + offset, 2)
+
+    def set_peg_reference(self, ticker: str, price: float) -> None:
+        """
+        Move the reference pegged orders on ticker follow and reprice them
+        """
+        self.peg_references[ticker] = price
+        if self.pegged_orders.get(ticker):
+            self._reprice_pegs(ticker)
+
+    def _reprice_pegs(self, ticker: str) -> None:
+        """
+        Move pegged orders whose price changed with the reference to their new
+        level, one batch (one version bump) per side. Repriced orders join the
+        back of their new level
+        """
+        moved: Dict[OrderSide, List[BookOrder]] = {OrderSide.BUY: [], OrderSide.SELL: []}
+        for order in self.pegged_orders.get(ticker, {}).values():
+            price = self.peg_price(ticker, order.peg_offset)
+            if price != order.price:
+                order.price = price
+                moved[order.side].append(order)
+
+        for side, orders in moved.items():
+            if orders:
+                self._get_book(ticker, side).apply(
+                    [order.id for order in orders], orders
+                )
+
+    def _forget_peg(self, order: BookOrder) -> None:
+        if order.peg_offset is not None:
+            self.pegged_orders.get(order.ticker, {}).pop(order.id, None)
+
+    def best_bid(self, ticker: str) -> Optional[BookOrder]:
+        if ticker not in self.buys:
             return None
-        return self.buys[ticker][0][self.ORDER_OBJ_IDX]
+        return self.buys[ticker].best_order()
 
-    def best_ask(self, ticker: str) -> Optional[OrderModel]:
-        if ticker not in self.sells or not self.sells[ticker]:
+    def best_ask(self, ticker: str) -> Optional[BookOrder]:
+        if ticker not in self.sells:
             return None
-        return self.sells[ticker][0][self.ORDER_OBJ_IDX]
+        return self.sells[ticker].best_order()
 
     def clamped_spread(self, ticker: str) -> Optional[float]:
         best_bid_w_clamp = self.best_bid_within_clamp(ticker)
@@ -314,38 +675,38 @@ class OrderBook:
             return best_ask_w_clamp.price - best_bid_w_clamp.price
         return None
 
-    def best_bid_within_clamp(self, ticker: str) -> Optional[OrderModel]:
+    def best_bid_within_clamp(self, ticker: str) -> Optional[BookOrder]:
         clamp_price = self.bid_clamp(ticker)
         if clamp_price is None:
             return self.best_bid(ticker)
+        return self._best_within_clamp(ticker, OrderSide.BUY, clamp_price)
 
-        best: Optional[OrderModel] = None
-
-        for entry in self.buys.get(ticker, []):
-            order = entry[self.ORDER_OBJ_IDX]
-            price = order.price
-
-            if price <= clamp_price:
-                if best is None or price > best.price:
-                    best = order
-
-        return best
-
-    def best_ask_within_clamp(self, ticker: str) -> Optional[OrderModel]:
+    def best_ask_within_clamp(self, ticker: str) -> Optional[BookOrder]:
         clamp_price = self.ask_clamp(ticker)
         if clamp_price is None:
             return self.best_ask(ticker)
+        return self._best_within_clamp(ticker, OrderSide.SELL, clamp_price)
 
-        best: Optional[OrderModel] = None
-
-        for entry in self.sells.get(ticker, []):
-            order = entry[self.ORDER_OBJ_IDX]
-            price = order.price
+    def _best_within_clamp(
+        self, ticker: str, side: OrderSide, clamp_price: float
+    ) -> Optional[BookOrder]:
+        """
+        Bisect the ladder for the best level inside the clamp
+        The answer is cached until the side changes or the clamp price moves
+        """
+        books = self.buys if side == OrderSide.BUY else self.sells
+        book = books.get(ticker)
+        if book is None:
+            return None
 
-            if price >= clamp_price:
-                if best is None or price < best.price:
-                    best = order
+        key = (ticker, side)
+        cached = self.clamp_cache.get(key)
+        if cached and cached[0] == book.version and cached[1] == clamp_price:
+            return cached[2]
 
+        level = book.best_level_within(clamp_price)
+        best = level.head() if level else None
+        self.clamp_cache[key] = (book.version, clamp_price, best)
         return best
 
     def clamp_range(self, ticker: str) -> Optional[float]:
@@ -384,15 +745,18 @@ class OrderBook:
         return mid - clamp_range * self.CLAMPED_DELTA_COEFF
 
     def mid_price(self, ticker: str) -> Optional[float]:
-        highest_bid = self.best_bid_within_clamp(ticker)
-        lowest_ask = self.best_ask_within_clamp(ticker)
-        if highest_bid and lowest_ask:
-            mid = (highest_bid.price + lowest_ask.price) / 2
-
+        mid = self.peek_mid_price(ticker)
+        if mid is not None:
             # Update previous mid **inside** mid_price
             self.previous_mid[ticker] = mid
+        return mid
 
-            return mid
+    def peek_mid_price(self, ticker: str) -> Optional[float]:
+        """mid_price without moving the previous mid the clamp is computed from"""
+        highest_bid = self.best_bid_within_clamp(ticker)
+        lowest_ask = self.best_ask_within_clamp(ticker)
+        if highest_bid and lowest_ask:
+            return (highest_bid.price + lowest_ask.price) / 2
         return None
 
     def mid_price_for_clamp(self, ticker: str) -> Optional[float]:
@@ -400,16 +764,22 @@ class OrderBook:
         return self.previous_mid.get(ticker)
 
     def match_order(
-        self, order: OrderModel, is_liquidity_bot: bool = False
+        self, order: Union[OrderModel, BookOrder], is_liquidity_bot: bool = False
     ) -> tuple[OrderStatus, int, float]:
         """
         Matches buy with corresponding sell orders, or sell with buy orders.
         Matching is price-priority based (max bid vs min ask), partial fills allowed.
         Updates last traded price and order book.
+        Executions are published once the match is complete, so subscribers
+        see the book, both users' state and both order logs after the fill
         Returns: (status, remaining quantity, average execution price)
         """
+        order = self._to_book_order(order)
+        self._accept_order(order)
         side = order.side
         ticker = order.ticker
+        if order.peg_offset is not None:
+            order.price = self.peg_price(ticker, order.peg_offset)
         quantity = order.quantity
         initial_quantity = quantity
         
@@ -419,33 +789,35 @@ class OrderBook:
         total_cost = 0.0
         filled_quantity = 0
 
-        # Select the heap for the opposite side
+        # Select the ladder for the opposite side
         if side == OrderSide.BUY:
-            opposite_heap = self.sells.setdefault(ticker, [])
+            opposite_book = self._get_book(ticker, OrderSide.SELL)
             is_buy = True
         else:
-            opposite_heap = self.buys.setdefault(ticker, [])
+            opposite_book = self._get_book(ticker, OrderSide.BUY)
             is_buy = False
 
         # If no opposite orders, just add to book
         # Liquidity bot orders are added to book without matching
-        if not opposite_heap or is_liquidity_bot:
+        if not opposite_book or is_liquidity_bot:
+            if not is_liquidity_bot:
+                self._add_order_to_trader_mapping(order, initial_quantity)
             self.add_order(order)
             return OrderStatus.OPEN, initial_quantity, 0.0
 
-        while quantity > 0 and opposite_heap:
-            best_entry = opposite_heap[0]
-            opp_price, opp_qty, opp_order = best_entry if not is_buy else best_entry
+        executions: List[Execution] = []
+        while quantity > 0 and opposite_book:
+            best_level = opposite_book.best_level()
 
             if is_buy:
-                # Sell heap stores (price, qty, order_obj)
-                if opp_price > order.price:
+                if best_level.price > order.price:
                     break  # cannot match
             else:
-                # Buy heap stores (-price, qty, order_obj)
-                if -opp_price < order.price:
+                if best_level.price < order.price:
                     break  # cannot match
 
+            # Oldest order at the best price trades first
+            opp_order = best_level.head()
             traded_qty = min(quantity, opp_order.quantity)
             trade_price = opp_order.price
 
@@ -473,38 +845,58 @@ class OrderBook:
                 price=trade_price,
             )
 
-            opp_order.quantity -= traded_qty
             quantity -= traded_qty
 
-            heapq.heappop(opposite_heap)
-            if opp_order.quantity > 0:
-                self.add_order(opp_order)
-            else:
+            if opposite_book.fill(opp_order, traded_qty):
                 # in this case, the order is fully matched
                 self.fulfilled_orders.add(opp_order.id)
+                self._forget_peg(opp_order)
+                self._mark_terminal(opp_order.id, opp_order.user_id)
+
+            maker_log = self.order_logs.get(opp_order.user_id)
+            if maker_log is not None:
+                maker_log.record_fill(opp_order.id, traded_qty)
+
+            executions.append(
+                Execution(
+                    ticker=ticker,
+                    price=trade_price,
+                    quantity=traded_qty,
+                    taker_order_id=order.id,
+                    taker_user_id=order.user_id,
+                    taker_side=side,
+                    maker_order_id=opp_order.id,
+                    maker_user_id=opp_order.user_id,
+                )
+            )
 
         # Calculate average execution price
         avg_price = total_cost / filled_quantity if filled_quantity > 0 else 0.0
 
         # Track order with execution price (for non-liquidity bots)
         if not is_liquidity_bot:
-            self._add_order_to_trader_mapping(order, avg_price if avg_price > 0 else order.price)
+            self._add_order_to_trader_mapping(
+                order, initial_quantity, avg_price, filled_quantity
+            )
 
         # Handle the remaining quantities (if any)
         if quantity == initial_quantity:
             # Nothing matched
             self.add_order(order)
-            # Add to user's unfulfilled trades
-            self._get_user_state(order.user_id).add_unfulfilled_trade(order)
-            return OrderStatus.OPEN, initial_quantity, 0.0
+            self._track_open_order(order)
+            result = OrderStatus.OPEN, initial_quantity, 0.0
         elif quantity > 0:
             # Partially matched
             order.quantity = quantity
             self.add_order(order)
-            # Add to user's unfulfilled trades
-            self._get_user_state(order.user_id).add_unfulfilled_trade(order)
-            return OrderStatus.PARTIALLY_FILLED, quantity, avg_price
+            self._track_open_order(order)
+            result = OrderStatus.PARTIALLY_FILLED, quantity, avg_price
         else:
             # Fully matched
             self.fulfilled_orders.add(order.id)
-            return OrderStatus.FILLED, 0, avg_price
+            self._mark_terminal(order.id, order.user_id)
+            result = OrderStatus.FILLED, 0, avg_price
+
+        for execution in executions:
+            self.executions.publish(execution)
+        return result
@@ -1,7 +1,8 @@
 import asyncio
-from typing import Optional
+from typing import List, Optional
 
-from app.schemas.order import OrderModel, OrderSide
+from app.schemas.order import OrderSide
+from app.services.book_order import BookOrder
 from app.services.gbm_manager import GBMManager
 from app.services.instrument_manager import InstrumentManager
 from app.services.order_book import OrderBook
@@ -35,36 +36,45 @@ class OrderGenerator:
             return spread
         return None
 
-    def _process_ticker(self, ticker: str):
+    def _orders_for(self, ticker: str) -> List[BookOrder]:
+        """The buy and sell to place around the GBM price, none without a spread"""
         mid_gbm = self.gbm_manager.get_ticker_current_gbm_price(ticker)
         if mid_gbm is None:
-            return
+            return []
 
         spread = self._derive_spread(ticker)
         if spread is None:
-            return
+            return []
 
         # place buy and sell orders at new mid-price calculated by GBM +/- spread
         target_bid = mid_gbm + (spread / 2)
         target_ask = mid_gbm - (spread / 2)
 
-        buy_order = OrderModel(
+        buy_order = BookOrder(
             price=round(target_bid, 2),
             quantity=self.default_quantity,
             ticker=ticker,
             side=OrderSide.BUY,
             user_id=self.user_id,
         )
-        self.order_book.match_order(buy_order)
 
-        sell_order = OrderModel(
+        sell_order = BookOrder(
             price=round(target_ask, 2),
             quantity=self.default_quantity,
             ticker=ticker,
             side=OrderSide.SELL,
             user_id=self.user_id,
         )
-        self.order_book.match_order(sell_order)
+        return [buy_order, sell_order]
+
+    def _process_ticker(self, ticker: str):
+        for order in self._orders_for(ticker):
+            self.order_book.match_order(order)
+
+    async def _process_ticker_async(self, ticker: str):
+        # a sharded book matches in its shard processes without blocking the loop
+        for order in self._orders_for(ticker):
+            await self.order_book.match_order_async(order)
 
     async def run(self):
         self.is_running = True
@@ -72,7 +82,7 @@ class OrderGenerator:
             try:
                 for instrument in self.instrument_manager.get_all_instruments():
                     ticker = instrument.id
-                    self._process_ticker(ticker)
+                    await self._process_ticker_async(ticker)
                 await asyncio.sleep(self.interval_seconds)
             except asyncio.CancelledError:
                 self.is_running = False
@@ -0,0 +1,308 @@
+import bisect
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from app.services.book_order import BookOrder
+
+OPEN = "open"
+PARTIALLY_FILLED = "partially_filled"
+FILLED = "filled"
+CANCELLED = "cancelled"
+
+# Statuses an order can't leave, only these are moved to the archive
+TERMINAL_STATUSES = (FILLED, CANCELLED)
+
+# Archive columns store status and side as small ints
+STATUS_CODES = (OPEN, PARTIALLY_FILLED, FILLED, CANCELLED)
+SIDE_CODES = ("buy", "sell")
+
+
+class OrderLogEntry:
+    """
+    One order as shown in a trader's history
+
+    Status and filled quantity are updated in place as the order trades, so
+    reading the history never has to look the order up in the book again.
+    seq is the log's change counter at the last update, clients pass the
+    highest seq they have seen as a cursor to only get what changed since
+    """
+
+    __slots__ = (
+        "order_id",
+        "public_id",
+        "symbol",
+        "quantity",
+        "filled_quantity",
+        "price",
+        "side",
+        "status",
+        "created_at",
+        "created_ts",
+        "external_id",
+        "seq",
+    )
+
+    def __init__(self, order: BookOrder, quantity: int, price: float):
+        self.order_id = order.id
+        self.public_id = order.public_id
+        self.symbol = order.ticker
+        self.quantity = quantity
+        self.filled_quantity = 0
+        self.price = price
+        self.side = order.side.value
+        self.status = OPEN
+        self.created_at = order.created_at_datetime().isoformat()
+        self.created_ts = order.created_at
+        self.external_id = order.external_id
+        self.seq = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "order_id": self.public_id,
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "filled_quantity": self.filled_quantity,
+            "price": self.price,
+            "type": self.side,
+            "status": self.status,
+            "created_at": self.created_at,
+            "seq": self.seq,
+        }
+
+
+class OrderArchive:
+    """
+    Compact columnar store for a trader's terminal orders
+
+    Each column is a typed array (or a list of shared ticker strings), so an
+    archived order costs tens of bytes instead of a slotted object plus its
+    dict entries. Rows are kept in creation order (order ids are increasing,
+    an order archived late is inserted at its bisect position), so a single
+    order is found with a bisect. created_at is kept as a unix timestamp and
+    only formatted when the row is read back. It holds the newest MAX_ORDERS
+    orders, older ones are dropped (and counted in dropped) in chunks of a
+    quarter so memory stays bounded per trader
+    """
+
+    MAX_ORDERS = 10000
+
+    def __init__(self, max_orders: int = MAX_ORDERS):
+        self.max_orders = max_orders
+        self.dropped = 0
+        self.order_ids = array("q")
+        self.external_ids = bytearray()  # 16 bytes per row, zeros if none
+        self.symbols: List[str] = []
+        self.quantities = array("q")
+        self.filled_quantities = array("q")
+        self.prices = array("d")
+        self.sides = array("b")
+        self.statuses = array("b")
+        self.created_at = array("d")
+        self.seqs = array("q")
+        self.max_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.order_ids)
+
+    def add(self, entry: OrderLogEntry) -> None:
+        if len(self.order_ids) >= self.max_orders:
+            self._drop_oldest(max(1, self.max_orders // 4))
+        idx = bisect.bisect_left(self.order_ids, entry.order_id)
+        self.order_ids.insert(idx, entry.order_id)
+        self.external_ids[idx * 16 : idx * 16] = (
+            entry.external_id.bytes if entry.external_id is not None else bytes(16)
+        )
+        self.symbols.insert(idx, entry.symbol)
+        self.quantities.insert(idx, entry.quantity)
+        self.filled_quantities.insert(idx, entry.filled_quantity)
+        self.prices.insert(idx, entry.price)
+        self.sides.insert(idx, SIDE_CODES.index(entry.side))
+        self.statuses.insert(idx, STATUS_CODES.index(entry.status))
+        self.created_at.insert(idx, entry.created_ts)
+        self.seqs.insert(idx, entry.seq)
+        self.max_seq = max(self.max_seq, entry.seq)
+
+    def _drop_oldest(self, count: int) -> None:
+        del self.order_ids[:count]
+        del self.external_ids[: count * 16]
+        del self.symbols[:count]
+        del self.quantities[:count]
+        del self.filled_quantities[:count]
+        del self.prices[:count]
+        del self.sides[:count]
+        del self.statuses[:count]
+        del self.created_at[:count]
+        del self.seqs[:count]
+        self.dropped += count
+
+    def row(self, idx: int) -> dict:
+        external_id = bytes(self.external_ids[idx * 16 : idx * 16 + 16])
+        if any(external_id):
+            public_id = str(UUID(bytes=external_id))
+        else:
+            public_id = str(self.order_ids[idx])
+        return {
+            "order_id": public_id,
+            "symbol": self.symbols[idx],
+            "quantity": self.quantities[idx],
+            "filled_quantity": self.filled_quantities[idx],
+            "price": self.prices[idx],
+            "type": SIDE_CODES[self.sides[idx]],
+            "status": STATUS_CODES[self.statuses[idx]],
+            "created_at": datetime.fromtimestamp(
+                self.created_at[idx], tz=timezone.utc
+            ).isoformat(),
+            "seq": self.seqs[idx],
+        }
+
+    def find(self, order_id: int) -> Optional[dict]:
+        idx = bisect.bisect_left(self.order_ids, order_id)
+        if idx < len(self.order_ids) and self.order_ids[idx] == order_id:
+            return self.row(idx)
+        return None
+
+
+class OrderLog:
+    """
+    Append-only order history for a single trader
+
+    entries is in creation order, so the newest orders are read from the end
+    without sorting. changes holds the same entries ordered by their last
+    update (an OrderedDict, moving an entry to the end is O(1)), so "what
+    changed since seq N" walks back from the end and stops at the first entry
+    at or below N
+
+    Old terminal orders are moved into archive (see archive_terminal), reads
+    fall through to it once the hot entries are exhausted
+    """
+
+    def __init__(self):
+        self.entries: List[OrderLogEntry] = []
+        self.by_id: Dict[int, OrderLogEntry] = {}
+        self.changes: "OrderedDict[int, OrderLogEntry]" = OrderedDict()
+        self.seq = 0
+        self.archive = OrderArchive()
+
+    def __len__(self) -> int:
+        return len(self.entries) + len(self.archive)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self.by_id or self.archive.find(order_id) is not None
+
+    def get(self, order_id: int) -> Optional[dict]:
+        """An order's history row, hot or archived"""
+        entry = self.by_id.get(order_id)
+        if entry is not None:
+            return entry.to_dict()
+        return self.archive.find(order_id)
+
+    def _touch(self, entry: OrderLogEntry) -> None:
+        self.seq += 1
+        entry.seq = self.seq
+        self.changes[entry.order_id] = entry
+        self.changes.move_to_end(entry.order_id)
+
+    def append(
+        self, order: BookOrder, quantity: int, price: float, filled_quantity: int = 0
+    ) -> OrderLogEntry:
+        entry = OrderLogEntry(order, quantity, price)
+        self.entries.append(entry)
+        self.by_id[entry.order_id] = entry
+        self._set_filled(entry, filled_quantity)
+        return entry
+
+    def record_fill(self, order_id: int, quantity: int) -> None:
+        """A resting order traded quantity against an incoming order"""
+        entry = self.by_id.get(order_id)
+        if entry is None:
+            return
+        self._set_filled(entry, entry.filled_quantity + quantity)
+
+    def record_cancel(self, order_id: int) -> None:
+        entry = self.by_id.get(order_id)
+        if entry is None or entry.status in TERMINAL_STATUSES:
+            return
+        entry.status = CANCELLED
+        self._touch(entry)
+
+    def _set_filled(self, entry: OrderLogEntry, filled_quantity: int) -> None:
+        entry.filled_quantity = filled_quantity
+        if filled_quantity >= entry.quantity:
+            entry.status = FILLED
+        elif filled_quantity > 0:
+            entry.status = PARTIALLY_FILLED
+        else:
+            entry.status = OPEN
+        self._touch(entry)
+
+    def archive_terminal(self, created_before: float) -> int:
+        """
+        Move filled and cancelled orders created before the cutoff to the archive
+        Each is moved on its own, an order that is still open stays hot without
+        holding back the ones around it
+        Returns the number of orders archived
+        """
+        kept = []
+        count = 0
+        for entry in self.entries:
+            if entry.status not in TERMINAL_STATUSES or entry.created_ts >= created_before:
+                kept.append(entry)
+                continue
+            self.archive.add(entry)
+            del self.by_id[entry.order_id]
+            del self.changes[entry.order_id]
+            count += 1
+        if count:
+            self.entries = kept
+        return count
+
+    def latest(self, limit: Optional[int] = None) -> List[dict]:
+        """
+        Newest orders first, only the first limit entries are serialized
+        Hot and archived orders are merged by order id, both are in creation order
+        """
+        total = len(self)
+        count = total if limit is None else min(limit, total)
+        entries, archive = self.entries, self.archive
+        hot, archived = len(entries) - 1, len(archive) - 1
+        orders = []
+        while len(orders) < count:
+            if archived < 0 or (
+                hot >= 0 and entries[hot].order_id > archive.order_ids[archived]
+            ):
+                orders.append(entries[hot].to_dict())
+                hot -= 1
+            else:
+                orders.append(archive.row(archived))
+                archived -= 1
+        return orders
+
+    def changed_since(self, since: int, limit: Optional[int] = None) -> List[dict]:
+        """
+        Orders created or updated after seq since, oldest change first
+        When limit cuts the page short, the last seq returned is the next cursor
+        """
+        changed = []
+        for entry in reversed(self.changes.values()):
+            if entry.seq <= since:
+                break
+            changed.append(entry)
+        changed.reverse()
+        orders = [entry.to_dict() for entry in changed]
+
+        if since < self.archive.max_seq:
+            # stale cursor, some of the changes have been archived since
+            archive = self.archive
+            orders.extend(
+                archive.row(idx)
+                for idx in range(len(archive))
+                if archive.seqs[idx] > since
+            )
+            orders.sort(key=lambda order: order["seq"])
+
+        if limit is not None:
+            orders = orders[:limit]
+        return orders
@@ -1,98 +1,91 @@
-from app.schemas.order import OrderModel
-from dependencies import get_instrument_manager
+from typing import Optional
+from uuid import UUID
+
+from app.schemas.order import OrderModel, OrderSide, OrderType
+from app.services.book_order import BookOrder
+from app.services.risk import RiskService
+
+# process_order statuses that mean the order never reached the book
+REJECTED_STATUSES = (
+    "POSITION_LIMIT_EXCEEDED",
+    "INVALID_INSTRUMENT",
+    "ORDER_SIZE_EXCEEDED",
+    "RATE_LIMIT_EXCEEDED",
+    "REVERSAL_BLOCKED",
+    "INSUFFICIENT_CASH",
+    "NOT_FOUND",  # the order an amend replaces is gone
+)
 
 
 class OrderProcessor:
-    def __init__(self, order_book, price_engine):
+    def __init__(self, order_book, price_engine, instrument_manager, risk_service=None):
         self.order_book = order_book
         self.price_engine = price_engine
+        self.instrument_manager = instrument_manager
+        self.risk_service = risk_service or RiskService(order_book)
 
     def _ensure_model(self, order):
-        """Convert dict to OrderModel if needed."""
-        if isinstance(order, OrderModel):
+        """Convert dict to OrderModel if needed, engine orders are taken as they are"""
+        if isinstance(order, (OrderModel, BookOrder)):
             return order
         return OrderModel(**order)
 
-    def process_order(self, order):
+    def order_price(
+        self,
+        symbol: str,
+        side: OrderSide,
+        order_type: OrderType,
+        price: Optional[float] = None,
+    ) -> float:
+        """
+        Price to send to the book, raises ValueError when the order can't be priced
+        Market orders get an aggressive limit so they sweep all available liquidity
+        """
+        if order_type == OrderType.LIMIT:
+            if price is None or price <= 0:
+                raise ValueError("Price is required for limit orders")
+            return price
+
+        if side == OrderSide.BUY:
+            # For market buy: use a very high price to match all available asks
+            best_ask = self.order_book.best_ask(symbol)
+            if not best_ask:
+                raise ValueError(f"No liquidity available to buy {symbol}")
+            # Use ask price * 10 to ensure matching through all depth levels
+            return best_ask.price * 10
+
+        # For market sell: use a very low price to match all available bids
+        best_bid = self.order_book.best_bid(symbol)
+        if not best_bid:
+            raise ValueError(f"No liquidity available to sell {symbol}")
+        # Use bid price * 0.1 to ensure matching through all depth levels
+        return best_bid.price * 0.1
+
+    def _check(self, order, replaces: Optional[BookOrder]):
+        """(rejection or None, check time) for an order about to be matched"""
         import time
-        
-        order: OrderModel = self._ensure_model(order)
-        instrument_manager = get_instrument_manager()
 
-        if not instrument_manager.is_valid_instrument(order.ticker):
-            return {
-                "status": "INVALID_INSTRUMENT",
-                "message": "Invalid instrument",
-            }
-        
-        # Anti-manipulation checks
-        MAX_POSITION = 5000
-        MAX_ORDER_SIZE = 500  # Maximum shares per single order
-        MAX_VOLUME_PER_MINUTE = 1000  # Maximum shares per ticker per minute
-        
-        user_state = self.order_book._get_user_state(order.user_id)
-        current_position = user_state.get_position(order.ticker)
+        rejection = self._invalid_instrument(order)
+        if rejection is not None:
+            return rejection, None
+
+        # Anti-manipulation checks, see RiskService
         current_time = time.time()
-        
-        # 1. Check single order size limit
-        if order.quantity > MAX_ORDER_SIZE:
-            return {
-                "status": "ORDER_SIZE_EXCEEDED",
-                "message": f"Order size exceeds maximum of {MAX_ORDER_SIZE} shares per order",
-                "unprocessed_quantity": order.quantity,
-            }
-        
-        # 2. Check volume rate limit (per minute)
-        recent_volume = user_state.get_recent_volume(order.ticker, 60, current_time)
-        if recent_volume + order.quantity > MAX_VOLUME_PER_MINUTE:
-            return {
-                "status": "RATE_LIMIT_EXCEEDED",
-                "message": f"Trading volume limit exceeded. Max {MAX_VOLUME_PER_MINUTE} shares per minute per ticker. Current: {recent_volume}",
-                "unprocessed_quantity": order.quantity,
-            }
-        
-        # 3. Check for rapid position reversals (pump & dump detection)
-        if user_state.check_reversal_risk(order.ticker, order.side.value, current_time, lookback_seconds=30):
-            return {
-                "status": "REVERSAL_BLOCKED",
-                "message": "Cannot reverse large position within 30 seconds. Wait before changing direction.",
-                "unprocessed_quantity": order.quantity,
-            }
-        
-        # 4. Check cash requirements for buy orders
-        if order.side.value == "buy":
-            required_cash = order.price * order.quantity
-            if not user_state.has_sufficient_cash(required_cash):
-                return {
-                    "status": "INSUFFICIENT_CASH",
-                    "message": f"Insufficient cash. Required: ${required_cash:.2f}, Available: ${user_state.get_cash():.2f}",
-                    "unprocessed_quantity": order.quantity,
-                }
-        
-        # 5. Check position limits (5000 per ticker)
-        if order.side.value == "buy":
-            new_position = current_position + order.quantity
-        else:  # sell
-            new_position = current_position - order.quantity
-        
-        if new_position > MAX_POSITION:
-            return {
-                "status": "POSITION_LIMIT_EXCEEDED",
-                "message": f"Order would exceed maximum long position of {MAX_POSITION}. Current position: {current_position}",
-                "unprocessed_quantity": order.quantity,
-            }
-        elif new_position < -MAX_POSITION:
-            return {
-                "status": "POSITION_LIMIT_EXCEEDED",
-                "message": f"Order would exceed maximum short position of {MAX_POSITION}. Current position: {current_position}",
-                "unprocessed_quantity": order.quantity,
-            }
+        return self.risk_service.check(order, current_time, replaces), current_time
+
+    @staticmethod
+    def _replaced_gone() -> dict:
+        return {
+            "status": "NOT_FOUND",
+            "message": "Order not found in the order book",
+        }
+
+    def _processed(self, order, quantity: int, current_time: float, match) -> dict:
+        processing_status, unprocessed_quantity, avg_execution_price = match
 
-        # Process the order and get actual execution price
-        processing_status, unprocessed_quantity, avg_execution_price = self.order_book.match_order(order)
-        
         # Track this trade for rate limiting
-        user_state.add_trade_to_history(order.ticker, order.quantity, order.side.value, current_time)
+        if quantity:
+            self.risk_service.record(order, quantity, current_time)
 
         return {
             "status": processing_status,
@@ -101,18 +94,47 @@ class OrderProcessor:
             "execution_price": avg_execution_price if avg_execution_price > 0 else order.price,
         }
 
-    def cancel_order(self, order):
-        order: OrderModel = self._ensure_model(order)
-        instrument_manager = get_instrument_manager()
+    def process_order(self, order, replaces: Optional[BookOrder] = None):
+        """
+        Check and match order. With replaces (an amend) the replaced order is
+        only taken out of the book once order passed the checks, so a rejected
+        amend leaves it resting
+        """
+        order = self._ensure_model(order)
+        rejection, current_time = self._check(order, replaces)
+        if rejection is not None:
+            return rejection
 
-        if not instrument_manager.is_valid_instrument(order.ticker):
-            return {
-                "status": "INVALID_INSTRUMENT",
-                "message": "Invalid instrument",
-            }
+        if replaces is not None and not self.order_book.remove_order(replaces):
+            return self._replaced_gone()
+
+        # Process the order and get actual execution price
+        # The engine works on BookOrder, validation already happened above
+        # taken before matching, a BookOrder is filled down in place
+        quantity = self.risk_service.new_volume(order, replaces)
+        if isinstance(order, OrderModel):
+            order = BookOrder.from_model(order)
+        match = self.order_book.match_order(order)
+        return self._processed(order, quantity, current_time, match)
 
-        success = self.order_book.remove_order(order)
+    async def process_order_async(self, order, replaces: Optional[BookOrder] = None):
+        """process_order on the event loop, waits for a book that matches elsewhere"""
+        order = self._ensure_model(order)
+        rejection, current_time = self._check(order, replaces)
+        if rejection is not None:
+            return rejection
 
+        if replaces is not None and not await self.order_book.remove_order_async(replaces):
+            return self._replaced_gone()
+
+        quantity = self.risk_service.new_volume(order, replaces)
+        if isinstance(order, OrderModel):
+            order = BookOrder.from_model(order)
+        match = await self.order_book.match_order_async(order)
+        return self._processed(order, quantity, current_time, match)
+
+    @staticmethod
+    def _cancelled(success: bool) -> dict:
         if success:
             return {"status": "CANCELLED", "message": "Order successfully cancelled"}
         else:
@@ -121,6 +143,40 @@ class OrderProcessor:
                 "message": "Order not found in the order book",
             }
 
+    def _invalid_instrument(self, order) -> Optional[dict]:
+        if not self.instrument_manager.is_valid_instrument(order.ticker):
+            return {
+                "status": "INVALID_INSTRUMENT",
+                "message": "Invalid instrument",
+            }
+        return None
+
+    def cancel_order(self, order):
+        order = self._ensure_model(order)
+        rejection = self._invalid_instrument(order)
+        if rejection is not None:
+            return rejection
+        return self._cancelled(self.order_book.remove_order(order))
+
+    async def cancel_order_async(self, order):
+        """cancel_order on the event loop, see process_order_async"""
+        order = self._ensure_model(order)
+        rejection = self._invalid_instrument(order)
+        if rejection is not None:
+            return rejection
+        return self._cancelled(await self.order_book.remove_order_async(order))
+
+    def find_user_order(self, order_id: str, user_id: str) -> Optional[BookOrder]:
+        """A user's order by the id the API handed out, None if unknown or not theirs"""
+        try:
+            external_id = UUID(str(order_id))
+        except ValueError:
+            return None
+        order = self.order_book.find_order(external_id)
+        if order is None or order.user_id != user_id:
+            return None
+        return order
+
     def check_order_status(self, order):
         order: OrderModel = self._ensure_model(order)
         status = self.order_book.check_order_status(order)
@@ -0,0 +1,78 @@
+from typing import Dict, Iterable, Optional
+
+
+def mark_price(order_book, ticker: str, peek: bool = False) -> Optional[float]:
+    """
+    Mid price, or the best bid / ask when only one side is quoted
+    With peek the mid is read without moving the previous mid the spread clamp
+    starts from, only the price tick should move it
+    """
+    price = order_book.peek_mid_price(ticker) if peek else order_book.mid_price(ticker)
+    if price is not None:
+        return price
+
+    best_bid = order_book.best_bid(ticker)
+    best_ask = order_book.best_ask(ticker)
+    if best_bid and best_ask:
+        return (best_bid.price + best_ask.price) / 2
+    if best_bid:
+        return best_bid.price
+    if best_ask:
+        return best_ask.price
+    return None
+
+
+def mark_prices(
+    order_book, tickers: Iterable[str], peek: bool = False
+) -> Dict[str, float]:
+    """Mark price of every ticker that has one, see mark_price for peek"""
+    prices = {}
+    for ticker in tickers:
+        price = mark_price(order_book, ticker, peek)
+        if price is not None:
+            prices[ticker] = price
+    return prices
+
+
+def build_portfolio(user_state, current_prices: dict, full_names: Dict[str, str]) -> dict:
+    """
+    Positions and PnL of a user marked at current_prices
+    Positions in tickers without a price or an instrument are left out
+    """
+    positions = []
+    for ticker, total_qty in user_state.positions.items():
+        if total_qty == 0 or ticker not in full_names or ticker not in current_prices:
+            continue
+
+        current_price = current_prices[ticker]
+        cost_basis = user_state.get_cost_basis(ticker)
+        avg_buy_price = user_state.get_average_price(ticker) if total_qty > 0 else 0
+
+        position_value = total_qty * current_price
+        pnl = position_value - cost_basis
+        pnl_percentage = (pnl / cost_basis * 100) if cost_basis > 0 else 0
+
+        positions.append(
+            {
+                "symbol": ticker,
+                "full_name": full_names[ticker],
+                "sector": "TECH",  # Could be enhanced with actual sector
+                "quantity": total_qty,
+                "price": current_price,
+                "avg_buy_price": avg_buy_price,
+                "total_position": position_value,
+                "pnl": pnl,
+                "pnl_percentage": pnl_percentage,
+            }
+        )
+
+    cash = user_state.get_cash()
+    portfolio_market_value = user_state.get_portfolio_market_value(current_prices)
+    return {
+        "cash": cash,
+        "realized_pnl": user_state.get_total_realized_pnl(),
+        "unrealized_pnl": user_state.calculate_unrealized_pnl(current_prices),
+        "portfolio_market_value": portfolio_market_value,
+        "total_value": cash + portfolio_market_value,
+        "positions": positions,
+    }
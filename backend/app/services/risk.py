@@ -0,0 +1,111 @@
+from typing import Optional
+
+from app.services.book_order import BookOrder
+
+
+class RiskService:
+    """
+    Per-user pre-trade checks (order size, volume rate, reversals, cash and
+    position limits), run before an order reaches the book
+
+    The checks only read user state, which stays with the order book that
+    applies fills, so they work the same whether matching is in-process or
+    partitioned across shard processes (see ShardedOrderBook)
+    """
+
+    MAX_POSITION = 5000
+    MAX_ORDER_SIZE = 500  # Maximum shares per single order
+    MAX_VOLUME_PER_MINUTE = 1000  # Maximum shares per ticker per minute
+    REVERSAL_LOOKBACK_SECONDS = 30
+
+    def __init__(self, order_book):
+        self.order_book = order_book
+
+    def check(
+        self,
+        order: BookOrder,
+        current_time: float,
+        replaces: Optional[BookOrder] = None,
+    ) -> Optional[dict]:
+        """
+        Rejection for process_order to return, None if the order may trade
+        For an amend, replaces is the order being replaced, only the quantity
+        added on top of it counts against the volume limit
+        """
+        user_state = self.order_book._get_user_state(order.user_id)
+        current_position = user_state.get_position(order.ticker)
+
+        # 1. Check single order size limit
+        if order.quantity > self.MAX_ORDER_SIZE:
+            return {
+                "status": "ORDER_SIZE_EXCEEDED",
+                "message": f"Order size exceeds maximum of {self.MAX_ORDER_SIZE} shares per order",
+                "unprocessed_quantity": order.quantity,
+            }
+
+        # 2. Check volume rate limit (per minute)
+        recent_volume = user_state.get_recent_volume(order.ticker, 60, current_time)
+        if recent_volume + self.new_volume(order, replaces) > self.MAX_VOLUME_PER_MINUTE:
+            return {
+                "status": "RATE_LIMIT_EXCEEDED",
+                "message": f"Trading volume limit exceeded. Max {self.MAX_VOLUME_PER_MINUTE} shares per minute per ticker. Current: {recent_volume}",
+                "unprocessed_quantity": order.quantity,
+            }
+
+        # 3. Check for rapid position reversals (pump & dump detection)
+        if user_state.check_reversal_risk(
+            order.ticker,
+            order.side.value,
+            current_time,
+            lookback_seconds=self.REVERSAL_LOOKBACK_SECONDS,
+        ):
+            return {
+                "status": "REVERSAL_BLOCKED",
+                "message": "Cannot reverse large position within 30 seconds. Wait before changing direction.",
+                "unprocessed_quantity": order.quantity,
+            }
+
+        # 4. Check cash requirements for buy orders
+        if order.side.value == "buy":
+            required_cash = order.price * order.quantity
+            if not user_state.has_sufficient_cash(required_cash):
+                return {
+                    "status": "INSUFFICIENT_CASH",
+                    "message": f"Insufficient cash. Required: ${required_cash:.2f}, Available: ${user_state.get_cash():.2f}",
+                    "unprocessed_quantity": order.quantity,
+                }
+
+        # 5. Check position limits (5000 per ticker)
+        if order.side.value == "buy":
+            new_position = current_position + order.quantity
+        else:  # sell
+            new_position = current_position - order.quantity
+
+        if new_position > self.MAX_POSITION:
+            return {
+                "status": "POSITION_LIMIT_EXCEEDED",
+                "message": f"Order would exceed maximum long position of {self.MAX_POSITION}. Current position: {current_position}",
+                "unprocessed_quantity": order.quantity,
+            }
+        elif new_position < -self.MAX_POSITION:
+            return {
+                "status": "POSITION_LIMIT_EXCEEDED",
+                "message": f"Order would exceed maximum short position of {self.MAX_POSITION}. Current position: {current_position}",
+                "unprocessed_quantity": order.quantity,
+            }
+
+        return None
+
+    @staticmethod
+    def new_volume(order: BookOrder, replaces: Optional[BookOrder] = None) -> int:
+        """Quantity order adds to the user's volume, an amend only its increase"""
+        if replaces is None:
+            return order.quantity
+        return max(0, order.quantity - replaces.quantity)
+
+    def record(self, order: BookOrder, quantity: int, current_time: float) -> None:
+        """Track a submitted order for the volume and reversal checks"""
+        user_state = self.order_book._get_user_state(order.user_id)
+        user_state.add_trade_to_history(
+            order.ticker, quantity, order.side.value, current_time
+        )
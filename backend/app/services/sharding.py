@@ -0,0 +1,580 @@
+import asyncio
+import itertools
+import multiprocessing
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.deps import get_logger
+from app.schemas.order import OrderSide
+from app.services.book_order import BookOrder
+from app.services.execution import Execution
+from app.services.market_replica import MarketReplica, changed_states
+from app.services.order_book import OrderBook
+
+logger = get_logger(__name__)
+
+"""
+OrderBook methods a shard serves, everything else stays with the parent.
+"market" does nothing, its reply only carries the market state
+"""
+SHARD_COMMANDS = (
+    "match_order",
+    "remove_order",
+    "replace_quotes",
+    "set_peg_reference",
+    "best_bid_within_clamp",
+    "best_ask_within_clamp",
+    "get_bids",
+    "get_asks",
+    "market",
+)
+
+# (ticker, price, quantity, taker order id, taker user id, taker side,
+#  maker order id, maker user id, timestamp, maker quantity left)
+Fill = Tuple[str, float, int, int, str, OrderSide, int, str, float, int]
+
+# (status, result or exception, fills, changed market states)
+Reply = Tuple[str, object, List[Fill], Dict[str, dict]]
+
+
+def assign_shards(tickers: Iterable[str], shards: int) -> Dict[str, int]:
+    """Spread tickers round robin over the shards, in sorted order so every process agrees"""
+    return {ticker: index % shards for index, ticker in enumerate(sorted(tickers))}
+
+
+class _PegReferences:
+    """Stands in for GBMManager inside a shard, the GBM price arrives as the peg reference"""
+
+    def __init__(self, order_book: OrderBook):
+        self.order_book = order_book
+
+    def get_ticker_current_gbm_price(self, ticker: str) -> Optional[float]:
+        return self.order_book.peg_references.get(ticker)
+
+
+class ShardBook(OrderBook):
+    """
+    The book inside a shard process: ladders, matching and quotes only.
+    Users' cash, positions and order history belong to the parent, which
+    applies the fills a command returns (see ShardedOrderBook)
+    """
+
+    def _apply_trade_to_user(self, user_id, ticker, side, quantity, price):
+        pass
+
+    def _add_order_to_trader_mapping(
+        self, order, quantity, execution_price=None, filled_quantity=0
+    ):
+        pass
+
+    def _track_open_order(self, order: BookOrder) -> None:
+        pass
+
+    def market(self) -> None:
+        pass
+
+
+def run_shard(
+    conn,
+    index: int,
+    shards: int,
+    instruments: List[Tuple[str, float]],
+    quote_interval: Optional[float],
+    retention_seconds: float,
+    archive_interval: float,
+    mid_interval: float,
+):
+    """
+    Shard process main loop: serve book commands from the parent and, between
+    them, requote the shard's liquidity bots every quote_interval seconds
+    (None runs no bots), take the mids the clamp follows every mid_interval
+    seconds and archive terminal orders every archive_interval seconds
+
+    Every reply is ("ok", result, fills, market) or ("error", exception, fills,
+    market). fills are the executions the command produced, for the parent to
+    apply to user state and publish, market the state of the tickers that
+    moved since the last reply (see changed_states)
+    """
+    from app.models.instrument import Instrument
+    from app.services.liquidity_bot_manager import LiquidityBotManager
+
+    order_book = ShardBook()
+    # ids are unique across shards and the parent (see ShardedOrderBook)
+    order_book.order_seq = itertools.count(index + 2, shards + 1)
+    tickers = [ticker for ticker, _ in instruments]
+    reported: Dict[str, dict] = {}
+
+    def market() -> Dict[str, dict]:
+        moved = set(tickers) | set(order_book.buys) | set(order_book.sells)
+        return changed_states(order_book, sorted(moved), reported)
+
+    fills: List[Fill] = []
+
+    def collect(execution: Execution):
+        maker = order_book.order_mapping.get(execution.maker_order_id)
+        fills.append(
+            (
+                execution.ticker,
+                execution.price,
+                execution.quantity,
+                execution.taker_order_id,
+                execution.taker_user_id,
+                execution.taker_side,
+                execution.maker_order_id,
+                execution.maker_user_id,
+                execution.timestamp,
+                maker.quantity if maker is not None else 0,
+            )
+        )
+
+    order_book.executions.subscribe(collect)
+
+    bots = None
+    if quote_interval:
+        bots = LiquidityBotManager(
+            instruments=[
+                Instrument(id=ticker, full_name=ticker, s_0=s_0, mean=0.0, variance=0.0)
+                for ticker, s_0 in instruments
+            ],
+            order_book=order_book,
+            gbm_manager=_PegReferences(order_book),
+        )
+
+    def quote():
+        if bots:
+            bots.quote_all()
+
+    def take_mids():
+        for ticker in tickers:
+            order_book.mid_price(ticker)
+
+    def archive():
+        if retention_seconds > 0:
+            order_book.archive_terminal_orders(retention_seconds)
+
+    # [next run, interval, task]
+    timers = [
+        [time.monotonic(), quote_interval, quote],
+        [time.monotonic(), mid_interval, take_mids],
+        [time.monotonic() + archive_interval, archive_interval, archive],
+    ]
+    timers = [timer for timer in timers if timer[1]]
+
+    conn.send(("ready", index, [], market()))
+    while True:
+        now = time.monotonic()
+        timeout = max(0.0, min(timer[0] for timer in timers) - now) if timers else None
+        try:
+            has_command = conn.poll(timeout)
+        except (EOFError, OSError):
+            break
+
+        if has_command:
+            try:
+                name, args = conn.recv()
+            except (EOFError, OSError):
+                break  # parent is gone
+            fills.clear()
+            try:
+                if name not in SHARD_COMMANDS:
+                    raise ValueError(f"Unknown shard command: {name}")
+                reply = ("ok", getattr(order_book, name)(*args), list(fills), market())
+            except Exception as e:
+                reply = ("error", e, list(fills), market())
+            try:
+                conn.send(reply)
+            except Exception as e:
+                # the result or exception didn't pickle
+                conn.send(("error", RuntimeError(repr(e)), list(fills), market()))
+
+        for timer in timers:
+            if time.monotonic() >= timer[0]:
+                try:
+                    timer[2]()
+                except Exception as e:
+                    logger.error(f"Error in shard {index}: {e}", exc_info=True)
+                timer[0] = time.monotonic() + timer[1]
+
+
+class ShardClient:
+    """
+    Parent side of one shard process. The pipe is only used from the shard's
+    own worker thread, so commands to a shard keep their order, different
+    shards work at the same time and the event loop never waits on a pipe
+    (request() awaits the worker)
+    """
+
+    def __init__(
+        self,
+        index: int,
+        shards: int,
+        instruments: List[Tuple[str, float]],
+        quote_interval: Optional[float],
+        retention_seconds: float,
+        archive_interval: float,
+        mid_interval: float,
+    ):
+        self.index = index
+        self.shards = shards
+        self.instruments = instruments
+        self.quote_interval = quote_interval
+        self.retention_seconds = retention_seconds
+        self.archive_interval = archive_interval
+        self.mid_interval = mid_interval
+        self.conn = None
+        self.process = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.calls = 0
+
+    def start(self) -> Dict[str, dict]:
+        """Start the shard process, returns the initial market state of its tickers"""
+        # spawn: the parent runs an event loop and threads, forking it isn't safe
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=run_shard,
+            args=(
+                child_conn,
+                self.index,
+                self.shards,
+                self.instruments,
+                self.quote_interval,
+                self.retention_seconds,
+                self.archive_interval,
+                self.mid_interval,
+            ),
+            name=f"engine-shard-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        _, _, _, market = self.conn.recv()  # ready
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"engine-shard-{self.index}"
+        )
+        return market
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        self.conn = None
+
+    def _roundtrip(self, name: str, args: tuple) -> Reply:
+        self.conn.send((name, args))
+        reply = self.conn.recv()
+        self.calls += 1
+        return reply
+
+    def submit(self, name: str, *args) -> Future:
+        """Queue an OrderBook method for the shard, the future resolves to its Reply"""
+        if self.executor is None:
+            raise RuntimeError(f"Shard {self.index} is not running")
+        return self.executor.submit(self._roundtrip, name, args)
+
+    async def request(self, name: str, *args) -> Reply:
+        return await asyncio.wrap_future(self.submit(name, *args))
+
+
+class ShardedOrderBook(MarketReplica, OrderBook):
+    """
+    Order book partitioned by instrument across shard processes
+
+    Each shard owns the ladders of its tickers and runs their liquidity bots,
+    so quoting and matching for different tickers use different cores. The
+    parent is the one owner of everything that spans tickers or is read by
+    the API: user state (cash, positions, the risk checks, see RiskService),
+    order logs, order ids and the execution bus. A shard's book keeps none of
+    that (see ShardBook), the fills a command produced come back with the
+    reply and are applied here exactly like match_order applies them in-process
+
+    Orders from the event loop go through match_order_async and
+    remove_order_async, which await the shard so orders for different shards
+    are matched at the same time. Book reads come from the market state every
+    reply carries (see MarketReplica), run() polls the shards every
+    MARKET_INTERVAL seconds for what their bots changed in between. The sync
+    match_order / remove_order / replace_quotes block the caller and are meant
+    for tests and tools, set_peg_reference doesn't wait for the shard
+
+    Order ids are handed out in disjoint strides (the parent gets 1, n+2, ...,
+    shard k gets k+2, k+n+3, ...) so quotes a shard creates never collide with
+    parent orders. Shards start with start(), peg references set before that
+    are replayed to them
+    """
+
+    MARKET_INTERVAL = 0.1
+    MID_INTERVAL = 0.5  # as often as the price engine takes the mid in-process
+
+    def __init__(
+        self,
+        instruments: Iterable,
+        shards: int,
+        quote_interval: Optional[float] = 0.5,
+        retention_seconds: float = 0.0,
+        archive_interval: float = 10.0,
+    ):
+        super().__init__()
+        self.tickers: Dict[str, dict] = {}
+        instruments = list(instruments)
+        self.order_seq = itertools.count(1, shards + 1)
+        self.shard_of = assign_shards([instrument.id for instrument in instruments], shards)
+        self.clients = [
+            ShardClient(
+                index,
+                shards,
+                [
+                    (instrument.id, instrument.s_0)
+                    for instrument in instruments
+                    if self.shard_of[instrument.id] == index
+                ],
+                quote_interval,
+                retention_seconds,
+                archive_interval,
+                self.MID_INTERVAL,
+            )
+            for index in range(shards)
+        ]
+        self.started = False
+        self.is_running = False
+
+    def start(self):
+        for client in self.clients:
+            self.apply_market(client.start())
+        self.started = True
+        for ticker, price in self.peg_references.items():
+            self._call(ticker, "set_peg_reference", ticker, price)
+
+    def stop(self):
+        for client in self.clients:
+            client.stop()
+        self.started = False
+
+    def _client(self, ticker: str) -> ShardClient:
+        index = self.shard_of.get(ticker)
+        if index is None:
+            index = zlib.crc32(ticker.encode()) % len(self.clients)
+        return self.clients[index]
+
+    def _finish(self, reply: Reply) -> Tuple[object, List[Execution]]:
+        """Apply a reply's fills and market state, returns (result, executions to publish)"""
+        status, result, fills, market = reply
+        executions = [self._apply_fill(*fill) for fill in fills]
+        self.apply_market(market)
+        if status == "error":
+            self._publish(executions)
+            raise result
+        return result, executions
+
+    def _publish(self, executions: List[Execution]):
+        for execution in executions:
+            self.executions.publish(execution)
+
+    def _call(self, ticker: str, name: str, *args):
+        """Run a command in the ticker's shard and wait for it, blocks the caller"""
+        result, executions = self._finish(self._client(ticker).submit(name, *args).result())
+        self._publish(executions)
+        return result
+
+    def _post(self, ticker: str, name: str, *args):
+        """Run a command in the ticker's shard without waiting, the reply is applied on the event loop"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._call(ticker, name, *args)
+            return
+
+        def done(future: Future):
+            if not future.cancelled() and not loop.is_closed():
+                loop.call_soon_threadsafe(self._posted, name, future)
+
+        self._client(ticker).submit(name, *args).add_done_callback(done)
+
+    def _posted(self, name: str, future: Future):
+        try:
+            _, executions = self._finish(future.result())
+        except Exception as e:
+            logger.error(f"Shard command {name} failed: {e}")
+            return
+        self._publish(executions)
+
+    def _apply_fill(
+        self,
+        ticker: str,
+        price: float,
+        quantity: int,
+        taker_order_id: int,
+        taker_user_id: str,
+        taker_side: OrderSide,
+        maker_order_id: int,
+        maker_user_id: str,
+        timestamp: float,
+        maker_left: int,
+    ):
+        """A shard's execution applied to user state and order logs, returned for publishing"""
+        self.last_traded_price[ticker] = price
+        execution = Execution(
+            ticker=ticker,
+            price=price,
+            quantity=quantity,
+            taker_order_id=taker_order_id,
+            taker_user_id=taker_user_id,
+            taker_side=taker_side,
+            maker_order_id=maker_order_id,
+            maker_user_id=maker_user_id,
+            timestamp=timestamp,
+        )
+        self._apply_trade_to_user(taker_user_id, ticker, taker_side, quantity, price)
+        self._apply_trade_to_user(
+            maker_user_id, ticker, execution.maker_side, quantity, price
+        )
+
+        # quotes the shard placed itself are only known there
+        maker = self.order_mapping.get(maker_order_id)
+        if maker is not None:
+            maker.quantity = maker_left
+            if maker_left <= 0:
+                self.fulfilled_orders.add(maker_order_id)
+                self._mark_terminal(maker_order_id, maker_user_id)
+
+        maker_log = self.order_logs.get(maker_user_id)
+        if maker_log is not None:
+            maker_log.record_fill(maker_order_id, quantity)
+        return execution
+
+    def _record_match(self, order: BookOrder, is_liquidity_bot: bool, reply: Reply):
+        """Taker side of a shard's match, recorded before its executions are published"""
+        initial_quantity = order.quantity
+        (status, quantity, avg_price), executions = self._finish(reply)
+
+        if not is_liquidity_bot:
+            self._add_order_to_trader_mapping(
+                order, initial_quantity, avg_price, initial_quantity - quantity
+            )
+        if quantity == 0:
+            self.fulfilled_orders.add(order.id)
+            self._mark_terminal(order.id, order.user_id)
+        else:
+            order.quantity = quantity
+            self.order_mapping[order.id] = order
+            if not is_liquidity_bot:
+                self._track_open_order(order)
+
+        # published once the taker is recorded, as in OrderBook.match_order
+        self._publish(executions)
+        return status, quantity, avg_price
+
+    def match_order(self, order, is_liquidity_bot: bool = False):
+        order = self._to_book_order(order)
+        self._accept_order(order)
+        reply = self._client(order.ticker).submit("match_order", order, is_liquidity_bot)
+        return self._record_match(order, is_liquidity_bot, reply.result())
+
+    async def match_order_async(self, order, is_liquidity_bot: bool = False):
+        order = self._to_book_order(order)
+        self._accept_order(order)
+        reply = await self._client(order.ticker).request(
+            "match_order", order, is_liquidity_bot
+        )
+        return self._record_match(order, is_liquidity_bot, reply)
+
+    def add_order(self, order) -> None:
+        order = self._to_book_order(order)
+        self._accept_order(order)
+        self.match_order(order, is_liquidity_bot=True)
+
+    def _remove_handle(self, order) -> Optional[BookOrder]:
+        order_id = self._resolve_order_id(order)
+        if order_id is None:
+            return None
+        return BookOrder(
+            price=order.price,
+            quantity=order.quantity,
+            ticker=order.ticker,
+            side=order.side,
+            user_id=order.user_id,
+            id=order_id,
+        )
+
+    def _record_remove(self, handle: BookOrder, reply: Reply) -> bool:
+        removed, executions = self._finish(reply)
+        self._publish(executions)
+        if not removed:
+            return False
+        self._mark_terminal(handle.id, handle.user_id)
+        order_log = self.order_logs.get(handle.user_id)
+        if order_log is not None:
+            order_log.record_cancel(handle.id)
+        return True
+
+    def remove_order(self, order) -> bool:
+        handle = self._remove_handle(order)
+        if handle is None:
+            return False
+        reply = self._client(handle.ticker).submit("remove_order", handle)
+        return self._record_remove(handle, reply.result())
+
+    async def remove_order_async(self, order) -> bool:
+        handle = self._remove_handle(order)
+        if handle is None:
+            return False
+        reply = await self._client(handle.ticker).request("remove_order", handle)
+        return self._record_remove(handle, reply)
+
+    def replace_quotes(self, owner, ticker, bids, asks, pegged=False):
+        return self._call(ticker, "replace_quotes", owner, ticker, bids, asks, pegged)
+
+    def set_peg_reference(self, ticker: str, price: float) -> None:
+        self.peg_references[ticker] = price
+        if self.started:
+            self._post(ticker, "set_peg_reference", ticker, price)
+
+    def best_bid_within_clamp(self, ticker: str) -> Optional[BookOrder]:
+        return self._call(ticker, "best_bid_within_clamp", ticker)
+
+    def best_ask_within_clamp(self, ticker: str) -> Optional[BookOrder]:
+        return self._call(ticker, "best_ask_within_clamp", ticker)
+
+    def get_bids(self, ticker: str) -> List[BookOrder]:
+        return self._call(ticker, "get_bids", ticker)
+
+    def get_asks(self, ticker: str) -> List[BookOrder]:
+        return self._call(ticker, "get_asks", ticker)
+
+    async def _refresh(self, client: ShardClient):
+        _, executions = self._finish(await client.request("market"))
+        self._publish(executions)
+
+    async def run(self):
+        """Keep the market state current with what the shards' bots quote between orders"""
+        self.is_running = True
+        while self.is_running:
+            try:
+                await asyncio.gather(*(self._refresh(client) for client in self.clients))
+                await asyncio.sleep(self.MARKET_INTERVAL)
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            except Exception as e:
+                logger.error(f"Error refreshing shard market state: {e}", exc_info=True)
+                await asyncio.sleep(self.MARKET_INTERVAL)
+
+    def metrics(self) -> dict:
+        return {
+            "shards": [
+                {
+                    "index": client.index,
+                    "tickers": [ticker for ticker, _ in client.instruments],
+                    "alive": client.process is not None and client.process.is_alive(),
+                    "calls": client.calls,
+                }
+                for client in self.clients
+            ]
+        }
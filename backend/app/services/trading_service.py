@@ -0,0 +1,208 @@
+import asyncio
+from typing import Dict, Iterable, Optional
+from uuid import uuid4
+from weakref import WeakValueDictionary
+
+from app.schemas.order import OrderCreate
+from app.services.book_order import BookOrder
+from app.services.order_processor import REJECTED_STATUSES
+from app.services.portfolio import build_portfolio, mark_prices
+
+
+def rejected(status: str, message: str) -> dict:
+    return {"accepted": False, "status": status, "message": message}
+
+
+def pending(message: str) -> dict:
+    """Order entry whose outcome isn't known, accepted is None"""
+    return {"accepted": None, "status": "PENDING", "message": message}
+
+
+class TradingService:
+    """
+    What the REST endpoints and /ws/user ask of the market on behalf of a user:
+    order entry (new, cancel, amend), order history and portfolio
+
+    Order entry runs as one matching engine command per request, so an amend's
+    cancel and replace can't interleave with other orders. Without a matching
+    engine (a sharded book, whose shards each apply their own orders in turn)
+    requests run as they come, those of one user one at a time so the risk
+    checks always see the user's previous order. Results are dicts
+    with accepted, status and message, accepted orders also carry order_id,
+    price and unprocessed_quantity. Rejections use the process_order statuses
+    plus INVALID_ORDER, NOT_FOUND and ENGINE_BUSY (the engine queue is full)
+
+    EngineClient has the same interface and forwards to an engine process, it
+    adds ENGINE_UNAVAILABLE rejects and PENDING results (see pending)
+    """
+
+    def __init__(
+        self,
+        order_book,
+        order_processor,
+        instrument_manager,
+        matching_engine=None,
+    ):
+        self.order_book = order_book
+        self.order_processor = order_processor
+        self.instrument_manager = instrument_manager
+        self.matching_engine = matching_engine
+        self.user_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+    async def _execute(self, fn, user_id: str, *args) -> dict:
+        if self.matching_engine is None:
+            lock = self.user_locks.get(user_id)
+            if lock is None:
+                lock = self.user_locks[user_id] = asyncio.Lock()
+            async with lock:
+                return await fn(user_id, *args)
+        try:
+            return await self.matching_engine.execute(fn, user_id, *args)
+        except asyncio.QueueFull:
+            return rejected("ENGINE_BUSY", "Too many pending orders, retry")
+
+    async def _submit(self, order: BookOrder, replaces: Optional[BookOrder] = None) -> dict:
+        """Run order through the processor's checks and the book"""
+        result = await self.order_processor.process_order_async(order, replaces)
+        status = result["status"]
+        status = status.value if hasattr(status, "value") else str(status)
+        if status in REJECTED_STATUSES:
+            return rejected(status, result.get("message", "Order rejected"))
+        return {
+            "accepted": True,
+            "status": status,
+            "message": result.get("message", "Order processed"),
+            "order_id": str(order.external_id),
+            "price": result.get("execution_price", order.price),
+            "unprocessed_quantity": result.get("unprocessed_quantity", 0),
+        }
+
+    async def _new_order(self, user_id: str, order_data: OrderCreate) -> dict:
+        try:
+            price = self.order_processor.order_price(
+                order_data.symbol, order_data.side, order_data.order_type, order_data.price
+            )
+        except ValueError as e:
+            return rejected("INVALID_ORDER", str(e))
+
+        # validated once at the edge, the engine record is built directly
+        order = BookOrder(
+            price=price,
+            quantity=order_data.quantity,
+            ticker=order_data.symbol,
+            side=order_data.side,
+            user_id=user_id,
+            external_id=uuid4(),
+        )
+        return await self._submit(order)
+
+    async def _cancel_order(self, user_id: str, order_id: str) -> dict:
+        order = self.order_processor.find_user_order(order_id, user_id)
+        if order is None:
+            return rejected("NOT_FOUND", "Unknown order")
+        result = await self.order_processor.cancel_order_async(order)
+        if result["status"] != "CANCELLED":
+            return rejected(result["status"], result["message"])
+        return {
+            "accepted": True,
+            "status": "cancelled",
+            "message": result["message"],
+            "order_id": str(order.external_id),
+        }
+
+    async def _amend_order(
+        self,
+        user_id: str,
+        order_id: str,
+        price: Optional[float],
+        quantity: Optional[int],
+    ) -> dict:
+        order = self.order_processor.find_user_order(order_id, user_id)
+        if order is None:
+            return rejected("NOT_FOUND", "Unknown order")
+        price = price or order.price
+        quantity = quantity or order.quantity
+        if not isinstance(quantity, int) or quantity <= 0 or price <= 0:
+            return rejected("INVALID_ORDER", "Price and quantity must be positive")
+
+        replacement = BookOrder(
+            price=price,
+            quantity=quantity,
+            ticker=order.ticker,
+            side=order.side,
+            user_id=user_id,
+            external_id=uuid4(),
+        )
+        # the original is only cancelled once the replacement passed the checks
+        reply = await self._submit(replacement, replaces=order)
+        reply["replaced_order_id"] = str(order.external_id)
+        return reply
+
+    async def new_order(self, user_id: str, order_data: OrderCreate) -> dict:
+        return await self._execute(self._new_order, user_id, order_data)
+
+    async def cancel_order(self, user_id: str, order_id: str) -> dict:
+        return await self._execute(self._cancel_order, user_id, order_id)
+
+    async def amend_order(
+        self,
+        user_id: str,
+        order_id: str,
+        price: Optional[float] = None,
+        quantity: Optional[int] = None,
+    ) -> dict:
+        """
+        Cancel / replace: the replacement gets a new order_id and loses time
+        priority, if it is rejected the original keeps resting unchanged
+        """
+        return await self._execute(self._amend_order, user_id, order_id, price, quantity)
+
+    async def orders(
+        self, user_id: str, limit: Optional[int] = None, since: Optional[int] = None
+    ) -> dict:
+        """
+        {"seq", "data"}: history rows as in GET /trading/orders and the seq of the
+        user's order log (0 before their first order)
+        """
+        order_log = self.order_book.order_logs.get(user_id)
+        return {
+            "seq": order_log.seq if order_log is not None else 0,
+            "data": self.order_book.get_trader_orders_with_status(
+                user_id, limit=limit, since=since
+            ),
+        }
+
+    async def order_seqs(self, user_ids: Iterable[str]) -> Dict[str, int]:
+        """Order log seq of each user, to only fetch the orders of those that changed"""
+        seqs = {}
+        for user_id in user_ids:
+            order_log = self.order_book.order_logs.get(user_id)
+            seqs[user_id] = order_log.seq if order_log is not None else 0
+        return seqs
+
+    def current_prices(self) -> Dict[str, float]:
+        return mark_prices(
+            self.order_book,
+            [instrument.id for instrument in self.instrument_manager.get_all_instruments()],
+            peek=True,
+        )
+
+    async def portfolios(
+        self, user_ids: Iterable[str], prices: Optional[Dict[str, float]] = None
+    ) -> Dict[str, dict]:
+        """Portfolio of each user (see build_portfolio), all marked at the same prices"""
+        if prices is None:
+            prices = self.current_prices()
+        full_names = {
+            instrument.id: instrument.full_name
+            for instrument in self.instrument_manager.get_all_instruments()
+        }
+        return {
+            user_id: build_portfolio(
+                self.order_book._get_user_state(user_id), prices, full_names
+            )
+            for user_id in user_ids
+        }
+
+    async def portfolio(self, user_id: str) -> dict:
+        return (await self.portfolios([user_id]))[user_id]
@@ -1,3 +1,107 @@
+from array import array
+from collections import deque
+
+
+class FillArchive:
+    """
+    Columnar store for a user's older fills (ticker, side, quantity, price)
+
+    The running aggregates already hold everything P&L needs, the archive only
+    keeps the history around at a fraction of the size of a dict per fill.
+    It holds the newest MAX_FILLS fills, older ones are dropped (and counted
+    in dropped) in chunks of a quarter so memory stays bounded per user
+    """
+
+    SIDES = ("buy", "sell")
+    MAX_FILLS = 10000
+
+    def __init__(self, max_fills: int = MAX_FILLS):
+        self.max_fills = max_fills
+        self.tickers = []  # shared ticker strings
+        self.sides = array("b")
+        self.quantities = array("q")
+        self.prices = array("d")
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.quantities)
+
+    def append(self, fill: dict) -> None:
+        if len(self.quantities) >= self.max_fills:
+            self._drop_oldest(max(1, self.max_fills // 4))
+        self.tickers.append(fill["ticker"])
+        self.sides.append(self.SIDES.index(fill["side"]))
+        self.quantities.append(fill["quantity"])
+        self.prices.append(fill["price"])
+
+    def _drop_oldest(self, count: int) -> None:
+        del self.tickers[:count]
+        del self.sides[:count]
+        del self.quantities[:count]
+        del self.prices[:count]
+        self.dropped += count
+
+    def __iter__(self):
+        for idx in range(len(self.quantities)):
+            yield {
+                "ticker": self.tickers[idx],
+                "side": self.SIDES[self.sides[idx]],
+                "quantity": self.quantities[idx],
+                "price": self.prices[idx],
+            }
+
+
+class TradeWindow:
+    """
+    Recent trades for one ticker, oldest first, used by the pre-trade checks
+
+    Entries older than window_seconds are evicted as new trades arrive or the
+    window is queried, so memory stays bounded no matter how long a user trades.
+    volume is the running total of the quantities still in the window.
+    """
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.trades = deque()  # (quantity, side, timestamp)
+        self.volume = 0
+
+    def _evict(self, current_time: float) -> None:
+        cutoff_time = current_time - self.window_seconds
+        while self.trades and self.trades[0][2] < cutoff_time:
+            quantity, _, _ = self.trades.popleft()
+            self.volume -= quantity
+
+    def add(self, quantity: int, side: str, timestamp: float) -> None:
+        self.trades.append((quantity, side, timestamp))
+        self.volume += quantity
+        self._evict(timestamp)
+
+    def recent_volume(self, time_window_seconds: float, current_time: float) -> int:
+        """Volume traded since current_time - time_window_seconds (capped to the window)"""
+        self._evict(current_time)
+        if time_window_seconds >= self.window_seconds:
+            return self.volume
+
+        # shorter lookback: walk back from the newest trade only as far as needed
+        cutoff_time = current_time - time_window_seconds
+        volume = 0
+        for quantity, _, timestamp in reversed(self.trades):
+            if timestamp < cutoff_time:
+                break
+            volume += quantity
+        return volume
+
+    def last_trade(self, lookback_seconds: float, current_time: float):
+        """Newest (quantity, side, timestamp) within the lookback, or None"""
+        self._evict(current_time)
+        if not self.trades:
+            return None
+        last = self.trades[-1]
+        if last[2] < current_time - lookback_seconds:
+            return None
+        return last
+
+
 class UserState:
     """Example of a portfolio
     "ticker": [(qty, price), (qty, price)]
@@ -6,19 +110,35 @@ class UserState:
         "AAPL": [(1, 120), (2, 125)],
         "MSFT": [(3, 310)]
     }
+
+    Lots for a ticker are either all long (qty > 0) or all short (qty < 0),
+    a fill on the other side closes lots FIFO from the front before opening
+    a new lot. Running per-ticker aggregates are kept next to the lots so
+    position checks and portfolio reads never re-sum trades:
+    positions: ticker -> net quantity (negative = short)
+    cost_basis: ticker -> sum(qty * entry price) over open lots
+    realized_pnl: ticker -> realized P&L from closed lots
     """
 
+    # Largest lookback used by the pre-trade checks (volume limit is per minute)
+    TRADE_WINDOW_SECONDS = 60
+
     def __init__(self, user_id):
         self.user_id = user_id
         self.cash = 500000.0  # Start with 500k cash
 
-        self.portfolio = {}  # contains user's portfolio
+        self.portfolio = {}  # contains user's portfolio, ticker -> deque of lots
         self.unfulfilled_trades = (
             []
         )  # orders that have not been fulfilled or position is not closed
         self.fulfilled_trades = (
             []
         )  # orders that have been fulfilled or position is closed
+        self.fill_archive = FillArchive()  # older fulfilled_trades, see archive_fills
+
+        self.positions = {}
+        self.cost_basis = {}
+        self.realized_pnl = {}
 
         self.total_shares = 0
         self.prev_avg_price = 0
@@ -26,92 +146,78 @@ class UserState:
         self.rank = 0
         
         # Anti-manipulation limits
-        self.trade_history = []  # List of (ticker, quantity, side, timestamp)
+        self.trade_history = {}  # ticker -> TradeWindow of recent trades
 
     # adds order that has not been closed
     def add_unfulfilled_trade(self, order):
         self.unfulfilled_trades.append(order)
 
-    # adds order that has been closed and so we call get_avg_price here
+    # adds order that has been closed and updates the running aggregates
     def add_fulfilled_trades(self, order):
         self.fulfilled_trades.append(order)
 
-        if order["ticker"] not in self.portfolio:
-            self.portfolio[order["ticker"]] = []
-
         if order["side"] == "buy":
-            # Check if we have short positions to close first
-            if self.portfolio[order["ticker"]]:
-                # Close short positions first (FIFO)
-                buy_qty = order["quantity"]
-                buy_price = order["price"]
-                lots = self.portfolio[order["ticker"]]
-                
-                while buy_qty > 0 and lots and lots[0][0] < 0:  # Negative qty = short
-                    short_qty, short_price = lots[0]
-                    short_qty = abs(short_qty)  # Make positive for calculation
-                    
-                    if buy_qty >= short_qty:
-                        # Close entire short position
-                        pnl = (short_price - buy_price) * short_qty  # Profit if buy < short
-                        self.total_realized_pnl += pnl
-                        buy_qty -= short_qty
-                        lots.pop(0)
-                    else:
-                        # Partially close short
-                        pnl = (short_price - buy_price) * buy_qty
-                        self.total_realized_pnl += pnl
-                        lots[0] = (-(short_qty - buy_qty), short_price)  # Keep negative
-                        buy_qty = 0
-                        break
-                
-                # If still have buy quantity left, add as long position
-                if buy_qty > 0:
-                    self.portfolio[order["ticker"]].append((buy_qty, buy_price))
-            else:
-                # No positions, just add long
-                self.portfolio[order["ticker"]].append((order["quantity"], order["price"]))
-                
+            self._apply_fill(order["ticker"], order["quantity"], order["price"])
         elif order["side"] == "sell":
             self.sell_shares(order["ticker"], order["quantity"], order["price"])
 
+    def archive_fills(self) -> int:
+        """Move the hot fill list into the compact archive, returns how many moved"""
+        count = len(self.fulfilled_trades)
+        for fill in self.fulfilled_trades:
+            self.fill_archive.append(fill)
+        self.fulfilled_trades = []
+        return count
+
+    def get_fulfilled_trades(self) -> list:
+        """Fills oldest first, archived ones included (the newest FillArchive.MAX_FILLS)"""
+        return list(self.fill_archive) + self.fulfilled_trades
+
     # user sell shares and would remove the shares based on FIFO
     def sell_shares(self, ticker, sell_qty, sell_price):
+        self._apply_fill(ticker, -sell_qty, sell_price)
+
+    def _apply_fill(self, ticker, signed_qty, price):
+        """
+        Apply a fill of signed_qty (positive = buy, negative = sell)
+        Only lots that are actually closed are touched, so this is O(1) amortized
+        """
+        lots = self.portfolio.get(ticker)
+        if lots is None:
+            lots = self.portfolio[ticker] = deque()
+
+        direction = 1 if signed_qty > 0 else -1
+        remaining = abs(signed_qty)
         realized_pnl = 0.0
+        cost_change = 0.0
 
-        remaining = sell_qty
-        lots = self.portfolio[ticker]
-
-        # Close long positions first (FIFO)
-        # Only process positive quantities (long positions)
-        i = 0
-        while remaining > 0 and i < len(lots):
-            buy_qty, buy_price = lots[i]
-            
-            # Skip short positions (negative quantities) and continue to next lot
-            if buy_qty <= 0:
-                i += 1
-                continue
-            
-            if remaining >= buy_qty:
-                # Close entire long position
-                realized_pnl += (sell_price - buy_price) * buy_qty
-                remaining -= buy_qty
-                lots.pop(i)
-                # Don't increment i, as we removed an element
+        # Close opposite lots first (FIFO)
+        while remaining > 0 and lots and lots[0][0] * direction < 0:
+            lot_qty, lot_price = lots[0]
+            closed = min(remaining, abs(lot_qty))
+
+            # long closed by a sell: (sell - entry), short closed by a buy: (entry - buy)
+            realized_pnl += (price - lot_price) * closed * -direction
+            cost_change -= lot_price * closed * -direction
+
+            if closed == abs(lot_qty):
+                lots.popleft()
             else:
-                # Partially close long position
-                realized_pnl += (sell_price - buy_price) * remaining
-                lots[i] = (buy_qty - remaining, buy_price)
-                remaining = 0
-                break
+                lots[0] = (lot_qty + closed * direction, lot_price)
+            remaining -= closed
 
-        # If still have remaining quantity, it's a short sale
-        # Store as negative quantity to track short positions
+        # Whatever is left opens a new lot (long for buys, short for sells)
         if remaining > 0:
-            # Add as negative lot (short position)
-            lots.append((-remaining, sell_price))
+            lots.append((remaining * direction, price))
+            cost_change += remaining * direction * price
 
+        self.positions[ticker] = self.positions.get(ticker, 0) + signed_qty
+        if lots:
+            self.cost_basis[ticker] = self.cost_basis.get(ticker, 0.0) + cost_change
+        else:
+            # flat, drop any float residue
+            self.cost_basis[ticker] = 0.0
+        self.realized_pnl[ticker] = self.realized_pnl.get(ticker, 0.0) + realized_pnl
         self.total_realized_pnl += realized_pnl
 
     def get_avg_price(self, order_price, order_quantity) -> float:
@@ -142,52 +248,54 @@ class UserState:
         """
         Get current position (net quantity) for a ticker.
         Returns positive for long, negative for short.
-        Calculated from all fulfilled trades (buys minus sells).
+        Kept up to date as each fill is applied.
         """
-        net_position = 0
-        
-        # Sum all fulfilled trades for this ticker
-        for trade in self.fulfilled_trades:
-            if trade["ticker"] == ticker:
-                if trade["side"] == "buy":
-                    net_position += trade["quantity"]
-                else:  # sell
-                    net_position -= trade["quantity"]
-        
-        return net_position
-    
+        return self.positions.get(ticker, 0)
+
+    def get_cost_basis(self, ticker: str) -> float:
+        """Sum of qty * entry price over open lots (negative for shorts)"""
+        return self.cost_basis.get(ticker, 0.0)
+
+    def get_average_price(self, ticker: str) -> float:
+        """Average entry price of the open position, 0 when flat"""
+        position = self.get_position(ticker)
+        if position == 0:
+            return 0.0
+        return self.get_cost_basis(ticker) / position
+
+    def _get_trade_window(self, ticker: str) -> "TradeWindow":
+        window = self.trade_history.get(ticker)
+        if window is None:
+            window = self.trade_history[ticker] = TradeWindow(self.TRADE_WINDOW_SECONDS)
+        return window
+
     def add_trade_to_history(self, ticker: str, quantity: int, side: str, timestamp: float):
         """Track trades for rate limiting"""
-        self.trade_history.append((ticker, quantity, side, timestamp))
+        self._get_trade_window(ticker).add(quantity, side, timestamp)
     
     def get_recent_volume(self, ticker: str, time_window_seconds: float, current_time: float) -> int:
         """
         Get total volume traded for a ticker within a time window.
         Used for rate limiting.
         """
-        cutoff_time = current_time - time_window_seconds
-        volume = sum(
-            qty for t, qty, side, ts in self.trade_history
-            if t == ticker and ts >= cutoff_time
-        )
-        return volume
+        if ticker not in self.trade_history:
+            return 0
+        return self.trade_history[ticker].recent_volume(time_window_seconds, current_time)
     
     def check_reversal_risk(self, ticker: str, side: str, current_time: float, lookback_seconds: float = 60) -> bool:
         """
         Check if user is trying to reverse position too quickly (pump & dump detection).
         Returns True if this looks like a reversal (suspicious).
         """
-        cutoff_time = current_time - lookback_seconds
-        recent_trades = [
-            (qty, s) for t, qty, s, ts in self.trade_history
-            if t == ticker and ts >= cutoff_time
-        ]
-        
-        if not recent_trades:
+        if ticker not in self.trade_history:
+            return False
+
+        last_trade = self.trade_history[ticker].last_trade(lookback_seconds, current_time)
+        if last_trade is None:
             return False
         
         # Check if the last trade was the opposite side
-        last_qty, last_side = recent_trades[-1]
+        last_qty, last_side, _ = last_trade
         
         # Suspicious if:
         # - Last trade was a large buy (>100) and now trying to sell
@@ -209,22 +317,15 @@ class UserState:
         """
         Calculate unrealized P&L based on current market prices.
         current_prices: dict of {ticker: current_price}
-        Handles both long positions (positive qty) and short positions (negative qty).
+        Handles both long positions (positive qty) and short positions (negative qty),
+        for both it is current_price * qty - cost basis.
         """
         unrealized_pnl = 0.0
         
-        for ticker, lots in self.portfolio.items():
-            if ticker not in current_prices:
+        for ticker, position in self.positions.items():
+            if ticker not in current_prices or position == 0:
                 continue
-            
-            current_price = current_prices[ticker]
-            for qty, entry_price in lots:
-                if qty > 0:
-                    # Long position: profit when price goes up
-                    unrealized_pnl += (current_price - entry_price) * qty
-                else:
-                    # Short position (qty is negative): profit when price goes down
-                    unrealized_pnl += (entry_price - current_price) * abs(qty)
+            unrealized_pnl += current_prices[ticker] * position - self.cost_basis[ticker]
         
         return unrealized_pnl
     
@@ -232,22 +333,14 @@ class UserState:
         """
         Calculate total market value of portfolio.
         For long positions: current_price * qty
-        For short positions: entry_price * qty - current_price * qty (what you'd need to close)
+        For short positions: current_price * qty is negative (liability to buy back)
         current_prices: dict of {ticker: current_price}
         """
         market_value = 0.0
         
-        for ticker, lots in self.portfolio.items():
+        for ticker, position in self.positions.items():
             if ticker not in current_prices:
                 continue
-            
-            current_price = current_prices[ticker]
-            for qty, entry_price in lots:
-                if qty > 0:
-                    # Long: value is current market price
-                    market_value += current_price * qty
-                else:
-                    # Short: value is negative (liability to buy back)
-                    market_value += current_price * qty  # qty is negative, so this subtracts
+            market_value += current_prices[ticker] * position
         
-        return market_value
\ No newline at end of file
+        return market_value
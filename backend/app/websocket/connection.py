@@ -0,0 +1,138 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple
+
+from fastapi import WebSocket
+
+from app.core.deps import get_logger
+from app.websocket.encoding import Frame
+
+logger = get_logger(__name__)
+
+# Close code sent to a client that can't keep up (RFC 6455 "try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class ClientConnection:
+    """
+    A WebSocket with its own bounded send queue and writer task
+
+    Publishers only enqueue pre-encoded frames, the writer task does the
+    socket writes, so a slow client never holds up a broadcast to the others.
+
+    When the queue is full the oldest droppable frame (price ticks) is
+    dropped and stale_prices is set so the engine sends a fresh price
+    snapshot later. A client whose queue is full of frames that can't be
+    dropped, or whose oldest queued frame has waited longer than max_lag
+    seconds, is a slow consumer and gets disconnected
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        binary: bool = False,
+        max_queue: int = 256,
+        max_lag: float = 5.0,
+        on_close: Optional[Callable[["ClientConnection"], None]] = None,
+    ):
+        self.websocket = websocket
+        self.binary = binary
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.on_close = on_close
+
+        # (frame, droppable, enqueued at)
+        self.queue: Deque[Tuple[Frame, bool, float]] = deque()
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.writer: Optional[asyncio.Task] = None
+
+        self.closed = False
+        self.slow_consumer = False
+        self.stale_prices = False
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def send(self, frame: Frame, droppable: bool = False) -> bool:
+        """Queue a frame, returns False if it was dropped or the client was cut off"""
+        if self.closed:
+            return False
+
+        now = time.monotonic()
+        if self.queue and now - self.queue[0][2] > self.max_lag:
+            self.close(slow_consumer=True)
+            return False
+
+        if len(self.queue) >= self.max_queue and not self._drop_oldest():
+            if not droppable:
+                self.close(slow_consumer=True)
+                return False
+            # nothing older to drop, the new tick goes instead
+            self.dropped += 1
+            self.stale_prices = True
+            return False
+
+        self.queue.append((frame, droppable, now))
+        self.idle.clear()
+        self.wakeup.set()
+        return True
+
+    def _drop_oldest(self) -> bool:
+        for idx, (_, droppable, _) in enumerate(self.queue):
+            if droppable:
+                del self.queue[idx]
+                self.dropped += 1
+                self.stale_prices = True
+                return True
+        return False
+
+    async def drain(self) -> None:
+        """Wait until everything queued so far has been written"""
+        await self.idle.wait()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                while not self.queue:
+                    self.idle.set()
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                frame, _, _ = self.queue.popleft()
+                if self.binary:
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending to connection: {e}", exc_info=True)
+            self.close()
+
+    def close(self, slow_consumer: bool = False) -> None:
+        """Stop the writer, a slow consumer also has its socket closed"""
+        if self.closed:
+            return
+        self.closed = True
+        self.slow_consumer = slow_consumer
+        self.queue.clear()
+        self.idle.set()
+        if self.writer is not None:
+            self.writer.cancel()
+        if slow_consumer:
+            logger.warning("Disconnecting slow WebSocket consumer")
+            asyncio.ensure_future(self._close_socket(SLOW_CONSUMER_CLOSE_CODE))
+        if self.on_close:
+            self.on_close(self)
+
+    async def _close_socket(self, code: int) -> None:
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            # already gone
+            pass
@@ -0,0 +1,59 @@
+import json
+from typing import Union
+
+Frame = Union[str, bytes]
+
+
+class JSONEncoder:
+    """Standard library JSON, sent as text frames"""
+
+    name = "json"
+    binary = False
+
+    def encode(self, message) -> Frame:
+        return json.dumps(message, separators=(",", ":"))
+
+
+class OrjsonEncoder:
+    """orjson (optional dependency), same JSON on the wire, several times faster"""
+
+    name = "orjson"
+    binary = False
+
+    def __init__(self):
+        import orjson
+
+        self._dumps = orjson.dumps
+
+    def encode(self, message) -> Frame:
+        return self._dumps(message).decode("utf-8")
+
+
+class MsgpackEncoder:
+    """msgpack (optional dependency), smaller binary frames, clients must decode msgpack"""
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        import msgpack
+
+        self._packb = msgpack.packb
+
+    def encode(self, message) -> Frame:
+        return self._packb(message)
+
+
+ENCODERS = {
+    encoder.name: encoder for encoder in (JSONEncoder, OrjsonEncoder, MsgpackEncoder)
+}
+
+
+def get_encoder(name: str):
+    """Encoder by name (settings.WS_ENCODER), the library has to be installed"""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown WebSocket encoder: {name}")
+    try:
+        return ENCODERS[name]()
+    except ImportError as e:
+        raise ValueError(f"WebSocket encoder {name} is not installed") from e
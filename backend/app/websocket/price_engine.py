@@ -1,28 +1,144 @@
 import asyncio
+import json
+import time
+from typing import Dict, List, Optional
 
 from fastapi import WebSocket
 
 from app.core.deps import get_logger
+from app.services.portfolio import mark_prices
+from app.websocket.connection import ClientConnection
+from app.websocket.encoding import Frame, JSONEncoder
+from app.websocket.subscriptions import ALL_TICKERS, SubscriptionRegistry
 
 logger = get_logger(__name__)
 
+REPLY_TYPES = {
+    "subscribe": "subscribed",
+    "unsubscribe": "unsubscribed",
+    "resync": "resynced",
+}
+
 
 class PriceEngine:
-    def __init__(self, news_engine=None, order_book=None, instrument_manager=None):
-        # TODO: convert to map, should be ticker -> connections
-        # also add another map ticker -> gbm simulator
-        self.active_connections = []
+    """
+    Market data over /ws/market
+
+    A connection that never subscribes gets the legacy feed: a flat
+    {ticker: price} map of the tickers that changed. Sending
+        {"action": "subscribe", "channel": "prices", "tickers": ["AAPL"]}
+    (or "unsubscribe") switches it to topic mode, where it only receives the
+    channels and tickers it asked for. tickers defaults to ["*"] (all).
+    "resync" resends the snapshot of a prices or depth subscription.
+
+    Channels:
+        prices  {"type": "prices", "seq", "snapshot", "data": {ticker: price}},
+                on subscribe and on every tick where a followed ticker changed
+        depth   {"type": "depth", "ticker", "seq", "version", "bids", "asks"}
+                snapshot on subscribe / resync, then
+                {"type": "depth_update", "ticker", "seq", "version", "bids", "asks"}
+                with only the changed levels (quantity 0 removes the level)
+        trades  {"type": "trade", "ticker", "price", "quantity", "side", "seq",
+                "timestamp"}, as they happen
+        news    {"type": "news", "data": [...]}, when news is activated
+
+    Price ticks are deltas: a ticker is only sent once it moved at least
+    min_change from the price last sent, smaller moves are conflated into a
+    later tick. seq counts ticks with any change (across all tickers, so a
+    client following a few tickers can see gaps). Every snapshot_seconds all
+    prices are sent with snapshot true, clients replace their state with it
+
+    Depth seq is per ticker and increases by one per depth_update, a client
+    that sees a gap sends resync for that ticker
+
+    Frames are serialized by encoder (JSON text by default, see
+    app.websocket.encoding), once per message no matter how many
+    connections receive it, and queued per connection (see ClientConnection)
+    """
+
+    DEPTH_LEVELS = 10
+
+    def __init__(
+        self,
+        news_engine=None,
+        order_book=None,
+        instrument_manager=None,
+        encoder=None,
+        min_change: float = 0.0,
+        snapshot_seconds: float = 10.0,
+        max_queue: int = 256,
+        max_lag: float = 5.0,
+    ):
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.subscriptions = SubscriptionRegistry()
         self.is_running = False
         self.news_engine = news_engine
         self.order_book = order_book
         self.instrument_manager = instrument_manager
+        self.encoder = encoder or JSONEncoder()
+        self.min_change = min_change
+        self.snapshot_seconds = snapshot_seconds
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+
+        # ticker -> price last sent on the prices channel and legacy feed
+        self.last_prices: Dict[str, float] = {}
+        self.price_seq = 0
+        self.last_snapshot_at: Optional[float] = None
+
+        # ticker -> {"seq", "version", "bids", "asks"} last sent on the depth channel
+        self.depth_books: Dict[str, dict] = {}
+        self.sent_news_ids = set()
+
+        # totals of connections that have closed, live ones are added in metrics()
+        self.closed_sent = 0
+        self.closed_dropped = 0
+        self.slow_consumers = 0
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = ClientConnection(
+            websocket,
+            binary=self.encoder.binary,
+            max_queue=self.max_queue,
+            max_lag=self.max_lag,
+            on_close=self._connection_closed,
+        )
+        self.connections[websocket] = connection
+        connection.start()
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        # may be called twice, by a slow consumer cut off and by the socket loop
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.close()
+        self.subscriptions.remove(websocket)
+
+    def _connection_closed(self, connection: ClientConnection):
+        if self.connections.get(connection.websocket) is not connection:
+            return
+        del self.connections[connection.websocket]
+        self.subscriptions.remove(connection.websocket)
+        self.closed_sent += connection.sent
+        self.closed_dropped += connection.dropped
+        if connection.slow_consumer:
+            self.slow_consumers += 1
+
+    def metrics(self) -> dict:
+        """Send queue health across all connections"""
+        live = list(self.connections.values())
+        return {
+            "connections": len(live),
+            "queued_frames": sum(len(connection.queue) for connection in live),
+            "max_queue_depth": max(
+                (len(connection.queue) for connection in live), default=0
+            ),
+            "frames_sent": self.closed_sent
+            + sum(connection.sent for connection in live),
+            "frames_dropped": self.closed_dropped
+            + sum(connection.dropped for connection in live),
+            "slow_consumers_disconnected": self.slow_consumers,
+        }
 
     def get_additional_drift(self):
         # Inject into calculate
@@ -30,51 +146,326 @@ class PriceEngine:
             return 0
         return self.news_engine.get_total_eff()
 
-    async def broadcast(self, message):
+    def _all_tickers(self):
+        if not self.instrument_manager:
+            return []
+        return [instrument.id for instrument in self.instrument_manager.get_all_instruments()]
+
+    async def handle_message(self, websocket: WebSocket, data: str) -> Optional[dict]:
+        """Handle a subscribe / unsubscribe / resync request, returns the reply to send"""
+        try:
+            message = json.loads(data)
+            action = message["action"]
+            channel = message["channel"]
+            tickers = message.get("tickers") or [ALL_TICKERS]
+        except (ValueError, KeyError, TypeError):
+            return {"type": "error", "message": "Expected {action, channel, tickers}"}
+
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        if not isinstance(tickers, list) or not all(
+            isinstance(ticker, str) for ticker in tickers
+        ):
+            return {"type": "error", "message": "tickers must be a list of strings"}
+
+        if action not in REPLY_TYPES:
+            return {"type": "error", "message": f"Unknown action: {action}"}
+
+        if self.instrument_manager and channel != "news":
+            unknown = [
+                ticker
+                for ticker in tickers
+                if ticker != ALL_TICKERS
+                and not self.instrument_manager.is_valid_instrument(ticker)
+            ]
+            if unknown:
+                return {"type": "error", "message": f"Unknown tickers: {unknown}"}
+
+        try:
+            if action == "subscribe":
+                tickers = self.subscriptions.subscribe(websocket, channel, tickers)
+            elif action == "unsubscribe":
+                tickers = self.subscriptions.unsubscribe(websocket, channel, tickers)
+            elif channel not in ("prices", "depth"):
+                raise ValueError(f"Nothing to resync on channel: {channel}")
+        except ValueError as e:
+            return {"type": "error", "message": str(e)}
+
+        if action != "unsubscribe" and channel == "prices":
+            # current state, later frames only carry changes
+            data = self._prices_snapshot(tickers)
+            if data:
+                await self.send(websocket, self._prices_message(data, snapshot=True))
+
+        if action != "unsubscribe" and channel == "depth":
+            # snapshot, later frames only carry the levels that changed
+            if ALL_TICKERS in tickers:
+                tickers_to_send = self._all_tickers()
+            else:
+                tickers_to_send = tickers
+            for ticker in tickers_to_send:
+                await self.send(websocket, self._depth_message(ticker))
+
+        return {"type": REPLY_TYPES[action], "channel": channel, "tickers": tickers}
+
+    async def broadcast(self, message, droppable: bool = False):
+        """Send message to every connection on the legacy feed"""
+        legacy = [
+            connection
+            for connection in self.connections
+            if connection not in self.subscriptions
+        ]
+        await self.send_to(legacy, message, droppable)
+
+    async def send(self, websocket: WebSocket, message, droppable: bool = False):
+        """Send a single reply (pong, subscribe ack) with the configured encoder"""
+        self._enqueue(websocket, self.encoder.encode(message), droppable)
+
+    async def send_to(self, connections, message, droppable: bool = False):
         # None connected
-        if not self.active_connections:
+        if not connections:
             return
 
-        coros = []
-        for connection in self.active_connections:
-            coros.append(self._safe_send(connection, message))
+        # Encode once, every connection gets the same frame
+        frame = self.encoder.encode(message)
+        # a copy, a slow consumer cut off here leaves the subscriber sets
+        for connection in list(connections):
+            self._enqueue(connection, frame, droppable)
+
+    def _enqueue(self, websocket: WebSocket, frame: Frame, droppable: bool = False):
+        # Only queued here, the connection's writer task does the socket write
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.send(frame, droppable)
+
+    def _current_prices(self) -> dict:
+        return mark_prices(self.order_book, self._all_tickers())
+
+    def _price_changed(self, ticker: str, price: float) -> bool:
+        last = self.last_prices.get(ticker)
+        return last is None or (
+            price != last and abs(price - last) >= self.min_change
+        )
+
+    def price_update(self, prices: dict, now: Optional[float] = None):
+        """
+        Conflate a tick of prices against what was last sent
+        Returns (changed prices, is snapshot), changed is empty on a quiet tick
+        """
+        now = time.monotonic() if now is None else now
+        if (
+            self.last_snapshot_at is None
+            or now - self.last_snapshot_at >= self.snapshot_seconds
+        ):
+            self.last_snapshot_at = now
+            self.last_prices = dict(prices)
+            changed, snapshot = dict(prices), True
+        else:
+            changed = {
+                ticker: price
+                for ticker, price in prices.items()
+                if self._price_changed(ticker, price)
+            }
+            self.last_prices.update(changed)
+            snapshot = False
+        if changed:
+            self.price_seq += 1
+        return changed, snapshot
+
+    async def publish_price_tick(self):
+        """Send the tickers that changed since the last tick, legacy and topic mode"""
+        changed, snapshot = self.price_update(self._current_prices())
+        if changed:
+            await self.broadcast(changed, droppable=True)
+            await self.publish_prices(changed, snapshot)
+        await self.resync_stale_prices()
+
+    async def resync_stale_prices(self):
+        """Connections that had price ticks dropped get a snapshot instead"""
+        for websocket, connection in list(self.connections.items()):
+            if not connection.stale_prices:
+                continue
+            connection.stale_prices = False
+            if websocket not in self.subscriptions:
+                await self.send(websocket, dict(self.last_prices), droppable=True)
+                continue
+            data = self._prices_snapshot(self.subscriptions.tickers("prices", websocket))
+            if data:
+                await self.send(
+                    websocket, self._prices_message(data, snapshot=True), droppable=True
+                )
+
+    def _prices_snapshot(self, tickers) -> dict:
+        if ALL_TICKERS in tickers:
+            return dict(self.last_prices)
+        return {
+            ticker: self.last_prices[ticker]
+            for ticker in sorted(tickers)
+            if ticker in self.last_prices
+        }
+
+    def _prices_message(self, data: dict, snapshot: bool = False) -> dict:
+        return {
+            "type": "prices",
+            "seq": self.price_seq,
+            "snapshot": snapshot,
+            "data": data,
+        }
+
+    async def publish_prices(self, prices: dict, snapshot: bool = False):
+        """
+        Each prices subscriber gets one frame with just the tickers it follows
+        Connections following the same tickers share a frame, so it is only
+        encoded once per distinct subscription
+        """
+        followed: Dict[WebSocket, set] = {}
+        for (channel, ticker), connections in self.subscriptions.topics.items():
+            if channel != "prices":
+                continue
+            for connection in connections:
+                followed.setdefault(connection, set()).add(ticker)
+
+        groups: Dict[frozenset, list] = {}
+        for connection, tickers in followed.items():
+            key = frozenset((ALL_TICKERS,)) if ALL_TICKERS in tickers else frozenset(tickers)
+            groups.setdefault(key, []).append(connection)
 
-        # Run all concurrently instead of sequentially
-        await asyncio.gather(*coros, return_exceptions=True)
+        for tickers, connections in groups.items():
+            if ALL_TICKERS in tickers:
+                data = prices
+            else:
+                data = {ticker: prices[ticker] for ticker in sorted(tickers) if ticker in prices}
+            if not data:
+                continue
+            frame = self.encoder.encode(self._prices_message(data, snapshot))
+            for connection in connections:
+                self._enqueue(connection, frame, droppable=True)
+
+    def _depth_book(self, ticker: str) -> dict:
+        book = self.depth_books.get(ticker)
+        if book is None:
+            snapshot = self.order_book.depth_snapshot(ticker, self.DEPTH_LEVELS)
+            book = {
+                "seq": 0,
+                "version": snapshot["version"],
+                "bids": snapshot["bids"],
+                "asks": snapshot["asks"],
+            }
+            self.depth_books[ticker] = book
+        return book
+
+    def _depth_message(self, ticker: str) -> dict:
+        book = self._depth_book(ticker)
+        return {
+            "type": "depth",
+            "ticker": ticker,
+            "seq": book["seq"],
+            "version": book["version"],
+            "bids": book["bids"],
+            "asks": book["asks"],
+        }
+
+    @staticmethod
+    def _level_changes(old: List[dict], new: List[dict]) -> List[dict]:
+        """Levels that changed, a level that left the top is sent with quantity 0"""
+        old_levels = {level["price"]: level for level in old}
+        new_prices = {level["price"] for level in new}
+        changes = [level for level in new if old_levels.get(level["price"]) != level]
+        changes.extend(
+            {"price": price, "quantity": 0, "orders": 0}
+            for price in old_levels
+            if price not in new_prices
+        )
+        return changes
+
+    async def publish_depth(self):
+        """Send the changed levels of every subscribed ticker whose book moved"""
+        for ticker in self._all_tickers():
+            if not self.subscriptions.has_subscribers("depth", ticker):
+                continue
+            book = self._depth_book(ticker)
+            version = self.order_book.book_version(ticker)
+            if book["version"] == version:
+                continue
+
+            snapshot = self.order_book.depth_snapshot(ticker, self.DEPTH_LEVELS)
+            bids = self._level_changes(book["bids"], snapshot["bids"])
+            asks = self._level_changes(book["asks"], snapshot["asks"])
+            book["version"] = version
+            book["bids"] = snapshot["bids"]
+            book["asks"] = snapshot["asks"]
+            if not bids and not asks:
+                # the book moved below the levels we publish
+                continue
+
+            book["seq"] += 1
+            await self.send_to(
+                self.subscriptions.subscribers("depth", ticker),
+                {
+                    "type": "depth_update",
+                    "ticker": ticker,
+                    "seq": book["seq"],
+                    "version": version,
+                    "bids": bids,
+                    "asks": asks,
+                },
+            )
+
+    async def publish_news(self):
+        """Send news activated since the last tick to news subscribers"""
+        if not self.news_engine:
+            return
+        new_ids = self.news_engine.active_news_ids - self.sent_news_ids
+        if not new_ids:
+            return
+        self.sent_news_ids |= new_ids
+
+        subscribers = self.subscriptions.subscribers("news")
+        if not subscribers:
+            return
+        data = [
+            {
+                "id": news.id,
+                "headline": news.headline,
+                "description": news.description,
+                "ts_release_ms": news.ts_release_ms,
+            }
+            for news in self.news_engine.news_objects
+            if news.id in new_ids
+        ]
+        await self.send_to(subscribers, {"type": "news", "data": data})
 
-    async def _safe_send(self, connection: WebSocket, message):
+    async def forward_trades(self):
+        """Relay executions from the matching engine to trades subscribers"""
+        queue = self.order_book.executions.subscribe_queue()
         try:
-            await connection.send_json(message)
-        except Exception as e:
-            logger.error(f"Error broadcasting to connection: {e}", exc_info=True)
-            self.disconnect(connection)
+            while True:
+                execution = await queue.get()
+                if not self.subscriptions.has_subscribers("trades", execution.ticker):
+                    continue
+                await self.send_to(
+                    self.subscriptions.subscribers("trades", execution.ticker),
+                    {
+                        "type": "trade",
+                        "ticker": execution.ticker,
+                        "price": execution.price,
+                        "quantity": execution.quantity,
+                        "side": execution.taker_side.value,
+                        "seq": execution.seq,
+                        "timestamp": execution.timestamp,
+                    },
+                )
+        finally:
+            self.order_book.executions.unsubscribe(queue)
 
     async def run(self):
         self.is_running = True
+        trades_task = asyncio.create_task(self.forward_trades())
         while self.is_running:
             try:
-                broadcast_unit = {}
-                for ticker in self.instrument_manager.get_all_instruments():
-                    # Try mid price first
-                    price = self.order_book.mid_price(ticker.id)
-                    
-                    # Fallback to best bid/ask if mid price not available
-                    if price is None:
-                        best_bid = self.order_book.best_bid(ticker.id)
-                        best_ask = self.order_book.best_ask(ticker.id)
-                        
-                        if best_bid and best_ask:
-                            price = (best_bid.price + best_ask.price) / 2
-                        elif best_bid:
-                            price = best_bid.price
-                        elif best_ask:
-                            price = best_ask.price
-                    
-                    # Only include if we have a valid price
-                    if price is not None:
-                        broadcast_unit[ticker.id] = price
-                
-                await self.broadcast(broadcast_unit)
+                await self.publish_price_tick()
+                await self.publish_depth()
+                await self.publish_news()
                 await asyncio.sleep(0.5)  # Broadcast every 0.5 seconds
             except asyncio.CancelledError:
                 self.is_running = False
@@ -82,3 +473,4 @@ class PriceEngine:
             except Exception as e:
                 logger.error(f"Error in price engine: {e}")
                 await asyncio.sleep(0.5)
+        trades_task.cancel()
@@ -0,0 +1,93 @@
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+CHANNELS = ("prices", "depth", "trades", "news")
+
+# Subscribing to this ticker means every ticker on the channel
+ALL_TICKERS = "*"
+
+Topic = Tuple[str, str]
+
+
+class SubscriptionRegistry:
+    """
+    Which connections listen to which (channel, ticker) topic
+
+    topics maps a topic to the set of connections subscribed to it, so a
+    publish only touches the interested connections. connection_topics is
+    the reverse index used to clean up when a connection goes away
+    """
+
+    def __init__(self):
+        self.topics: Dict[Topic, Set[Hashable]] = {}
+        self.connection_topics: Dict[Hashable, Set[Topic]] = {}
+
+    def __contains__(self, connection: Hashable) -> bool:
+        """A connection is in the registry once it has subscribed to anything"""
+        return connection in self.connection_topics
+
+    @staticmethod
+    def _validate(channel: str) -> None:
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel: {channel}")
+
+    def subscribe(
+        self, connection: Hashable, channel: str, tickers: Iterable[str]
+    ) -> List[str]:
+        self._validate(channel)
+        own_topics = self.connection_topics.setdefault(connection, set())
+        added = []
+        for ticker in tickers:
+            topic = (channel, ticker)
+            self.topics.setdefault(topic, set()).add(connection)
+            own_topics.add(topic)
+            added.append(ticker)
+        return added
+
+    def unsubscribe(
+        self, connection: Hashable, channel: str, tickers: Iterable[str]
+    ) -> List[str]:
+        self._validate(channel)
+        own_topics = self.connection_topics.get(connection, set())
+        removed = []
+        for ticker in tickers:
+            topic = (channel, ticker)
+            if topic not in own_topics:
+                continue
+            own_topics.discard(topic)
+            self._drop(topic, connection)
+            removed.append(ticker)
+        # an emptied subscription list keeps the connection out of legacy mode
+        return removed
+
+    def remove(self, connection: Hashable) -> None:
+        for topic in self.connection_topics.pop(connection, set()):
+            self._drop(topic, connection)
+
+    def _drop(self, topic: Topic, connection: Hashable) -> None:
+        connections = self.topics.get(topic)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.topics[topic]
+
+    def subscribers(self, channel: str, ticker: str = ALL_TICKERS) -> Set[Hashable]:
+        """Connections subscribed to ticker on channel, directly or through ALL_TICKERS"""
+        direct = self.topics.get((channel, ticker), set())
+        if ticker == ALL_TICKERS:
+            return direct
+        wildcard = self.topics.get((channel, ALL_TICKERS), set())
+        if not wildcard:
+            return direct
+        return direct | wildcard
+
+    def has_subscribers(self, channel: str, ticker: str = ALL_TICKERS) -> bool:
+        return (channel, ticker) in self.topics or (channel, ALL_TICKERS) in self.topics
+
+    def tickers(self, channel: str, connection: Hashable) -> Set[str]:
+        """Tickers a connection follows on channel (may contain ALL_TICKERS)"""
+        return {
+            ticker
+            for topic_channel, ticker in self.connection_topics.get(connection, ())
+            if topic_channel == channel
+        }
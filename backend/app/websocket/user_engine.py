@@ -0,0 +1,441 @@
+import asyncio
+import functools
+import json
+import time
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket
+from pydantic import ValidationError
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.deps import get_logger, get_user_from_token
+from app.db.database import engine
+from app.schemas.order import OrderCreate
+from app.schemas.user import UserInDB
+from app.services.execution import Execution
+from app.services.portfolio import mark_prices
+from app.websocket.connection import ClientConnection
+from app.websocket.encoding import JSONEncoder
+
+logger = get_logger(__name__)
+
+
+def load_user(token: str) -> Optional[UserInDB]:
+    with Session(engine) as db:
+        return get_user_from_token(db, token)
+
+
+class UserSession:
+    """Everything streamed to one user, shared by all of that user's connections"""
+
+    def __init__(self, user: UserInDB):
+        self.user_id = str(user.id)
+        self.user = user
+        self.connections: Set[ClientConnection] = set()
+        self.execution_callback = None
+        # order log seq last sent, the next orders frame starts after it
+        self.order_seq = 0
+        self.portfolio_dirty = True
+        self.last_portfolio: Optional[dict] = None
+        # one orders fetch at a time, so frames never overlap
+        self.orders_lock = asyncio.Lock()
+
+
+class UserEngine:
+    """
+    Private updates for one user over /ws/user
+
+    The client authenticates once with the JWT from /auth/login, either as
+    ?token=... or as the first message {"action": "auth", "token": "..."},
+    and then receives for that user only:
+        fill       {"type": "fill", "seq", "order_id", "ticker", "side", "price",
+                   "quantity", "liquidity", "timestamp"}, as the engine executes
+        orders     {"type": "orders", "seq", "data": [...]}, history rows (as in
+                   GET /trading/orders) created or changed since the last frame,
+                   seq can be passed to GET /trading/orders?since= to catch up
+        portfolio  {"type": "portfolio", ...} (as GET /portfolio/), at most every
+                   portfolio_interval seconds and only when it changed
+
+    Fills come straight from the execution bus, new and cancelled orders are
+    picked up from the order log every ORDERS_INTERVAL seconds. Order history,
+    portfolios and order entry go through trading (TradingService, or an
+    EngineClient when the engine runs in its own process)
+
+    Orders can be entered on the same connection, every request carries a
+    client_order_id that is echoed in the answer:
+        {"action": "new", "client_order_id", "symbol", "side", "order_type",
+         "quantity", "price"}
+        {"action": "cancel", "client_order_id", "order_id"}
+        {"action": "amend", "client_order_id", "order_id", "price", "quantity"}
+    answered with {"type": "ack", "action", "client_order_id", "order_id", ...}
+    or {"type": "reject", "action", "client_order_id", "reason", "message"}.
+    {"type": "pending", "action", "client_order_id", "message"} means the
+    engine process didn't answer in time, the request may still have been
+    applied, the fills and order updates that follow on this stream tell.
+    Amend is cancel / replace: the replacement gets a new order_id and loses
+    time priority, if it is rejected the original keeps resting unchanged
+    """
+
+    AUTH_TIMEOUT_SECONDS = 10
+    ORDERS_INTERVAL = 0.25
+    INITIAL_ORDERS = 50
+
+    def __init__(
+        self,
+        order_book=None,
+        instrument_manager=None,
+        trading=None,
+        encoder=None,
+        portfolio_interval: float = 1.0,
+        max_queue: int = 256,
+        max_lag: float = 5.0,
+    ):
+        self.order_book = order_book
+        self.instrument_manager = instrument_manager
+        self.trading = trading
+        self.encoder = encoder or JSONEncoder()
+        self.portfolio_interval = portfolio_interval
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.is_running = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.sessions: Dict[str, UserSession] = {}
+        # marks the portfolios were last computed at
+        self.last_prices: Dict[str, float] = {}
+        # websocket -> (connection, user id)
+        self.connections: Dict[WebSocket, tuple] = {}
+
+    async def authenticate(
+        self, websocket: WebSocket, token: Optional[str] = None
+    ) -> Optional[UserInDB]:
+        """The active user behind the connection's token, None if it doesn't check out"""
+        if token is None:
+            try:
+                data = await asyncio.wait_for(
+                    websocket.receive_text(), self.AUTH_TIMEOUT_SECONDS
+                )
+                message = json.loads(data)
+                if message["action"] != "auth":
+                    return None
+                token = message["token"]
+            except (asyncio.TimeoutError, ValueError, KeyError, TypeError):
+                return None
+
+        # one DB lookup per connection, not per message
+        user = await run_in_threadpool(load_user, token)
+        if user is None or not user.is_active:
+            return None
+        return user
+
+    async def reject(self, websocket: WebSocket, message: str):
+        """Tell an unauthenticated client why and close the socket"""
+        frame = self.encoder.encode({"type": "error", "message": message})
+        try:
+            if self.encoder.binary:
+                await websocket.send_bytes(frame)
+            else:
+                await websocket.send_text(frame)
+            await websocket.close(code=1008)
+        except Exception:
+            pass
+
+    async def connect(self, websocket: WebSocket, user: UserInDB):
+        """
+        Start streaming to an accepted, authenticated connection
+        If the initial state can't be loaded (engine down) the connection is
+        closed again and the error raised
+        """
+        self.loop = asyncio.get_running_loop()
+        connection = ClientConnection(
+            websocket,
+            binary=self.encoder.binary,
+            max_queue=self.max_queue,
+            max_lag=self.max_lag,
+            on_close=self._connection_closed,
+        )
+        session = self.sessions.get(str(user.id))
+        new_session = session is None
+        if new_session:
+            session = self._open_session(user)
+        session.connections.add(connection)
+        self.connections[websocket] = (connection, session.user_id)
+        connection.start()
+        try:
+            await self._send_initial_state(connection, session, user, new_session)
+        except BaseException:
+            connection.close()
+            raise
+
+    async def _send_initial_state(
+        self,
+        connection: ClientConnection,
+        session: UserSession,
+        user: UserInDB,
+        new_session: bool,
+    ):
+        connection.send(
+            self.encoder.encode(
+                {
+                    "type": "authenticated",
+                    "user_id": user.id,
+                    "username": user.username,
+                }
+            )
+        )
+        async with session.orders_lock:
+            orders = await self.trading.orders(session.user_id, limit=self.INITIAL_ORDERS)
+            if new_session:
+                session.order_seq = orders["seq"]
+            if orders["seq"]:
+                connection.send(
+                    self.encoder.encode(
+                        {"type": "orders", "seq": session.order_seq, "data": orders["data"]}
+                    )
+                )
+        prices = self._current_prices()
+        portfolios = await self.trading.portfolios([session.user_id], prices)
+        portfolio = self._portfolio_message(session, portfolios[session.user_id])
+        session.last_portfolio = portfolio
+        connection.send(self.encoder.encode(portfolio))
+
+    def _open_session(self, user: UserInDB) -> UserSession:
+        session = UserSession(user)
+        session.execution_callback = functools.partial(
+            self._dispatch_execution, session.user_id
+        )
+        self.order_book.executions.subscribe(
+            session.execution_callback, user_id=session.user_id
+        )
+        self.sessions[session.user_id] = session
+        return session
+
+    def disconnect(self, websocket: WebSocket):
+        # may be called twice, by a slow consumer cut off and by the socket loop
+        entry = self.connections.get(websocket)
+        if entry is not None:
+            entry[0].close()
+
+    def _connection_closed(self, connection: ClientConnection):
+        entry = self.connections.get(connection.websocket)
+        if entry is None or entry[0] is not connection:
+            return
+        del self.connections[connection.websocket]
+        session = self.sessions.get(entry[1])
+        if session is None:
+            return
+        session.connections.discard(connection)
+        if not session.connections:
+            self.order_book.executions.unsubscribe(
+                session.execution_callback, user_id=session.user_id
+            )
+            del self.sessions[session.user_id]
+
+    async def send(self, websocket: WebSocket, message):
+        """Send a single reply (pong, errors) with the configured encoder"""
+        entry = self.connections.get(websocket)
+        if entry is not None:
+            entry[0].send(self.encoder.encode(message))
+
+    async def handle_message(self, websocket: WebSocket, data: str) -> Optional[dict]:
+        """Handle an order entry request, returns the ack / reject to send"""
+        entry = self.connections.get(websocket)
+        if entry is None:
+            return None
+        try:
+            message = json.loads(data)
+            action = message["action"]
+        except (ValueError, KeyError, TypeError):
+            return {"type": "error", "message": "Expected {action, client_order_id, ...}"}
+
+        user_id = entry[1]
+        if action not in ("new", "cancel", "amend"):
+            return {"type": "error", "message": f"Unknown action: {action}"}
+        if not message.get("client_order_id"):
+            return self._reject(message, "INVALID_ORDER", "client_order_id is required")
+
+        if action == "new":
+            try:
+                order_data = OrderCreate.model_validate(message)
+            except ValidationError as e:
+                return self._reject(message, "INVALID_ORDER", e.errors()[0]["msg"])
+            result = await self.trading.new_order(user_id, order_data)
+        elif action == "cancel":
+            result = await self.trading.cancel_order(user_id, message.get("order_id"))
+        else:
+            result = await self.trading.amend_order(
+                user_id,
+                message.get("order_id"),
+                message.get("price"),
+                message.get("quantity"),
+            )
+
+        if result["accepted"] is None:
+            return {
+                "type": "pending",
+                "action": action,
+                "client_order_id": message["client_order_id"],
+                "message": result["message"],
+            }
+        if not result["accepted"]:
+            return self._reject(message, result["status"], result["message"])
+        reply = {
+            "type": "ack",
+            "action": action,
+            "client_order_id": message["client_order_id"],
+        }
+        for key in ("order_id", "status", "price", "unprocessed_quantity", "replaced_order_id"):
+            if key in result:
+                reply[key] = result[key]
+        return reply
+
+    @staticmethod
+    def _reject(message: dict, reason: str, text: str) -> dict:
+        return {
+            "type": "reject",
+            "action": message.get("action"),
+            "client_order_id": message.get("client_order_id"),
+            "reason": reason,
+            "message": text,
+        }
+
+    def _send_session(self, session: UserSession, message: dict, droppable: bool = False):
+        frame = self.encoder.encode(message)
+        for connection in list(session.connections):
+            connection.send(frame, droppable)
+
+    def _dispatch_execution(self, user_id: str, execution: Execution):
+        # called on the matching thread, hand over to the event loop
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._on_execution, user_id, execution)
+
+    def _on_execution(self, user_id: str, execution: Execution):
+        session = self.sessions.get(user_id)
+        if session is None:
+            return
+        # a self-trade is a fill on both sides
+        roles = []
+        if execution.taker_user_id == user_id:
+            roles.append(("taker", execution.taker_order_id, execution.taker_side))
+        if execution.maker_user_id == user_id:
+            roles.append(("maker", execution.maker_order_id, execution.maker_side))
+
+        for liquidity, order_id, side in roles:
+            self._send_session(
+                session,
+                {
+                    "type": "fill",
+                    "seq": execution.seq,
+                    "order_id": self.order_book.public_order_id(user_id, order_id),
+                    "ticker": execution.ticker,
+                    "side": side.value,
+                    "price": execution.price,
+                    "quantity": execution.quantity,
+                    "liquidity": liquidity,
+                    "timestamp": execution.timestamp,
+                },
+            )
+        session.portfolio_dirty = True
+        task = asyncio.ensure_future(self._flush_orders(session))
+        task.add_done_callback(self._flush_done)
+
+    @staticmethod
+    def _flush_done(task: asyncio.Task):
+        # the run loop picks the orders up on its next round
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Could not flush orders after a fill: {task.exception()}")
+
+    async def _flush_orders(self, session: UserSession, seq: Optional[int] = None):
+        """Orders frame with what changed since the last one, seq skips the check when known"""
+        async with session.orders_lock:
+            if seq is None:
+                seq = (await self.trading.order_seqs([session.user_id]))[session.user_id]
+            if seq == session.order_seq:
+                return
+            orders = await self.trading.orders(session.user_id, since=session.order_seq)
+            session.order_seq = orders["seq"]
+            self._send_session(
+                session, {"type": "orders", "seq": orders["seq"], "data": orders["data"]}
+            )
+
+    async def publish_orders(self):
+        """New and cancelled orders, fills already flushed theirs"""
+        if not self.sessions:
+            return
+        # one round for everyone's seq, orders are only fetched where it moved
+        seqs = await self.trading.order_seqs(list(self.sessions))
+        for user_id, seq in seqs.items():
+            session = self.sessions.get(user_id)
+            if session is not None and seq != session.order_seq:
+                await self._flush_orders(session, seq)
+
+    def _current_prices(self) -> dict:
+        if not self.instrument_manager:
+            return {}
+        # portfolio pushes must not move the clamp, however many users are on
+        return mark_prices(
+            self.order_book,
+            [instrument.id for instrument in self.instrument_manager.get_all_instruments()],
+            peek=True,
+        )
+
+    def _portfolio_message(self, session: UserSession, portfolio: dict) -> dict:
+        return {
+            "type": "portfolio",
+            "user_id": session.user.id,
+            "username": session.user.username,
+            **portfolio,
+        }
+
+    async def publish_portfolios(self):
+        """
+        Portfolio of every connected user whose fills or marks changed
+        Prices are marked once for all users
+        """
+        if not self.sessions:
+            return
+        prices = self._current_prices()
+        marks_moved = prices != self.last_prices
+        self.last_prices = prices
+        due = {}
+        for session in list(self.sessions.values()):
+            stale = False
+            for connection in session.connections:
+                stale |= connection.stale_prices
+                connection.stale_prices = False
+            if marks_moved or session.portfolio_dirty or stale:
+                session.portfolio_dirty = False
+                due[session.user_id] = stale
+        if not due:
+            return
+
+        portfolios = await self.trading.portfolios(list(due), prices)
+        for user_id, stale in due.items():
+            session = self.sessions.get(user_id)
+            if session is None:
+                continue
+            message = self._portfolio_message(session, portfolios[user_id])
+            if message == session.last_portfolio and not stale:
+                continue
+            session.last_portfolio = message
+            self._send_session(session, message, droppable=True)
+
+    async def run(self):
+        self.is_running = True
+        self.loop = asyncio.get_running_loop()
+        last_portfolio_at = 0.0
+        while self.is_running:
+            try:
+                await self.publish_orders()
+                now = time.monotonic()
+                if now - last_portfolio_at >= self.portfolio_interval:
+                    last_portfolio_at = now
+                    await self.publish_portfolios()
+                await asyncio.sleep(self.ORDERS_INTERVAL)
+            except asyncio.CancelledError:
+                self.is_running = False
+                break
+            except Exception as e:
+                logger.error(f"Error in user engine: {e}")
+                await asyncio.sleep(self.ORDERS_INTERVAL)
@@ -1,48 +1,170 @@
+import asyncio
+
 import redis.asyncio as redis
 
 from app.core.config import settings
+from app.services.engine_rpc import EngineClient, RemoteNewsEngine
 from app.services.gbm_manager import GBMManager
 from app.services.instrument_manager import InstrumentManager
 from app.services.leaderboard import Leaderboard
 from app.services.liquidity_bot_manager import LiquidityBotManager
+from app.services.matching_engine import MatchingEngine
 from app.services.news import NewsShockSimulator
+from app.services.order_archiver import OrderArchiver
 from app.services.order_book import OrderBook
 from app.services.order_generator import OrderGenerator
+from app.services.order_processor import OrderProcessor
+from app.services.risk import RiskService
+from app.services.sharding import ShardedOrderBook
+from app.services.trading_service import TradingService
+from app.websocket.encoding import get_encoder
 from app.websocket.price_engine import PriceEngine
+from app.websocket.user_engine import UserEngine
 
 """
 For dependency injections, these are all singletons
 """
 
-news_engine = NewsShockSimulator()
 redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=False)
 leaderboard = Leaderboard(redis_client)
-order_book = OrderBook()
 instrument_manager = InstrumentManager()
+engine_client = None
+if settings.ENGINE_REMOTE:
+    # the market lives in the engine process (engine.py), this worker keeps
+    # replicas of its book and news state, connected on app startup
+    engine_client = EngineClient(settings.ENGINE_SOCKET, settings.SECRET_KEY.encode())
+    order_book = engine_client.order_book
+    news_engine = RemoteNewsEngine(engine_client)
+elif settings.ENGINE_SHARDS > 0:
+    # shard processes are started with the market
+    news_engine = NewsShockSimulator()
+    order_book = ShardedOrderBook(
+        instrument_manager.get_all_instruments(),
+        settings.ENGINE_SHARDS,
+        retention_seconds=settings.ORDER_RETENTION_SECONDS,
+        archive_interval=settings.ORDER_ARCHIVE_INTERVAL_SECONDS,
+    )
+else:
+    news_engine = NewsShockSimulator()
+    order_book = OrderBook()
 price_engine = PriceEngine(
     news_engine=news_engine,
     order_book=order_book,
     instrument_manager=instrument_manager,
+    encoder=get_encoder(settings.WS_ENCODER),
+    min_change=settings.WS_PRICE_MIN_CHANGE,
+    snapshot_seconds=settings.WS_PRICE_SNAPSHOT_SECONDS,
+    max_queue=settings.WS_SEND_QUEUE_SIZE,
+    max_lag=settings.WS_SLOW_CONSUMER_SECONDS,
 )
-gbm_manager = GBMManager(
-    instrument_manager, news_engine
-)  # Pass news engine to calculate drift
-order_generator = OrderGenerator(
-    instrument_manager=instrument_manager,
-    order_book=order_book,
-    gbm_manager=gbm_manager,
-)
-lb_manager = LiquidityBotManager(
-    instruments=instrument_manager.get_all_instruments(),
+
+if settings.ENGINE_REMOTE:
+    trading_service = engine_client
+    risk_service = order_processor = matching_engine = None
+    gbm_manager = order_generator = lb_manager = order_archiver = None
+else:
+    risk_service = RiskService(order_book)
+    order_processor = OrderProcessor(
+        order_book, price_engine, instrument_manager, risk_service=risk_service
+    )
+    matching_engine = None
+    if not settings.ENGINE_SHARDS:
+        # a sharded book's shards each apply their own orders in turn, orders
+        # for different shards are matched at the same time (see TradingService)
+        matching_engine = MatchingEngine(
+            max_batch=settings.ENGINE_MAX_BATCH, max_queue=settings.ENGINE_QUEUE_SIZE
+        )
+    trading_service = TradingService(
+        order_book, order_processor, instrument_manager, matching_engine
+    )
+    gbm_manager = GBMManager(
+        instrument_manager, news_engine, order_book
+    )  # Pass news engine to calculate drift, GBM prices are the peg reference
+    order_generator = OrderGenerator(
+        instrument_manager=instrument_manager,
+        order_book=order_book,
+        gbm_manager=gbm_manager,
+    )
+    lb_manager = LiquidityBotManager(
+        instruments=instrument_manager.get_all_instruments(),
+        order_book=order_book,
+        gbm_manager=gbm_manager,
+    )
+    order_archiver = OrderArchiver(
+        order_book=order_book,
+        retention_seconds=settings.ORDER_RETENTION_SECONDS,
+        interval_seconds=settings.ORDER_ARCHIVE_INTERVAL_SECONDS,
+    )
+user_engine = UserEngine(
     order_book=order_book,
-    gbm_manager=gbm_manager,
+    instrument_manager=instrument_manager,
+    trading=trading_service,
+    encoder=get_encoder(settings.WS_ENCODER),
+    portfolio_interval=settings.WS_PORTFOLIO_INTERVAL_SECONDS,
+    max_queue=settings.WS_SEND_QUEUE_SIZE,
+    max_lag=settings.WS_SLOW_CONSUMER_SECONDS,
 )
 
 
+def start_market():
+    """
+    Start everything that moves the market, in the API process or in the
+    engine process (engine.py) when ENGINE_REMOTE is set for the workers
+    """
+
+    """
+    Start the shard processes when the book is partitioned by instrument,
+    and keep their market state current, otherwise the single writer that
+    applies queued orders to the order book
+    """
+    if settings.ENGINE_SHARDS:
+        order_book.start()
+        asyncio.create_task(order_book.run())
+    else:
+        asyncio.create_task(matching_engine.run())
+
+    """
+    Initialize GBM manager
+    """
+    asyncio.create_task(gbm_manager.run())
+
+    """
+    Start news engine to adjust add. drift
+    """
+    asyncio.create_task(news_engine.run())
+
+    """
+    Start liquidity bots, a sharded book runs them inside its shards
+    """
+    if not settings.ENGINE_SHARDS:
+        asyncio.create_task(lb_manager.run())
+
+    """
+    Start order generator to place orders every 5 seconds
+    """
+    asyncio.create_task(order_generator.run())
+
+    """
+    Move filled and cancelled orders out of memory once past retention
+    (shards sweep their own books)
+    """
+    asyncio.create_task(order_archiver.run())
+
+
+def engine_metrics() -> dict:
+    if settings.ENGINE_SHARDS:
+        return order_book.metrics()
+    return matching_engine.metrics()
+
+
 def get_price_engine() -> PriceEngine:
     return price_engine
 
 
+def get_user_engine() -> UserEngine:
+    return user_engine
+
+
 def get_news_engine() -> NewsShockSimulator:
     return news_engine
 
@@ -59,6 +181,18 @@ def get_instrument_manager() -> InstrumentManager:
     return instrument_manager
 
 
+def get_order_processor() -> OrderProcessor:
+    return order_processor
+
+
+def get_matching_engine() -> MatchingEngine:
+    return matching_engine
+
+
+def get_trading_service() -> TradingService:
+    return trading_service
+
+
 def get_gbm_manager() -> GBMManager:
     return gbm_manager
 
@@ -0,0 +1,50 @@
+"""
+Trading Simulator engine process
+Runs the order book, matching engine, simulators and bots for API workers
+started with ENGINE_REMOTE=true, e.g.
+
+    python engine.py
+    ENGINE_REMOTE=true uvicorn main:app --workers 4
+"""
+
+import asyncio
+
+from app.core.config import settings
+from app.core.deps import get_logger
+from app.core.logging import setup_logging
+
+# this process is the engine, the singletons below are the real market
+settings.ENGINE_REMOTE = False
+
+import dependencies  # noqa: E402
+from app.services.engine_rpc import EngineServer  # noqa: E402
+
+logger = get_logger(__name__)
+
+
+async def main():
+    dependencies.start_market()
+    server = EngineServer(
+        settings.ENGINE_SOCKET,
+        settings.SECRET_KEY.encode(),
+        trading=dependencies.trading_service,
+        order_book=dependencies.order_book,
+        instrument_manager=dependencies.instrument_manager,
+        news_engine=dependencies.news_engine,
+        metrics=dependencies.engine_metrics,
+    )
+    await server.start()
+    try:
+        await server.run()
+    finally:
+        await server.stop()
+        if settings.ENGINE_SHARDS:
+            dependencies.order_book.stop()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Engine stopped")
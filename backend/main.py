@@ -4,20 +4,20 @@ Main entry point for the trading simulator backend
 """
 
 import asyncio
+from typing import Optional
 
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, HTTPException, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.api_v1.api import api_router
 from app.core.config import settings
 from app.core.logging import setup_logging
 from dependencies import (
-    gbm_manager,
-    instrument_manager,
-    lb_manager,
-    news_engine,
-    order_generator,
+    engine_client,
+    engine_metrics as local_engine_metrics,
     price_engine,
+    start_market,
+    user_engine,
 )
 
 # Setup logging
@@ -54,6 +54,21 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/ws/metrics")
+async def websocket_metrics():
+    return price_engine.metrics()
+
+
+@app.get("/engine/metrics")
+async def engine_metrics():
+    if engine_client is None:
+        return local_engine_metrics()
+    try:
+        return await engine_client.metrics()
+    except ConnectionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
 @app.get("/version")
 async def version_check():
     return {"version": "1.0.0"}
@@ -62,9 +77,12 @@ async def version_check():
 @app.on_event("startup")
 async def startup_event():
     """
-    Initialize GBM manager
+    Connect to the engine process, or run the market in this process
     """
-    asyncio.create_task(gbm_manager.run())
+    if engine_client is not None:
+        asyncio.create_task(engine_client.run())
+    else:
+        start_market()
 
     """
     Start price engine for GBM
@@ -72,19 +90,9 @@ async def startup_event():
     asyncio.create_task(price_engine.run())
 
     """
-    Start news engine to adjust add. drift
-    """
-    asyncio.create_task(news_engine.run())
-
-    """
-    Start liquidity bots
-    """
-    asyncio.create_task(lb_manager.run())
-
-    """
-    Start order generator to place orders every 5 seconds
+    Push fills, order updates and portfolio to /ws/user clients
     """
-    asyncio.create_task(order_generator.run())
+    asyncio.create_task(user_engine.run())
 
 
 @app.websocket("/ws/market")
@@ -94,17 +102,49 @@ async def websocket_market(websocket: WebSocket):
     await price_engine.connect(websocket)
     try:
         while True:
-            data = await websocket.receive_text()  # ping
+            data = await websocket.receive_text()  # ping or (un)subscribe
             if data == "ping":
-                await websocket.send_json(
-                    {"type": "pong", "timestamp": time.time()}
+                await price_engine.send(
+                    websocket, {"type": "pong", "timestamp": time.time()}
                 )  # pong
+            else:
+                reply = await price_engine.handle_message(websocket, data)
+                if reply:
+                    await price_engine.send(websocket, reply)
     except Exception as e:
         pass
     finally:
         price_engine.disconnect(websocket)
 
 
+@app.websocket("/ws/user")
+async def websocket_user(websocket: WebSocket, token: Optional[str] = None):
+    import time
+
+    await websocket.accept()
+    user = await user_engine.authenticate(websocket, token)
+    if user is None:
+        await user_engine.reject(websocket, "Could not validate credentials")
+        return
+
+    try:
+        await user_engine.connect(websocket, user)
+        while True:
+            data = await websocket.receive_text()
+            if data == "ping":
+                await user_engine.send(
+                    websocket, {"type": "pong", "timestamp": time.time()}
+                )
+            else:
+                reply = await user_engine.handle_message(websocket, data)
+                if reply:
+                    await user_engine.send(websocket, reply)
+    except Exception as e:
+        pass
+    finally:
+        user_engine.disconnect(websocket)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,80 @@
+"""
+Matching engine benchmark - Measures matches per second through OrderBook.match_order
+
+Usage:
+    python scripts/benchmark_matching.py [--orders 20000] [--repeat 3] [--seed 7]
+
+A book is seeded with resting asks, then the same number of marketable buys is
+sent through match_order. The "engine" run builds BookOrder directly (bots and the
+generator), the "api" run builds a pydantic OrderModel per order and lets the
+engine convert it, which is what a POST /trading/orders pays. The best of --repeat runs is reported.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.schemas.order import OrderModel, OrderSide
+from app.services.book_order import BookOrder
+from app.services.order_book import OrderBook
+
+
+def seed_book(order_book: OrderBook, n_orders: int, rng: random.Random) -> None:
+    for i in range(n_orders):
+        order_book.add_order(
+            BookOrder(
+                price=round(100 + rng.random() * 5, 2),
+                quantity=5,
+                ticker="BENCH",
+                side=OrderSide.SELL,
+                user_id=f"maker_{i}",
+            )
+        )
+
+
+def run_once(n_orders: int, seed: int, use_model: bool) -> tuple[float, int]:
+    rng = random.Random(seed)
+    order_book = OrderBook()
+    seed_book(order_book, n_orders, rng)
+    order_cls = OrderModel if use_model else BookOrder
+
+    fills = 0
+    start = time.perf_counter()
+    for i in range(n_orders):
+        order = order_cls(
+            price=200,
+            quantity=rng.choice((3, 5, 7)),
+            ticker="BENCH",
+            side=OrderSide.BUY,
+            user_id=f"taker_{i % 50}",
+        )
+        before = len(order_book.fulfilled_orders)
+        order_book.match_order(order)
+        fills += len(order_book.fulfilled_orders) - before
+    return time.perf_counter() - start, fills
+
+
+def run(n_orders: int, seed: int, use_model: bool, repeat: int) -> float:
+    elapsed, fills = min(run_once(n_orders, seed, use_model) for _ in range(repeat))
+
+    label = "api (OrderModel)" if use_model else "engine (BookOrder)"
+    print(
+        f"{label:<20} {n_orders / elapsed:>10.0f} orders/s "
+        f"{fills / elapsed:>10.0f} fully filled orders/s"
+    )
+    return n_orders / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    run(args.orders, args.seed, use_model=False, repeat=args.repeat)
+    run(args.orders, args.seed, use_model=True, repeat=args.repeat)
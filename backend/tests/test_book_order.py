@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from app.schemas.order import OrderModel, OrderSide
+from app.services.book_order import BookOrder
+from app.services.order_book import OrderBook
+
+
+class TestBookOrder(TestCase):
+    def setUp(self):
+        self.model = OrderModel(
+            price=101.5,
+            quantity=5,
+            ticker="AAPL",
+            user_id="u1",
+            side=OrderSide.BUY,
+        )
+
+    def test_round_trip_keeps_fields(self):
+        """Test converting an API order into the engine and back"""
+        order = BookOrder.from_model(self.model)
+        self.assertIsNone(order.id)
+        self.assertEqual(order.external_id, self.model.id)
+        self.assertEqual(order.price, 101.5)
+        self.assertEqual(order.quantity, 5)
+
+        model = order.to_model()
+        self.assertEqual(model.id, self.model.id)
+        self.assertEqual(model.side, OrderSide.BUY)
+        self.assertEqual(
+            model.created_at.replace(tzinfo=None), self.model.created_at
+        )
+
+    def test_book_stores_engine_orders(self):
+        """Test that the book converts API orders and leaves the caller's copy alone"""
+        order_book = OrderBook()
+        order_book.add_order(self.model)
+
+        resting = order_book.best_bid("AAPL")
+        self.assertIsInstance(resting, BookOrder)
+
+        order_book.match_order(
+            OrderModel(
+                price=101, quantity=2, ticker="AAPL", user_id="u2", side=OrderSide.SELL
+            )
+        )
+        self.assertEqual(resting.quantity, 3)
+        self.assertEqual(self.model.quantity, 5)
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app.schemas.order import OrderCreate, OrderModel, OrderSide, OrderType
+from app.services.engine_rpc import EngineClient, EngineServer
+from app.services.order_book import OrderBook
+from app.services.order_processor import OrderProcessor
+from app.services.trading_service import TradingService
+
+
+class DummyInstrument:
+    id = "AAPL"
+    full_name = "Apple Inc."
+
+
+class DummyInstrumentManager:
+    def get_all_instruments(self):
+        return [DummyInstrument()]
+
+    def is_valid_instrument(self, ticker):
+        return ticker == "AAPL"
+
+
+class TestEngineRPC(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "engine.sock")
+
+        self.order_book = OrderBook()
+        instrument_manager = DummyInstrumentManager()
+        self.trading = TradingService(
+            self.order_book,
+            OrderProcessor(self.order_book, None, instrument_manager),
+            instrument_manager,
+        )
+        self.server = EngineServer(
+            self.path,
+            b"secret",
+            trading=self.trading,
+            order_book=self.order_book,
+            instrument_manager=instrument_manager,
+        )
+        self.client = EngineClient(self.path, b"secret")
+
+        self.ask = OrderModel(
+            price=101, quantity=10, ticker="AAPL", user_id="2", side=OrderSide.SELL
+        )
+        self.order_book.match_order(self.ask)
+        self.order_book.match_order(
+            OrderModel(price=99, quantity=10, ticker="AAPL", user_id="2", side=OrderSide.BUY)
+        )
+
+        self.tasks = []
+        self.addCleanup(self._close_loop)
+        self._run(self.server.start())
+        self._start(self.client.run())
+        self._run(self._until(lambda: self.client.connected))
+
+    def _close_loop(self):
+        async def stop():
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.server.stop()
+            await asyncio.sleep(0)
+
+        self.loop.run_until_complete(stop())
+        self.loop.close()
+
+    def _start(self, coro):
+        self.tasks.append(self.loop.create_task(coro))
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    async def _until(self, condition, timeout=5.0):
+        deadline = self.loop.time() + timeout
+        while not condition():
+            if self.loop.time() > deadline:
+                raise AssertionError("condition not met in time")
+            await asyncio.sleep(0.01)
+
+    def _buy(self, quantity=4, price=101):
+        return OrderCreate(
+            symbol="AAPL",
+            side=OrderSide.BUY,
+            order_type=OrderType.LIMIT,
+            quantity=quantity,
+            price=price,
+        )
+
+    def test_market_replica_on_connect(self):
+        """Test that a worker sees the engine's top of book and depth once connected"""
+        replica = self.client.order_book
+        self._run(self._until(lambda: replica.has_ticker("AAPL")))
+        self.assertEqual(replica.best_ask("AAPL").price, 101)
+        self.assertEqual(replica.best_bid("AAPL").quantity, 10)
+        self.assertEqual(replica.mid_price("AAPL"), self.order_book.mid_price("AAPL"))
+        self.assertEqual(
+            replica.depth_snapshot("AAPL", 1), self.order_book.depth_snapshot("AAPL", 1)
+        )
+
+    def test_order_entry_and_execution_stream(self):
+        """Test that an order placed by a worker fills in the engine and streams back"""
+        executions = []
+        self.client.order_book.executions.subscribe(executions.append, user_id="2")
+
+        result = self._run(self.client.new_order("1", self._buy()))
+        self.assertTrue(result["accepted"])
+        self.assertEqual(result["status"], "filled")
+        self.assertEqual(self.order_book.find_order(self.ask.id).quantity, 6)
+
+        self._run(self._until(lambda: executions))
+        execution = executions[0]
+        self.assertEqual(execution.quantity, 4)
+        self.assertEqual(execution.seq, self.order_book.executions.recent[-1].seq)
+        self.assertEqual(
+            self.client.order_book.public_order_id("2", execution.maker_order_id),
+            str(self.ask.id),
+        )
+
+        self.server.publish_market()
+        self._run(
+            self._until(lambda: self.client.order_book.best_ask("AAPL").quantity == 6)
+        )
+
+    def test_reads_and_rejects_go_through_the_engine(self):
+        """Test that order history, portfolio and rejects come from the engine"""
+        result = self._run(self.client.new_order("1", self._buy(quantity=501)))
+        self.assertFalse(result["accepted"])
+        self.assertEqual(result["status"], "ORDER_SIZE_EXCEEDED")
+
+        orders = self._run(self.client.orders("2", limit=1))
+        self.assertEqual(orders["seq"], self.order_book.order_logs["2"].seq)
+        self.assertEqual(len(orders["data"]), 1)
+        seqs = self._run(self.client.order_seqs(["1", "2"]))
+        self.assertEqual(seqs["1"], 0)
+
+        portfolio = self._run(self.client.portfolio("2"))
+        self.assertEqual(portfolio, self._run(self.trading.portfolio("2")))
+
+    def test_engine_unavailable(self):
+        """Test that order entry is rejected and reads fail while disconnected"""
+        self._run(self.server.stop())
+        self._run(self._until(lambda: not self.client.connected))
+
+        result = self._run(self.client.new_order("1", self._buy()))
+        self.assertEqual(result["status"], "ENGINE_UNAVAILABLE")
+        with self.assertRaises(ConnectionError):
+            self._run(self.client.orders("1"))
+
+    def test_unanswered_order_is_pending(self):
+        """Test that an order the engine doesn't confirm in time isn't reported as rejected"""
+
+        async def stalled(user_id, order_data):
+            await asyncio.sleep(1)
+
+        self.server.methods["new_order"] = stalled
+        self.client.CALL_TIMEOUT = 0.05
+        result = self._run(self.client.new_order("1", self._buy()))
+        self.assertIsNone(result["accepted"])
+        self.assertEqual(result["status"], "PENDING")
+
+    def test_engine_errors_keep_their_type(self):
+        """Test that an exception raised in the engine is raised again in the worker"""
+
+        def failing():
+            raise ValueError("no metrics")
+
+        self.server.methods["metrics"] = failing
+        with self.assertRaisesRegex(ValueError, "no metrics"):
+            self._run(self.client.metrics())
+
+    def test_publishing_market_keeps_previous_mid(self):
+        """Test that pushing market state doesn't move the mid the spread clamp starts from"""
+        self.order_book.previous_mid.pop("AAPL", None)
+        self.server.publish_market()
+        self.assertNotIn("AAPL", self.order_book.previous_mid)
+        self.server.take_mids()
+        self.assertEqual(self.order_book.previous_mid["AAPL"], 100)
+
+    def test_bad_authkey_refused(self):
+        """Test that a worker without the engine's key never gets connected"""
+        intruder = EngineClient(self.path, b"wrong")
+        with self.assertRaises(ConnectionError):
+            self._run(intruder._session())
+        self.assertFalse(intruder.connected)
+
+    def test_engine_must_know_the_authkey(self):
+        """Test that a worker refuses a process that answers on the socket without the key"""
+        self._run(self.server.stop())
+        frames = []
+
+        async def impostor(reader, writer):
+            writer.write(os.urandom(32))
+            await reader.readexactly(64)
+            writer.write(os.urandom(32))
+            frames.append(await reader.read(1))
+            writer.close()
+
+        async def serve():
+            return await asyncio.start_unix_server(impostor, path=self.path)
+
+        server = self._run(serve())
+        self.addCleanup(server.close)
+        client = EngineClient(self.path, b"secret")
+        with self.assertRaisesRegex(ConnectionError, "does not know the authkey"):
+            self._run(client._session())
+        self.assertFalse(client.connected)
+        self._run(self._until(lambda: frames))
+        self.assertEqual(frames, [b""])
+
+    def test_socket_directory_must_be_private(self):
+        """Test that neither side uses a socket in a directory others can enter"""
+        os.chmod(os.path.dirname(self.path), 0o755)
+        with self.assertRaises(PermissionError):
+            self._run(EngineClient(self.path, b"secret")._session())
+        with self.assertRaises(PermissionError):
+            self._run(self.server.start())
@@ -0,0 +1,91 @@
+import asyncio
+from unittest import TestCase
+
+from app.schemas.order import OrderModel, OrderSide
+from app.services.order_book import OrderBook
+
+
+class TestExecutionBus(TestCase):
+    def setUp(self):
+        self.order_book = OrderBook()
+        for price, user_id in ((101, "m1"), (102, "m2")):
+            self.order_book.match_order(
+                OrderModel(
+                    price=price,
+                    quantity=5,
+                    ticker="AAPL",
+                    user_id=user_id,
+                    side=OrderSide.SELL,
+                )
+            )
+
+    def _buy(self, quantity=8, user_id="t1"):
+        self.order_book.match_order(
+            OrderModel(
+                price=102,
+                quantity=quantity,
+                ticker="AAPL",
+                user_id=user_id,
+                side=OrderSide.BUY,
+            )
+        )
+
+    def test_match_publishes_one_execution_per_fill(self):
+        """Test that each fill is published with taker, maker and a sequence number"""
+        received = []
+        self.order_book.executions.subscribe(received.append)
+        self._buy()
+
+        self.assertEqual(
+            [(e.price, e.quantity, e.maker_user_id) for e in received],
+            [(101, 5, "m1"), (102, 3, "m2")],
+        )
+        self.assertEqual([e.seq for e in received], [1, 2])
+        self.assertTrue(all(e.taker_user_id == "t1" for e in received))
+        self.assertEqual(received[0].maker_side, OrderSide.SELL)
+        self.assertEqual(list(self.order_book.executions.recent), received)
+
+    def test_taker_is_recorded_before_publishing(self):
+        """Test that subscribers already find the taker's order in its history"""
+        seen = []
+
+        def record(execution):
+            seen.append(
+                self.order_book.order_logs["t1"].get(execution.taker_order_id)["status"]
+            )
+
+        self.order_book.executions.subscribe(record)
+        self._buy()
+        self.assertEqual(seen, ["filled", "filled"])
+
+    def test_user_subscription_only_sees_own_fills(self):
+        """Test that a per-user subscriber only gets executions it took part in"""
+        received = []
+        self.order_book.executions.subscribe(received.append, user_id="m2")
+        self._buy()
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].side_for("m2"), OrderSide.SELL)
+
+    def test_failing_subscriber_does_not_break_matching(self):
+        """Test that an exception in a subscriber is contained"""
+
+        def broken(execution):
+            raise RuntimeError("boom")
+
+        self.order_book.executions.subscribe(broken)
+        self._buy(quantity=5)
+        self.assertEqual(self.order_book.best_ask("AAPL").price, 102)
+
+    def test_queue_subscriber_drops_oldest_when_full(self):
+        """Test that a slow queue consumer keeps only the newest executions"""
+
+        async def consume():
+            queue = self.order_book.executions.subscribe_queue(maxsize=1)
+            self._buy()
+            await asyncio.sleep(0)
+            return queue.dropped, await queue.get()
+
+        dropped, execution = asyncio.run(consume())
+        self.assertEqual(dropped, 1)
+        self.assertEqual(execution.seq, 2)
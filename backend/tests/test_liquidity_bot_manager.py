@@ -0,0 +1,126 @@
+import random
+from unittest import TestCase
+
+from app.schemas.order import OrderModel, OrderSide
+from app.services.liquidity_bot_manager import LiquidityBotManager
+from app.services.order_book import OrderBook
+
+
+class TestLiquidityBotManager(TestCase):
+    def setUp(self):
+        self.order_book = OrderBook()
+
+        class DummyInstrument:
+            id = "AAPL"
+            s_0 = 100.0
+
+        self.manager = LiquidityBotManager(
+            instruments=[DummyInstrument()], order_book=self.order_book
+        )
+        self.bot = self.manager.liquidity_bots["AAPL"]
+        self.manager.process_book_snapshot(
+            {
+                "type": "book_snapshot",
+                "instrumentId": "AAPL",
+                "bids": [[99.0, 50], [98.0, 40]],
+                "asks": [[101.0, 50], [102.0, 40]],
+            }
+        )
+
+    def _trade(self, side, price, quantity):
+        self.order_book.match_order(
+            OrderModel(
+                price=price, quantity=quantity, ticker="AAPL", user_id="u1", side=side
+            )
+        )
+
+    def test_inventory_updated_on_fill(self):
+        """Test that bot inventory moves as soon as its quotes trade"""
+        self._trade(OrderSide.BUY, 101.0, 20)
+        self.assertEqual(self.bot.inventory, -20)
+
+        self._trade(OrderSide.SELL, 98.0, 60)
+        self.assertEqual(self.bot.inventory, 40)
+
+    def test_requote_does_not_count_fills_again(self):
+        """Test that replacing quotes after a fill leaves inventory alone"""
+        self._trade(OrderSide.BUY, 102.0, 60)
+        self.assertEqual(self.bot.inventory, -60)
+
+        self.manager.process_book_snapshot(
+            {
+                "type": "book_snapshot",
+                "instrumentId": "AAPL",
+                "bids": [[99.0, 50]],
+                "asks": [[101.5, 50]],
+            }
+        )
+        self.assertEqual(self.bot.inventory, -60)
+        self.assertEqual(self.order_book.best_ask("AAPL").price, 101.5)
+
+    def test_pegged_quotes_follow_reference(self):
+        """Test that with a peg reference the bot's quotes move without a requote"""
+        self.order_book.set_peg_reference("AAPL", 100.0)
+        self.manager.process_book_snapshot(
+            {
+                "type": "book_snapshot",
+                "instrumentId": "AAPL",
+                "bids": [[99.0, 50]],
+                "asks": [[101.0, 50]],
+            }
+        )
+        best_ask = self.order_book.best_ask("AAPL")
+        self.assertEqual(best_ask.peg_offset, 1.0)
+
+        self.order_book.set_peg_reference("AAPL", 105.0)
+        self.assertEqual(self.order_book.best_bid("AAPL").price, 104.0)
+        self.assertIs(self.order_book.best_ask("AAPL"), best_ask)
+        self.assertEqual(best_ask.price, 106.0)
+
+        self._trade(OrderSide.BUY, 106.0, 10)
+        self.assertEqual(self.bot.inventory, -10)
+
+    def _count_requotes(self, threshold, ticks=50):
+        """Ticks on which the bot's resting pegged quotes were replaced"""
+        random.seed(7)
+        order_book = OrderBook()
+        reference = {"price": 100.0}
+
+        class DummyInstrument:
+            id = "AAPL"
+            s_0 = 100.0
+
+        class DummyGBMManager:
+            def get_ticker_current_gbm_price(self, ticker):
+                return reference["price"]
+
+        manager = LiquidityBotManager(
+            instruments=[DummyInstrument()],
+            order_book=order_book,
+            gbm_manager=DummyGBMManager(),
+        )
+        manager.REQUOTE_THRESHOLD = threshold
+        manager.liquidity_bots["AAPL"].quote_noise_sigma = 0.001
+
+        def resting_ids():
+            quotes = order_book.quotes[(manager.bot_user_id("AAPL"), "AAPL")]
+            return {order.id for side in quotes.values() for order, _ in side.values()}
+
+        requotes = 0
+        previous = None
+        for _ in range(ticks):
+            reference["price"] *= 1 + random.gauss(0, 0.002)
+            order_book.set_peg_reference("AAPL", reference["price"])
+            manager.quote_all()
+            current = resting_ids()
+            if previous is not None and current != previous:
+                requotes += 1
+            previous = current
+        return requotes
+
+    def test_quote_noise_does_not_requote_pegged_levels(self):
+        """Test that small offset changes leave the bot's pegged quotes resting"""
+        noisy = self._count_requotes(threshold=0)
+        stable = self._count_requotes(threshold=LiquidityBotManager.REQUOTE_THRESHOLD)
+        self.assertGreater(noisy, 40)
+        self.assertLess(stable, noisy // 4)
@@ -0,0 +1,90 @@
+import asyncio
+from unittest import TestCase
+
+from app.schemas.order import OrderSide
+from app.services.book_order import BookOrder
+from app.services.matching_engine import MatchingEngine
+from app.services.order_book import OrderBook
+
+
+class TestMatchingEngine(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.order_book = OrderBook()
+        self.engine = MatchingEngine(max_batch=3, max_queue=5)
+
+    def _order(self, side, price, quantity=1, user_id="1"):
+        return BookOrder(
+            price=price, quantity=quantity, ticker="AAPL", side=side, user_id=user_id
+        )
+
+    def _run(self, coro):
+        """Run coro while the engine drains its queue"""
+        async def with_engine():
+            task = asyncio.ensure_future(self.engine.run())
+            try:
+                return await coro
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+        return self.loop.run_until_complete(with_engine())
+
+    def test_results_come_back_in_order(self):
+        """Test that queued commands are applied in submission order"""
+        async def submit():
+            futures = [
+                self.engine.submit(self.order_book.match_order, self._order(OrderSide.SELL, 101)),
+                self.engine.submit(self.order_book.match_order, self._order(OrderSide.BUY, 101)),
+            ]
+            return await asyncio.gather(*futures)
+
+        sell, buy = self._run(submit())
+        self.assertEqual(sell[1], 1)
+        self.assertEqual(buy[1], 0)
+        self.assertEqual(buy[2], 101)
+        self.assertIsNone(self.order_book.best_ask("AAPL"))
+
+    def test_batches_and_metrics(self):
+        """Test that a burst is drained in batches of at most max_batch"""
+        async def burst():
+            futures = [
+                self.engine.submit(self.order_book.match_order, self._order(OrderSide.BUY, 90 + i))
+                for i in range(5)
+            ]
+            return await asyncio.gather(*futures)
+
+        self._run(burst())
+        metrics = self.engine.metrics()
+        self.assertEqual(metrics["processed"], 5)
+        self.assertEqual(metrics["batches"], 2)
+        self.assertEqual(metrics["largest_batch"], 3)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertEqual(self.order_book.best_bid("AAPL").price, 94)
+
+    def test_errors_reach_the_caller(self):
+        """Test that an exception fails only its own command"""
+        def fail():
+            raise ValueError("bad order")
+
+        async def submit():
+            failed = self.engine.submit(fail)
+            ok = self.engine.submit(lambda: "ok")
+            with self.assertRaises(ValueError):
+                await failed
+            return await ok
+
+        self.assertEqual(self._run(submit()), "ok")
+
+    def test_full_queue_refuses_commands(self):
+        """Test that submit raises QueueFull once max_queue commands are waiting"""
+        async def overfill():
+            futures = [self.engine.submit(lambda: None) for _ in range(5)]
+            self.assertEqual(self.engine.queue_depth, 5)
+            with self.assertRaises(asyncio.QueueFull):
+                self.engine.submit(lambda: None)
+            await asyncio.gather(*futures)
+
+        self._run(overfill())
+        self.assertEqual(self.engine.metrics()["rejected"], 1)
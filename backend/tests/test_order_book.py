@@ -1,6 +1,8 @@
 from unittest import TestCase
 
 from app.schemas.order import OrderModel, OrderSide, OrderStatus
+from app.services.book_order import BookOrder
+from app.services.book_side import BookSide
 from app.services.order_book import OrderBook
 
 
@@ -44,10 +46,10 @@ class TestOrderBook(TestCase):
 
         # Verify best bid is correct
         self.assertEqual(len(self.order_book.buys["AAPL"]), 2)
-        best_bid_prices = [order.price for _, _, order in self.order_book.buys["AAPL"]]
+        best_bid_prices = [order.price for order in self.order_book.buys["AAPL"]]
         self.assertIn(100, best_bid_prices)
         self.assertIn(101, best_bid_prices)
-        self.assertEqual(self.order_book.buys["AAPL"][0][2].price, max(best_bid_prices))
+        self.assertEqual(self.order_book.best_bid("AAPL").price, max(best_bid_prices))
 
     def test_order_insertion_end(self):
         """Test inserting sell orders at the end of the order book"""
@@ -55,10 +57,10 @@ class TestOrderBook(TestCase):
         self.order_book.add_order(self.sell_order_102)
 
         self.assertEqual(len(self.order_book.sells["AAPL"]), 2)
-        sell_prices = [order.price for _, _, order in self.order_book.sells["AAPL"]]
+        sell_prices = [order.price for order in self.order_book.sells["AAPL"]]
         self.assertIn(102, sell_prices)
         self.assertIn(103, sell_prices)
-        self.assertEqual(self.order_book.sells["AAPL"][0][2].price, min(sell_prices))
+        self.assertEqual(self.order_book.best_ask("AAPL").price, min(sell_prices))
 
     def test_order_insertion_middle(self):
         """Test inserting orders in the middle of the order book"""
@@ -79,10 +81,10 @@ class TestOrderBook(TestCase):
         )
 
         self.assertEqual(len(self.order_book.buys["AAPL"]), 3)
-        prices = [order.price for _, _, order in self.order_book.buys["AAPL"]]
+        prices = [order.price for order in self.order_book.buys["AAPL"]]
         for p in [100, 102, 105]:
             self.assertIn(p, prices)
-        self.assertEqual(self.order_book.buys["AAPL"][0][2].price, max(prices))
+        self.assertEqual(self.order_book.best_bid("AAPL").price, max(prices))
 
     def test_order_matching_partial(self):
         """Test partial order matching"""
@@ -91,17 +93,17 @@ class TestOrderBook(TestCase):
         buy_order = OrderModel(
             price=103, quantity=15, ticker="AAPL", user_id="u1", side=OrderSide.BUY
         )
-        status, remaining_qty = self.order_book.match_order(buy_order)
+        status, remaining_qty, _ = self.order_book.match_order(buy_order)
 
         self.assertEqual(status, OrderStatus.PARTIALLY_FILLED)
         self.assertEqual(remaining_qty, 7)
 
-        # Sell heap should be empty
+        # Sell side should be empty
         self.assertEqual(len(self.order_book.sells["AAPL"]), 0)
 
         # Buy order should be in the book with remaining quantity
         self.assertEqual(len(self.order_book.buys["AAPL"]), 1)
-        self.assertEqual(self.order_book.buys["AAPL"][0][2].quantity, 7)
+        self.assertEqual(self.order_book.best_bid("AAPL").quantity, 7)
 
     def test_order_matching_full(self):
         """Test full order matching"""
@@ -110,14 +112,14 @@ class TestOrderBook(TestCase):
         buy_order = OrderModel(
             price=103, quantity=5, ticker="AAPL", user_id="u1", side=OrderSide.BUY
         )
-        status, remaining_qty = self.order_book.match_order(buy_order)
+        status, remaining_qty, _ = self.order_book.match_order(buy_order)
 
         self.assertEqual(status, OrderStatus.FILLED)
         self.assertEqual(remaining_qty, 0)
 
         self.assertEqual(len(self.order_book.sells["AAPL"]), 1)
         self.assertEqual(len(self.order_book.buys.get("AAPL", [])), 0)
-        self.assertEqual(self.order_book.sells["AAPL"][0][2].quantity, 3)
+        self.assertEqual(self.order_book.best_ask("AAPL").quantity, 3)
 
     def test_order_matching_no_match(self):
         """Test order matching when no match is possible"""
@@ -126,7 +128,7 @@ class TestOrderBook(TestCase):
         buy_order = OrderModel(
             price=100, quantity=5, ticker="AAPL", user_id="u1", side=OrderSide.BUY
         )
-        status, remaining_qty = self.order_book.match_order(buy_order)
+        status, remaining_qty, _ = self.order_book.match_order(buy_order)
 
         self.assertEqual(status, OrderStatus.OPEN)
         self.assertEqual(remaining_qty, 5)
@@ -138,7 +140,7 @@ class TestOrderBook(TestCase):
         self.order_book.add_order(self.buy_order_100)
         self.assertEqual(len(self.order_book.buys["AAPL"]), 1)
 
-        result = self.order_book.remove_order(self.order_book.buys["AAPL"][0][2])
+        result = self.order_book.remove_order(self.order_book.best_bid("AAPL"))
         self.assertTrue(result)
         self.assertEqual(len(self.order_book.buys["AAPL"]), 0)
 
@@ -169,13 +171,13 @@ class TestOrderBook(TestCase):
         buy_order = OrderModel(
             price=103, quantity=7, ticker="AAPL", user_id="u3", side=OrderSide.BUY
         )
-        status, remaining_qty = self.order_book.match_order(buy_order)
+        status, remaining_qty, _ = self.order_book.match_order(buy_order)
 
         self.assertEqual(status, OrderStatus.FILLED)
         self.assertEqual(remaining_qty, 0)
 
         # After match, one sell order remains with quantity 1
-        remaining_sells = [o[2] for o in self.order_book.sells["AAPL"]]
+        remaining_sells = list(self.order_book.sells["AAPL"])
         self.assertEqual(len(remaining_sells), 1)
         self.assertEqual(remaining_sells[0].quantity, 1)
         self.assertEqual(remaining_sells[0].price, 102)
@@ -336,3 +338,501 @@ class TestOrderBook(TestCase):
         # Best ask without clamp should show the best ask which is the outlier 0.1
         best_ask_unclamped = self.order_book.best_ask("AAPL")
         self.assertEqual(best_ask_unclamped.price, 0.1)
+
+    def test_same_price_time_priority(self):
+        """Test that orders at the same price are matched in arrival order"""
+        first = OrderModel(
+            price=102, quantity=2, ticker="AAPL", user_id="u1", side=OrderSide.SELL
+        )
+        second = OrderModel(
+            price=102, quantity=2, ticker="AAPL", user_id="u2", side=OrderSide.SELL
+        )
+        self.order_book.add_order(first)
+        self.order_book.add_order(second)
+
+        buy_order = OrderModel(
+            price=102, quantity=3, ticker="AAPL", user_id="u3", side=OrderSide.BUY
+        )
+        self.order_book.match_order(buy_order)
+
+        # first is fully filled, second keeps its place with 1 left
+        self.assertIn(
+            self.order_book.external_ids[first.id], self.order_book.fulfilled_orders
+        )
+        self.assertEqual(self.order_book.best_ask("AAPL").external_id, second.id)
+        self.assertEqual(self.order_book.best_ask("AAPL").quantity, 1)
+
+    def test_price_levels_sorted(self):
+        """Test that bids and asks are returned best price first"""
+        for price in [100, 98, 101, 99]:
+            self.order_book.add_order(
+                OrderModel(
+                    price=price,
+                    quantity=1,
+                    ticker="AAPL",
+                    user_id="u1",
+                    side=OrderSide.BUY,
+                )
+            )
+        for price in [105, 103, 104]:
+            self.order_book.add_order(
+                OrderModel(
+                    price=price,
+                    quantity=1,
+                    ticker="AAPL",
+                    user_id="u2",
+                    side=OrderSide.SELL,
+                )
+            )
+
+        self.assertEqual(
+            [o.price for o in self.order_book.get_bids("AAPL")], [101, 100, 99, 98]
+        )
+        self.assertEqual(
+            [o.price for o in self.order_book.get_asks("AAPL")], [103, 104, 105]
+        )
+        self.assertEqual(self.order_book.buys["AAPL"].prices, [98, 99, 100, 101])
+
+    def test_order_removal_keeps_level_queue(self):
+        """Test cancelling an order from the middle of a price level"""
+        orders = [
+            OrderModel(
+                price=100, quantity=1, ticker="AAPL", user_id=f"u{i}", side=OrderSide.BUY
+            )
+            for i in range(3)
+        ]
+        for order in orders:
+            self.order_book.add_order(order)
+
+        self.assertTrue(self.order_book.remove_order(orders[1]))
+        self.assertFalse(self.order_book.remove_order(orders[1]))
+
+        remaining = [o.external_id for o in self.order_book.get_bids("AAPL")]
+        self.assertEqual(remaining, [orders[0].id, orders[2].id])
+
+        self.order_book.remove_order(orders[0])
+        self.order_book.remove_order(orders[2])
+        self.assertEqual(len(self.order_book.buys["AAPL"]), 0)
+        self.assertEqual(self.order_book.buys["AAPL"].prices, [])
+
+    def test_ladder_keeps_dropped_levels_out_of_the_index(self):
+        """Test that levels dropped and re-added keep the price index sorted and live"""
+        book = BookSide(is_bid=True)
+        for i in range(200):
+            order = BookOrder(
+                price=100 + i % 7, quantity=1, ticker="AAPL", side=OrderSide.BUY,
+                user_id="u1", id=i,
+            )
+            book.add(order)
+            if i % 3:
+                book.remove(i)
+
+        self.assertEqual(book.prices, sorted(book.levels))
+        self.assertEqual([level.price for level in book.iter_levels()], book.prices[::-1])
+        self.assertEqual(book.best_level().price, max(book.prices))
+        self.assertEqual(book.best_level_within(103.5).price, 103)
+        self.assertIsNone(book.best_level_within(99))
+
+        for order_id in list(book.order_levels):
+            book.remove(order_id)
+        self.assertEqual(book.prices, [])
+        self.assertIsNone(book.best_level())
+
+    def test_clamp_cache_invalidated_by_book_and_clamp_changes(self):
+        """Test that the cached clamp answer follows the book and the clamp inputs"""
+        self.order_book.add_order(self.buy_order_100)
+        self.order_book.add_order(self.sell_order_102)
+        self.order_book.last_traded_price["AAPL"] = 101
+        self.order_book.mid_price("AAPL")
+
+        # clamp range is |101 - 101| = 0, so bids must be <= 101
+        self.assertEqual(self.order_book.best_bid_within_clamp("AAPL").price, 100)
+
+        # a better bid inside the clamp invalidates the cached answer
+        self.order_book.add_order(self.buy_order_101)
+        self.assertEqual(self.order_book.best_bid_within_clamp("AAPL").price, 101)
+
+        # moving the clamp below 101 changes the answer without touching the book
+        self.order_book.previous_mid["AAPL"] = 100.5
+        self.order_book.last_traded_price["AAPL"] = 100.5
+        self.assertEqual(self.order_book.best_bid_within_clamp("AAPL").price, 100)
+
+        # removing every bid inside the clamp leaves nothing
+        self.order_book.remove_order(self.buy_order_100)
+        self.assertIsNone(self.order_book.best_bid_within_clamp("AAPL"))
+
+    def test_depth_snapshot_cached_per_version(self):
+        """Test that depth snapshots are aggregated and rebuilt only on book changes"""
+        self.order_book.add_order(self.buy_order_100)
+        self.order_book.add_order(
+            OrderModel(
+                price=100, quantity=4, ticker="AAPL", user_id="u5", side=OrderSide.BUY
+            )
+        )
+        self.order_book.add_order(self.sell_order_102)
+
+        snapshot = self.order_book.depth_snapshot("AAPL", 5)
+        self.assertEqual(
+            snapshot["bids"], [{"price": 100, "quantity": 14, "orders": 2}]
+        )
+        self.assertEqual(
+            snapshot["asks"], [{"price": 102, "quantity": 8, "orders": 1}]
+        )
+
+        encoded = self.order_book.depth_snapshot_json("AAPL", 5, None)
+        self.assertIs(self.order_book.depth_snapshot_json("AAPL", 5, None), encoded)
+
+        # a partial fill is a book change, so the version moves and bytes rebuild
+        version = snapshot["version"]
+        self.order_book.match_order(
+            OrderModel(
+                price=100, quantity=3, ticker="AAPL", user_id="u6", side=OrderSide.SELL
+            )
+        )
+        snapshot = self.order_book.depth_snapshot("AAPL", 5)
+        self.assertGreater(snapshot["version"], version)
+        self.assertEqual(
+            snapshot["bids"], [{"price": 100, "quantity": 11, "orders": 2}]
+        )
+        self.assertIsNot(self.order_book.depth_snapshot_json("AAPL", 5, None), encoded)
+
+    def test_level_totals_follow_adds_fills_and_cancels(self):
+        """Test that per-level quantity and order count are kept incrementally"""
+        second_at_102 = OrderModel(
+            price=102, quantity=4, ticker="AAPL", user_id="u5", side=OrderSide.SELL
+        )
+        self.order_book.add_order(self.sell_order_102)
+        self.order_book.add_order(second_at_102)
+        self.order_book.add_order(self.sell_order_103)
+
+        level = self.order_book.sells["AAPL"].levels[102]
+        self.assertEqual((level.quantity, len(level)), (12, 2))
+
+        self.order_book.match_order(
+            OrderModel(
+                price=102, quantity=10, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+            )
+        )
+        self.assertEqual((level.quantity, len(level)), (2, 1))
+
+        self.order_book.remove_order(second_at_102)
+        self.assertNotIn(102, self.order_book.sells["AAPL"].levels)
+        self.assertEqual(
+            self.order_book.depth_snapshot("AAPL", 5)["asks"],
+            [{"price": 103, "quantity": 12, "orders": 1}],
+        )
+
+    def test_level_totals_after_cancel_from_busy_level(self):
+        """Test that cancelling one of several orders at a price updates the total"""
+        self.order_book.add_order(self.buy_order_100)
+        other = OrderModel(
+            price=100, quantity=4, ticker="AAPL", user_id="u5", side=OrderSide.BUY
+        )
+        self.order_book.add_order(other)
+
+        self.order_book.remove_order(self.buy_order_100)
+        level = self.order_book.buys["AAPL"].levels[100]
+        self.assertEqual((level.quantity, len(level)), (4, 1))
+
+    def test_sequence_ids_assigned_on_acceptance(self):
+        """Test that accepted orders get increasing integer ids"""
+        self.order_book.add_order(self.buy_order_100)
+        self.order_book.add_order(self.buy_order_101)
+        self.order_book.match_order(self.sell_order_103)
+
+        ids = [
+            self.order_book.external_ids[order.id]
+            for order in (self.buy_order_100, self.buy_order_101, self.sell_order_103)
+        ]
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(isinstance(order_id, int) for order_id in ids))
+
+        # the API UUID still resolves to the resting order
+        self.assertTrue(self.order_book.remove_order(self.buy_order_101))
+        self.assertEqual(self.order_book.best_bid("AAPL").id, ids[0])
+
+    def test_portfolio_from_user_positions(self):
+        """Test that the portfolio reflects each user's fills and nobody else's"""
+        self.order_book.add_order(self.sell_order_102)
+        buy = OrderModel(
+            price=102, quantity=5, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+        )
+        self.order_book.match_order(buy)
+
+        self.assertEqual(dict(self.order_book.get_portfolio("u1")), {"AAPL": 5})
+        self.assertEqual(dict(self.order_book.get_portfolio("u3")), {"AAPL": -5})
+        self.assertEqual(dict(self.order_book.get_portfolio("nobody")), {})
+
+    def test_order_history_status_follows_fills_and_cancels(self):
+        """Test that a trader's history tracks resting orders as they fill or cancel"""
+        self.order_book.match_order(self.sell_order_102)
+        self.order_book.match_order(self.sell_order_103)
+        buy = OrderModel(
+            price=102, quantity=5, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+        )
+        self.order_book.match_order(buy)
+
+        history = self.order_book.get_trader_orders_with_status("u3")
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0]["status"], "partially_filled")
+        self.assertEqual(history[0]["filled_quantity"], 5)
+        self.assertEqual(history[0]["order_id"], str(self.sell_order_102.id))
+
+        self.assertEqual(
+            self.order_book.get_trader_orders_with_status("u1")[0]["status"], "filled"
+        )
+
+        self.order_book.remove_order(self.sell_order_103)
+        self.assertEqual(
+            self.order_book.get_trader_orders_with_status("u4")[0]["status"],
+            "cancelled",
+        )
+
+    def test_order_history_limit_and_since(self):
+        """Test newest-first paging and fetching only what changed since a seq"""
+        orders = [
+            OrderModel(
+                price=90 + i, quantity=1, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+            )
+            for i in range(5)
+        ]
+        for order in orders:
+            self.order_book.match_order(order)
+
+        latest = self.order_book.get_trader_orders_with_status("u1", limit=2)
+        self.assertEqual(
+            [o["order_id"] for o in latest], [str(orders[4].id), str(orders[3].id)]
+        )
+
+        cursor = max(o["seq"] for o in latest)
+        self.assertEqual(
+            self.order_book.get_trader_orders_with_status("u1", since=cursor), []
+        )
+
+        # an older order fills, only it comes back
+        sell = OrderModel(
+            price=90, quantity=5, ticker="AAPL", user_id="u2", side=OrderSide.SELL
+        )
+        self.order_book.remove_order(orders[4])
+        self.order_book.match_order(sell)
+        changed = self.order_book.get_trader_orders_with_status("u1", since=cursor)
+        self.assertEqual(
+            [(o["order_id"], o["status"]) for o in changed],
+            [
+                (str(orders[4].id), "cancelled"),
+                (str(orders[3].id), "filled"),
+                (str(orders[2].id), "filled"),
+                (str(orders[1].id), "filled"),
+                (str(orders[0].id), "filled"),
+            ],
+        )
+
+    def test_archive_terminal_orders_reads_through(self):
+        """Test that archived orders leave the hot dicts but stay queryable"""
+        self.order_book.match_order(self.sell_order_102)
+        self.order_book.match_order(self.sell_order_103)
+        buy = OrderModel(
+            price=102, quantity=8, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+        )
+        self.order_book.match_order(buy)
+        self.order_book.remove_order(self.sell_order_103)
+        before = self.order_book.get_trader_orders_with_status("u3")
+
+        # nothing is old enough yet
+        moved = self.order_book.archive_terminal_orders(retention_seconds=60)
+        self.assertEqual(moved["orders"], 0)
+
+        later = self.order_book.terminal_orders[-1][0] + 61
+        moved = self.order_book.archive_terminal_orders(60, now=later)
+        self.assertEqual(moved["orders"], 3)
+        self.assertEqual(self.order_book.order_mapping, {})
+        self.assertEqual(self.order_book.fulfilled_orders, set())
+
+        self.assertEqual(self.order_book.get_trader_orders_with_status("u3"), before)
+        self.assertEqual(
+            self.order_book.check_order_status(self.sell_order_102), OrderStatus.FILLED
+        )
+        self.assertEqual(
+            self.order_book.check_order_fulfilled_amount(self.sell_order_102), 8
+        )
+        self.assertEqual(
+            self.order_book.get_trader_orders_with_status("u4")[0]["status"],
+            "cancelled",
+        )
+        self.assertEqual(len(self.order_book.order_logs["u1"].entries), 0)
+        self.assertEqual(
+            self.order_book.user_state_mapping["u1"].get_fulfilled_trades()[0]["quantity"],
+            8,
+        )
+
+    def test_archive_sweep_only_visits_changed_users(self):
+        """Test that a sweep skips traders with nothing terminal, later ones catch up"""
+        self.order_book.match_order(self.buy_order_100)
+        quiet_log = self.order_book.order_logs["u1"]
+        quiet_log.archive_terminal = None  # a visit would fail
+        sell = OrderModel(
+            price=200, quantity=1, ticker="AAPL", user_id="u2", side=OrderSide.SELL
+        )
+        self.order_book.match_order(sell)
+        self.order_book.remove_order(sell)
+
+        later = self.order_book.terminal_orders[-1][0] + 1
+        moved = self.order_book.archive_terminal_orders(0, now=later)
+        self.assertEqual(moved["history"], 1)
+        self.assertEqual(len(self.order_book.order_logs["u2"].archive), 1)
+
+        moved = self.order_book.archive_terminal_orders(0, now=later + 1)
+        self.assertEqual(moved, {"orders": 0, "history": 0, "fills": 0})
+
+    def test_archive_keeps_open_orders_hot(self):
+        """Test that an open order stays hot without holding back later terminal ones"""
+        self.order_book.match_order(self.buy_order_100)
+        sell = OrderModel(
+            price=200, quantity=1, ticker="AAPL", user_id="u1", side=OrderSide.SELL
+        )
+        self.order_book.match_order(sell)
+        self.order_book.remove_order(sell)
+
+        later = self.order_book.terminal_orders[-1][0] + 1
+        self.order_book.archive_terminal_orders(0, now=later)
+        order_log = self.order_book.order_logs["u1"]
+        self.assertEqual(len(order_log.entries), 1)
+        self.assertEqual(len(order_log.archive), 1)
+        self.assertIn(
+            self.order_book.external_ids[self.buy_order_100.id],
+            self.order_book.order_mapping,
+        )
+        self.assertEqual(
+            [o["order_id"] for o in self.order_book.get_trader_orders_with_status("u1")],
+            [str(sell.id), str(self.buy_order_100.id)],
+        )
+
+        # archived after the newer order, it still reads back in creation order
+        self.order_book.remove_order(self.buy_order_100)
+        later = self.order_book.terminal_orders[-1][0] + 1
+        self.order_book.archive_terminal_orders(0, now=later)
+        self.assertEqual(len(order_log.entries), 0)
+        self.assertEqual(
+            [
+                (o["order_id"], o["status"])
+                for o in self.order_book.get_trader_orders_with_status("u1")
+            ],
+            [(str(sell.id), "cancelled"), (str(self.buy_order_100.id), "cancelled")],
+        )
+        self.assertEqual(
+            order_log.get(order_log.archive.order_ids[0])["order_id"],
+            str(self.buy_order_100.id),
+        )
+
+    def test_order_archive_is_bounded(self):
+        """Test that a trader's order archive keeps only the newest orders"""
+        orders = [
+            OrderModel(
+                price=90, quantity=1, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+            )
+            for _ in range(10)
+        ]
+        for order in orders:
+            self.order_book.match_order(order)
+            self.order_book.remove_order(order)
+        order_log = self.order_book.order_logs["u1"]
+        order_log.archive.max_orders = 8
+
+        later = self.order_book.terminal_orders[-1][0] + 1
+        self.order_book.archive_terminal_orders(0, now=later)
+        self.assertEqual(len(order_log.archive), 8)
+        self.assertEqual(order_log.archive.dropped, 2)
+        self.assertEqual(
+            [o["order_id"] for o in self.order_book.get_trader_orders_with_status("u1")],
+            [str(order.id) for order in reversed(orders[2:])],
+        )
+
+    def test_replace_quotes_diffs_ladders(self):
+        """Test that unchanged quotes stay put and each side changes version once"""
+        self.order_book.replace_quotes(
+            "bot", "AAPL", [[99, 10], [98, 20]], [[101, 10], [102, 20]]
+        )
+        kept_bid = self.order_book.best_bid("AAPL")
+        bid_version = self.order_book.buys["AAPL"].version
+        ask_version = self.order_book.sells["AAPL"].version
+
+        fills = self.order_book.replace_quotes(
+            "bot", "AAPL", [[99, 10], [97, 30]], [[101, 5], [102, 20]]
+        )
+        self.assertEqual(fills, [])
+        self.assertIs(self.order_book.best_bid("AAPL"), kept_bid)
+        self.assertEqual(self.order_book.buys["AAPL"].version, bid_version + 1)
+        self.assertEqual(self.order_book.sells["AAPL"].version, ask_version + 1)
+        self.assertEqual(
+            [(o.price, o.quantity) for o in self.order_book.get_bids("AAPL")],
+            [(99, 10), (97, 30)],
+        )
+        self.assertEqual(
+            [(o.price, o.quantity) for o in self.order_book.get_asks("AAPL")],
+            [(101, 5), (102, 20)],
+        )
+
+        # nothing changed, nothing touched
+        self.order_book.replace_quotes(
+            "bot", "AAPL", [[99, 10], [97, 30]], [[101, 5], [102, 20]]
+        )
+        self.assertEqual(self.order_book.buys["AAPL"].version, bid_version + 1)
+
+    def test_replace_quotes_reports_fills(self):
+        """Test that fills on the previous quotes are returned once"""
+        self.order_book.replace_quotes("bot", "AAPL", [], [[101, 10], [102, 20]])
+        buy = OrderModel(
+            price=102, quantity=15, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+        )
+        self.order_book.match_order(buy)
+
+        fills = self.order_book.replace_quotes("bot", "AAPL", [], [[101, 10], [102, 15]])
+        self.assertEqual(
+            sorted(fills), [(OrderSide.SELL, 101, 10), (OrderSide.SELL, 102, 5)]
+        )
+        # the partially filled quote already matches the new ladder and is kept
+        self.assertEqual(
+            [(o.price, o.quantity) for o in self.order_book.get_asks("AAPL")],
+            [(101, 10), (102, 15)],
+        )
+        self.assertEqual(
+            self.order_book.replace_quotes("bot", "AAPL", [], [[101, 10], [102, 15]]),
+            [],
+        )
+
+    def test_pegged_orders_follow_the_reference(self):
+        """Test that pegged orders move with the reference and reads never change the book"""
+        self.order_book.set_peg_reference("AAPL", 100.0)
+        pegged = BookOrder(
+            price=0,
+            quantity=5,
+            ticker="AAPL",
+            side=OrderSide.BUY,
+            user_id="u1",
+            peg_offset=-1.0,
+        )
+        self.order_book.match_order(pegged)
+        self.order_book.add_order(self.buy_order_100)
+        self.assertEqual(pegged.price, 99.0)
+        self.assertEqual(self.order_book.best_bid("AAPL").price, 100)
+
+        version = self.order_book.book_version("AAPL")
+        self.order_book.depth_snapshot("AAPL", 5)
+        self.order_book.get_bids("AAPL")
+        self.assertEqual(self.order_book.book_version("AAPL"), version)
+        for reference in (101.0, 101.5, 102.0):
+            self.order_book.set_peg_reference("AAPL", reference)
+        self.assertEqual(self.order_book.book_version("AAPL"), version + 3)
+        version = self.order_book.book_version("AAPL")
+        self.order_book.depth_snapshot("AAPL", 5)
+        self.assertEqual(self.order_book.book_version("AAPL"), version)
+        self.assertIs(self.order_book.best_bid("AAPL"), pegged)
+        self.assertEqual(pegged.price, 101.0)
+
+        # a sell at the pegged price trades with it
+        sell = OrderModel(
+            price=101, quantity=5, ticker="AAPL", user_id="u2", side=OrderSide.SELL
+        )
+        status, _, avg_price = self.order_book.match_order(sell)
+        self.assertEqual((status, avg_price), (OrderStatus.FILLED, 101.0))
+        self.assertEqual(self.order_book.pegged_orders["AAPL"], {})
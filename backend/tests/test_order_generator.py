@@ -113,13 +113,13 @@ class TestOrderGenerator(TestCase):
         print("Before _process_ticker:")
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -129,13 +129,13 @@ class TestOrderGenerator(TestCase):
         print("After _process_ticker:")
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -168,13 +168,13 @@ class TestOrderGenerator(TestCase):
         print("Before _process_ticker:")
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -183,13 +183,13 @@ class TestOrderGenerator(TestCase):
         print("After _process_ticker:")
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -223,13 +223,13 @@ class TestOrderGenerator(TestCase):
         print("Before _process_ticker:")
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -239,13 +239,13 @@ class TestOrderGenerator(TestCase):
         print("After _process_ticker:")
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -317,8 +317,8 @@ class TestOrderGenerator(TestCase):
 
         self.generator._process_ticker("AAPL")
 
-        buys = [o.quantity for _, _, o in self.order_book.buys["AAPL"]]
-        sells = [o.quantity for _, _, o in self.order_book.sells["AAPL"]]
+        buys = [o.quantity for o in self.order_book.buys["AAPL"]]
+        sells = [o.quantity for o in self.order_book.sells["AAPL"]]
 
         self.assertTrue(all(q > 0 for q in buys))
         self.assertTrue(all(q > 0 for q in sells))
@@ -385,13 +385,13 @@ class TestOrderGenerator(TestCase):
         # Call _process_ticker
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -400,13 +400,13 @@ class TestOrderGenerator(TestCase):
 
         print(
             "Buys:",
-            [(o.price, o.quantity) for _, _, o in self.order_book.buys.get("AAPL", [])],
+            [(o.price, o.quantity) for o in self.order_book.buys.get("AAPL", [])],
         )
         print(
             "Sells:",
             [
                 (o.price, o.quantity)
-                for _, _, o in self.order_book.sells.get("AAPL", [])
+                for o in self.order_book.sells.get("AAPL", [])
             ],
         )
 
@@ -0,0 +1,342 @@
+import asyncio
+import json
+from unittest import TestCase
+
+from app.schemas.order import OrderModel, OrderSide
+from app.services.order_book import OrderBook
+from app.websocket.encoding import JSONEncoder, get_encoder
+from app.websocket.price_engine import PriceEngine
+
+
+class FakeWebSocket:
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.blocked = blocked
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame):
+        if self.blocked:
+            # a client on a dead network, the write never completes
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+class CountingEncoder(JSONEncoder):
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, message):
+        self.calls += 1
+        return super().encode(message)
+
+
+class TestPriceEngine(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self._close_loop)
+        self.order_book = OrderBook()
+
+        class DummyInstrument:
+            def __init__(self, id):
+                self.id = id
+
+        class DummyInstrumentManager:
+            instruments = [DummyInstrument("AAPL"), DummyInstrument("MSFT")]
+
+            def get_all_instruments(self):
+                return self.instruments
+
+            def is_valid_instrument(self, ticker):
+                return ticker in ("AAPL", "MSFT")
+
+        self.engine = PriceEngine(
+            order_book=self.order_book, instrument_manager=DummyInstrumentManager()
+        )
+        for ticker, bid, ask in (("AAPL", 99, 101), ("MSFT", 199, 201)):
+            for price, side in ((bid, OrderSide.BUY), (ask, OrderSide.SELL)):
+                self.order_book.add_order(
+                    OrderModel(
+                        price=price, quantity=5, ticker=ticker, user_id="u1", side=side
+                    )
+                )
+
+    def _close_loop(self):
+        async def disconnect_all():
+            for websocket in list(self.engine.connections):
+                self.engine.disconnect(websocket)
+            await asyncio.sleep(0)
+
+        self.loop.run_until_complete(disconnect_all())
+        self.loop.close()
+
+    def _run(self, coro):
+        """Run coro, then let the writer tasks flush what it queued"""
+        result = self.loop.run_until_complete(coro)
+        self.loop.run_until_complete(self._drain())
+        return result
+
+    async def _drain(self):
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            *(
+                connection.drain()
+                for websocket, connection in self.engine.connections.items()
+                if not websocket.blocked
+            )
+        )
+
+    def _connect(self, blocked=False):
+        websocket = FakeWebSocket(blocked)
+        self._run(self.engine.connect(websocket))
+        return websocket
+
+    def _request(self, websocket, **message):
+        return self._run(self.engine.handle_message(websocket, json.dumps(message)))
+
+    def _tick(self):
+        async def tick():
+            await self.engine.publish_price_tick()
+            await self.engine.publish_depth()
+
+        self._run(tick())
+
+    def test_legacy_clients_get_flat_price_map(self):
+        """Test that a client that never subscribes keeps the old feed"""
+        legacy = self._connect()
+        self._tick()
+        self.assertEqual(legacy.sent, [{"AAPL": 100.0, "MSFT": 200.0}])
+
+    def test_prices_only_for_subscribed_tickers(self):
+        """Test that a subscribed client only gets the tickers it follows"""
+        websocket = self._connect()
+        reply = self._request(
+            websocket, action="subscribe", channel="prices", tickers=["MSFT"]
+        )
+        self.assertEqual(reply["type"], "subscribed")
+        self._tick()
+        self.assertEqual(
+            websocket.sent,
+            [{"type": "prices", "seq": 1, "snapshot": True, "data": {"MSFT": 200.0}}],
+        )
+
+        self._request(
+            websocket, action="unsubscribe", channel="prices", tickers=["MSFT"]
+        )
+        self._raise_bid("MSFT", 200)
+        self._tick()
+        self.assertEqual(len(websocket.sent), 1)
+
+    def test_depth_snapshot_on_subscribe_then_only_on_change(self):
+        """Test that depth is sent on subscribe and again only when the book moves"""
+        websocket = self._connect()
+        self._request(websocket, action="subscribe", channel="depth", tickers=["AAPL"])
+        self.assertEqual(websocket.sent[0]["type"], "depth")
+        self.assertEqual(websocket.sent[0]["bids"][0]["price"], 99)
+
+        self._tick()
+        self._tick()
+        self.assertEqual(len(websocket.sent), 1)
+
+        self.order_book.add_order(
+            OrderModel(
+                price=100, quantity=1, ticker="AAPL", user_id="u1", side=OrderSide.BUY
+            )
+        )
+        self._tick()
+        self.assertEqual(len(websocket.sent), 2)
+        self.assertEqual(
+            websocket.sent[1],
+            {
+                "type": "depth_update",
+                "ticker": "AAPL",
+                "seq": 1,
+                "version": self.order_book.book_version("AAPL"),
+                "bids": [{"price": 100, "quantity": 1, "orders": 1}],
+                "asks": [],
+            },
+        )
+
+    def test_depth_update_removes_level_and_resync(self):
+        """Test that an emptied level is sent with quantity 0 and resync resends the book"""
+        websocket = self._connect()
+        self._request(websocket, action="subscribe", channel="depth", tickers=["MSFT"])
+        self.order_book.match_order(
+            OrderModel(
+                price=201, quantity=5, ticker="MSFT", user_id="u2", side=OrderSide.BUY
+            )
+        )
+        self._tick()
+        self.assertEqual(
+            websocket.sent[-1]["asks"], [{"price": 201, "quantity": 0, "orders": 0}]
+        )
+        self.assertEqual(websocket.sent[-1]["seq"], 1)
+
+        reply = self._request(
+            websocket, action="resync", channel="depth", tickers=["MSFT"]
+        )
+        self.assertEqual(reply["type"], "resynced")
+        snapshot = websocket.sent[-1]
+        self.assertEqual(snapshot["type"], "depth")
+        self.assertEqual(snapshot["seq"], 1)
+        self.assertEqual(snapshot["asks"], [])
+
+    def test_rejects_unknown_channel_and_ticker(self):
+        """Test that bad subscribe requests get an error reply"""
+        websocket = self._connect()
+        self.assertEqual(
+            self._request(websocket, action="subscribe", channel="candles")["type"],
+            "error",
+        )
+        self.assertEqual(
+            self._request(
+                websocket, action="subscribe", channel="prices", tickers=["NOPE"]
+            )["type"],
+            "error",
+        )
+        self.assertNotIn(websocket, self.engine.subscriptions)
+
+    def test_tickers_must_be_a_list(self):
+        """Test that a single ticker string is one ticker and other shapes are refused"""
+        websocket = self._connect()
+        self.assertEqual(
+            self._request(websocket, action="subscribe", channel="prices", tickers={"a": 1})[
+                "type"
+            ],
+            "error",
+        )
+        self.assertNotIn(websocket, self.engine.subscriptions)
+
+        reply = self._request(
+            websocket, action="subscribe", channel="prices", tickers="AAPL"
+        )
+        self.assertEqual(reply["tickers"], ["AAPL"])
+        self.assertEqual(
+            self.engine.subscriptions.tickers("prices", websocket), {"AAPL"}
+        )
+
+    def test_slow_consumer_is_disconnected(self):
+        """Test that a stuck client is cut off without holding up the others"""
+        self.engine.max_queue = 2
+        stuck = self._connect(blocked=True)
+        healthy = self._connect()
+        for websocket in (stuck, healthy):
+            self._request(websocket, action="subscribe", channel="news")
+
+        for i in range(4):
+            subscribers = self.engine.subscriptions.subscribers("news")
+            self._run(self.engine.send_to(subscribers, {"i": i}))
+
+        self.assertEqual([message["i"] for message in healthy.sent], [0, 1, 2, 3])
+        self.assertNotIn(stuck, self.engine.connections)
+        self.assertEqual(stuck.close_code, 1013)
+        self.assertEqual(self.engine.metrics()["slow_consumers_disconnected"], 1)
+
+    def test_price_ticks_dropped_oldest_first(self):
+        """Test that a lagging client loses old price ticks, not its connection"""
+        self.engine.max_queue = 2
+        websocket = self._connect(blocked=True)
+        connection = self.engine.connections[websocket]
+        for i in range(5):
+            self._run(self.engine.broadcast({"AAPL": 100.0 + i}, droppable=True))
+
+        self.assertIn(websocket, self.engine.connections)
+        # one frame in flight, the newest two still queued
+        self.assertEqual(
+            [json.loads(frame)["AAPL"] for frame, _, _ in connection.queue],
+            [103.0, 104.0],
+        )
+        self.assertEqual(self.engine.metrics()["frames_dropped"], 2)
+        self.assertTrue(connection.stale_prices)
+
+    def test_disconnect_cleans_up_topics(self):
+        """Test that a dropped connection leaves no topic behind"""
+        websocket = self._connect()
+        self._request(websocket, action="subscribe", channel="trades")
+        self.engine.disconnect(websocket)
+        self.engine.disconnect(websocket)
+        self.assertEqual(self.engine.subscriptions.topics, {})
+
+    def _raise_bid(self, ticker, price):
+        self.order_book.add_order(
+            OrderModel(
+                price=price, quantity=1, ticker=ticker, user_id="u2", side=OrderSide.BUY
+            )
+        )
+
+    def test_only_changed_tickers_are_sent(self):
+        """Test that quiet ticks send nothing and moves send just that ticker"""
+        legacy = self._connect()
+        websocket = self._connect()
+        self._request(websocket, action="subscribe", channel="prices")
+        self._tick()
+        self._tick()
+        self.assertEqual(len(legacy.sent), 1)
+        self.assertEqual(len(websocket.sent), 1)
+
+        self._raise_bid("AAPL", 100)
+        self._tick()
+        self.assertEqual(legacy.sent[-1], {"AAPL": 100.5})
+        self.assertEqual(
+            websocket.sent[-1],
+            {"type": "prices", "seq": 2, "snapshot": False, "data": {"AAPL": 100.5}},
+        )
+
+    def test_min_change_conflates_small_moves(self):
+        """Test that moves below the threshold wait until they add up"""
+        self.engine.min_change = 1.0
+        self.engine.price_update({"AAPL": 100.0})
+        self.assertEqual(self.engine.price_update({"AAPL": 100.5}), ({}, False))
+        self.assertEqual(
+            self.engine.price_update({"AAPL": 101.0}), ({"AAPL": 101.0}, False)
+        )
+        self.assertEqual(self.engine.price_seq, 2)
+
+    def test_periodic_snapshot_and_on_subscribe(self):
+        """Test that all prices are resent on the snapshot interval and on subscribe"""
+        self.engine.snapshot_seconds = 10
+        self.engine.price_update({"AAPL": 100.0, "MSFT": 200.0}, now=0)
+        self.assertEqual(self.engine.price_update({"AAPL": 100.0}, now=5), ({}, False))
+        self.assertEqual(
+            self.engine.price_update({"AAPL": 100.0, "MSFT": 200.0}, now=10),
+            ({"AAPL": 100.0, "MSFT": 200.0}, True),
+        )
+
+        websocket = self._connect()
+        self._request(websocket, action="subscribe", channel="prices", tickers=["AAPL"])
+        self.assertEqual(
+            websocket.sent,
+            [{"type": "prices", "seq": 2, "snapshot": True, "data": {"AAPL": 100.0}}],
+        )
+
+    def test_frame_encoded_once_for_all_connections(self):
+        """Test that a broadcast is serialized once, not once per connection"""
+        self.engine.encoder = CountingEncoder()
+        legacy = [self._connect() for _ in range(5)]
+        subscribed = [self._connect() for _ in range(5)]
+        for websocket in subscribed:
+            self._request(
+                websocket, action="subscribe", channel="prices", tickers=["AAPL"]
+            )
+
+        self._tick()
+        # one legacy frame and one frame shared by the AAPL subscribers
+        self.assertEqual(self.engine.encoder.calls, 2)
+        for websocket in legacy:
+            self.assertEqual(websocket.sent, [{"AAPL": 100.0, "MSFT": 200.0}])
+        for websocket in subscribed:
+            self.assertEqual(
+                websocket.sent,
+                [{"type": "prices", "seq": 1, "snapshot": True, "data": {"AAPL": 100.0}}],
+            )
+
+    def test_unknown_encoder(self):
+        """Test that a misconfigured encoder name fails at startup"""
+        self.assertIsInstance(get_encoder("json"), JSONEncoder)
+        with self.assertRaises(ValueError):
+            get_encoder("xml")
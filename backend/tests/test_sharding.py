@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+from app.schemas.order import OrderSide
+from app.services.book_order import BookOrder
+from app.services.order_processor import OrderProcessor
+from app.services.sharding import ShardBook, ShardedOrderBook, assign_shards
+
+
+def instrument(ticker, s_0=100.0):
+    return SimpleNamespace(id=ticker, s_0=s_0)
+
+
+class DummyInstrumentManager:
+    def is_valid_instrument(self, ticker):
+        return ticker in ("AAPL", "MSFT")
+
+
+class TestAssignShards(TestCase):
+    def test_round_robin_in_ticker_order(self):
+        """Test that tickers are spread evenly and independent of input order"""
+        shards = assign_shards(["MSFT", "AAPL", "TSLA", "GOOG"], 2)
+        self.assertEqual(shards, {"AAPL": 0, "GOOG": 1, "MSFT": 0, "TSLA": 1})
+        self.assertEqual(shards, assign_shards(["TSLA", "GOOG", "AAPL", "MSFT"], 2))
+
+
+class TestShardedOrderBook(TestCase):
+    def setUp(self):
+        self.order_book = ShardedOrderBook(
+            [instrument("AAPL"), instrument("MSFT")], shards=2, quote_interval=None
+        )
+        self.order_book.start()
+        self.addCleanup(self.order_book.stop)
+        self.executions = []
+        self.order_book.executions.subscribe(self.executions.append)
+
+    def _order(self, side, price, quantity, user_id, ticker="AAPL"):
+        return BookOrder(
+            price=price, quantity=quantity, ticker=ticker, side=side, user_id=user_id
+        )
+
+    def test_tickers_live_on_their_shard(self):
+        """Test that each ticker's orders rest in its own shard process"""
+        self.order_book.match_order(self._order(OrderSide.SELL, 101, 5, "2"))
+        self.order_book.match_order(self._order(OrderSide.SELL, 301, 5, "2", "MSFT"))
+        self.assertEqual(self.order_book.best_ask("AAPL").price, 101)
+        self.assertEqual(self.order_book.best_ask("MSFT").price, 301)
+        # reads are answered from the market state the replies carried
+        calls = [shard["calls"] for shard in self.order_book.metrics()["shards"]]
+        self.assertEqual(calls, [1, 1])
+
+    def test_fills_applied_in_parent(self):
+        """Test that a shard's fills reach user state, order logs and the bus"""
+        maker = self._order(OrderSide.SELL, 101, 10, "2")
+        self.order_book.match_order(maker)
+        status, left, price = self.order_book.match_order(
+            self._order(OrderSide.BUY, 102, 4, "1")
+        )
+
+        self.assertEqual((status.value, left, price), ("filled", 0, 101))
+        self.assertEqual(len(self.executions), 1)
+        self.assertEqual(self.executions[0].maker_order_id, maker.id)
+        self.assertEqual(self.order_book._get_user_state("1").get_position("AAPL"), 4)
+        self.assertEqual(self.order_book._get_user_state("2").get_position("AAPL"), -4)
+        self.assertEqual(self.order_book.order_mapping[maker.id].quantity, 6)
+        maker_orders = self.order_book.get_trader_orders_with_status("2")
+        self.assertEqual(maker_orders[0]["status"], "partially_filled")
+        self.assertEqual(self.order_book.depth_snapshot("AAPL")["asks"][0]["quantity"], 6)
+
+    def test_cancel(self):
+        """Test that a cancel removes the order in the shard and logs it"""
+        maker = self._order(OrderSide.SELL, 101, 10, "2")
+        self.order_book.match_order(maker)
+        self.assertTrue(self.order_book.remove_order(maker))
+        self.assertFalse(self.order_book.remove_order(maker))
+        self.assertIsNone(self.order_book.best_ask("AAPL"))
+        self.assertEqual(
+            self.order_book.get_trader_orders_with_status("2")[0]["status"], "cancelled"
+        )
+
+    def test_risk_checks_use_parent_state(self):
+        """Test that cash checks see fills that happened in another shard"""
+        processor = OrderProcessor(self.order_book, None, DummyInstrumentManager())
+        self.order_book._get_user_state("1").cash = 900
+        self.order_book.match_order(self._order(OrderSide.SELL, 100, 5, "2", "MSFT"))
+        result = processor.process_order(self._order(OrderSide.BUY, 100, 5, "1", "MSFT"))
+        self.assertEqual(result["status"].value, "filled")
+
+        result = processor.process_order(self._order(OrderSide.BUY, 100, 5, "1"))
+        self.assertEqual(result["status"], "INSUFFICIENT_CASH")
+
+
+    def test_orders_for_different_shards_match_concurrently(self):
+        """Test that the event loop awaits shards in parallel instead of one at a time"""
+        # only passes once both shards are inside a round trip at the same time
+        barrier = threading.Barrier(len(self.order_book.clients), timeout=5)
+        for client in self.order_book.clients:
+            roundtrip = client._roundtrip
+
+            def together(name, args, roundtrip=roundtrip):
+                barrier.wait()
+                return roundtrip(name, args)
+
+            client._roundtrip = together
+
+        async def place():
+            return await asyncio.gather(
+                self.order_book.match_order_async(self._order(OrderSide.SELL, 101, 5, "2")),
+                self.order_book.match_order_async(
+                    self._order(OrderSide.SELL, 301, 5, "2", "MSFT")
+                ),
+            )
+
+        results = asyncio.run(place())
+        self.assertEqual([result[1] for result in results], [5, 5])
+        self.assertEqual(self.order_book.best_ask("MSFT").price, 301)
+        self.assertEqual(len(self.order_book.get_trader_orders_with_status("2")), 2)
+
+
+class TestShardBook(TestCase):
+    def test_shard_keeps_no_user_state(self):
+        """Test that a shard only matches, users and their history live in the parent"""
+        order_book = ShardBook()
+        executions = []
+        order_book.executions.subscribe(executions.append)
+        order_book.match_order(
+            BookOrder(price=101, quantity=5, ticker="AAPL", side=OrderSide.SELL, user_id="2")
+        )
+        order_book.match_order(
+            BookOrder(price=101, quantity=8, ticker="AAPL", side=OrderSide.BUY, user_id="1")
+        )
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(order_book.best_bid("AAPL").quantity, 3)
+        self.assertEqual(order_book.user_state_mapping, {})
+        self.assertEqual(order_book.order_logs, {})
+        self.assertEqual(order_book.trader_mapping, {})
+
+
+class TestShardBots(TestCase):
+    def test_bots_quote_inside_shards(self):
+        """Test that shards run the liquidity bots around the peg reference"""
+        order_book = ShardedOrderBook([instrument("AAPL")], shards=1, quote_interval=0.05)
+        order_book.set_peg_reference("AAPL", 100.0)
+        order_book.start()
+        self.addCleanup(order_book.stop)
+
+        async def quoted():
+            # run() brings the market state the bots produced between orders
+            runner = asyncio.ensure_future(order_book.run())
+            deadline = time.monotonic() + 5
+            while order_book.best_bid("AAPL") is None and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+        asyncio.run(quoted())
+        self.assertLess(order_book.best_bid("AAPL").price, order_book.best_ask("AAPL").price)
@@ -0,0 +1,105 @@
+import random
+from unittest import TestCase
+
+from app.services.user import FillArchive, UserState
+
+
+class TestUserState(TestCase):
+    def setUp(self):
+        self.user_state = UserState(user_id="u1")
+
+    def _fill(self, side, quantity, price, ticker="AAPL"):
+        self.user_state.add_fulfilled_trades(
+            {"ticker": ticker, "side": side, "quantity": quantity, "price": price}
+        )
+
+    def test_long_then_partial_close(self):
+        """Test position, cost basis and realized P&L on a long position"""
+        self._fill("buy", 10, 100)
+        self._fill("buy", 10, 110)
+        self._fill("sell", 15, 120)
+
+        # FIFO: 10 @ 100 and 5 @ 110 are closed, 5 @ 110 remain
+        self.assertEqual(self.user_state.get_position("AAPL"), 5)
+        self.assertEqual(self.user_state.get_cost_basis("AAPL"), 550)
+        self.assertEqual(self.user_state.get_average_price("AAPL"), 110)
+        self.assertEqual(self.user_state.get_total_realized_pnl(), 200 + 50)
+
+    def test_flip_from_long_to_short(self):
+        """Test that selling through a long position opens a short lot"""
+        self._fill("buy", 5, 100)
+        self._fill("sell", 8, 90)
+
+        self.assertEqual(self.user_state.get_position("AAPL"), -3)
+        self.assertEqual(self.user_state.get_cost_basis("AAPL"), -270)
+        self.assertEqual(self.user_state.get_total_realized_pnl(), -50)
+
+        # buying back below the short price realizes a profit
+        self._fill("buy", 3, 80)
+        self.assertEqual(self.user_state.get_position("AAPL"), 0)
+        self.assertEqual(self.user_state.get_cost_basis("AAPL"), 0)
+        self.assertEqual(self.user_state.get_total_realized_pnl(), -50 + 30)
+
+    def test_aggregates_match_lots(self):
+        """Test that running aggregates agree with the open lots after random fills"""
+        rng = random.Random(3)
+        for _ in range(500):
+            self._fill(
+                rng.choice(["buy", "sell"]),
+                rng.randint(1, 20),
+                round(rng.uniform(90, 110), 2),
+            )
+
+        lots = self.user_state.portfolio["AAPL"]
+        self.assertEqual(
+            self.user_state.get_position("AAPL"), sum(qty for qty, _ in lots)
+        )
+        self.assertAlmostEqual(
+            self.user_state.get_cost_basis("AAPL"),
+            sum(qty * price for qty, price in lots),
+        )
+
+        prices = {"AAPL": 100.0}
+        self.assertAlmostEqual(
+            self.user_state.calculate_unrealized_pnl(prices),
+            sum((100.0 - price) * qty for qty, price in lots),
+        )
+
+    def test_recent_volume_window(self):
+        """Test that only trades inside the window count towards recent volume"""
+        self.user_state.add_trade_to_history("AAPL", 100, "buy", 0)
+        self.user_state.add_trade_to_history("AAPL", 50, "buy", 40)
+        self.user_state.add_trade_to_history("MSFT", 70, "buy", 45)
+
+        self.assertEqual(self.user_state.get_recent_volume("AAPL", 60, 50), 150)
+        self.assertEqual(self.user_state.get_recent_volume("AAPL", 30, 50), 50)
+        self.assertEqual(self.user_state.get_recent_volume("AAPL", 60, 70), 50)
+        self.assertEqual(self.user_state.get_recent_volume("TSLA", 60, 70), 0)
+
+        # old trades are evicted, memory stays bounded
+        self.assertEqual(len(self.user_state.trade_history["AAPL"].trades), 1)
+
+    def test_reversal_risk_uses_last_trade_in_lookback(self):
+        """Test reversal detection against the newest trade inside the lookback"""
+        self.user_state.add_trade_to_history("AAPL", 150, "buy", 0)
+
+        self.assertTrue(self.user_state.check_reversal_risk("AAPL", "sell", 10, 30))
+        self.assertFalse(self.user_state.check_reversal_risk("AAPL", "buy", 10, 30))
+        self.assertFalse(self.user_state.check_reversal_risk("AAPL", "sell", 40, 30))
+
+        self.user_state.add_trade_to_history("AAPL", 10, "buy", 41)
+        self.assertFalse(self.user_state.check_reversal_risk("AAPL", "sell", 45, 30))
+
+    def test_fill_archive_is_bounded(self):
+        """Test that the archive keeps the newest fills and drops the oldest"""
+        self.user_state.fill_archive = FillArchive(max_fills=8)
+        for price in range(20):
+            self._fill("buy", 1, price)
+            self.user_state.archive_fills()
+
+        prices = [fill["price"] for fill in self.user_state.get_fulfilled_trades()]
+        self.assertLessEqual(len(prices), 8)
+        self.assertEqual(prices[-1], 19)
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(self.user_state.fill_archive.dropped + len(prices), 20)
+        self.assertEqual(self.user_state.get_position("AAPL"), 20)
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import time
+from unittest import TestCase
+
+from app.schemas.order import OrderModel, OrderSide
+from app.services.matching_engine import MatchingEngine
+from app.services.order_book import OrderBook
+from app.services.order_processor import OrderProcessor
+from app.services.trading_service import TradingService
+from app.websocket.user_engine import UserEngine
+
+
+class FakeWebSocket:
+    def __init__(self, messages=()):
+        self.sent = []
+        self.messages = list(messages)
+        self.close_code = None
+
+    async def receive_text(self):
+        return self.messages.pop(0)
+
+    async def send_text(self, frame):
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+class FakeUser:
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+        self.is_active = True
+
+
+class TestUserEngine(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self._close_loop)
+        self.order_book = OrderBook()
+
+        class DummyInstrument:
+            id = "AAPL"
+            full_name = "Apple Inc."
+
+        class DummyInstrumentManager:
+            def get_all_instruments(self):
+                return [DummyInstrument()]
+
+            def is_valid_instrument(self, ticker):
+                return ticker == "AAPL"
+
+        instrument_manager = DummyInstrumentManager()
+        self.engine = UserEngine(
+            order_book=self.order_book,
+            instrument_manager=instrument_manager,
+            trading=TradingService(
+                self.order_book,
+                OrderProcessor(self.order_book, None, instrument_manager),
+                instrument_manager,
+            ),
+        )
+        self.ask = OrderModel(
+            price=101, quantity=10, ticker="AAPL", user_id="2", side=OrderSide.SELL
+        )
+        # resting orders of user 2, placed the way the trading endpoint does
+        self.order_book.match_order(self.ask)
+        self.order_book.match_order(
+            OrderModel(
+                price=99, quantity=10, ticker="AAPL", user_id="2", side=OrderSide.BUY
+            )
+        )
+
+    def _close_loop(self):
+        async def disconnect_all():
+            for websocket in list(self.engine.connections):
+                self.engine.disconnect(websocket)
+            await asyncio.sleep(0)
+
+        self.loop.run_until_complete(disconnect_all())
+        self.loop.close()
+
+    def _run(self, coro=None):
+        """Run coro, then let callbacks and writer tasks flush"""
+        async def flush():
+            result = await coro if coro is not None else None
+            await asyncio.sleep(0)
+            await asyncio.gather(
+                *(connection.drain() for connection, _ in self.engine.connections.values())
+            )
+            return result
+
+        return self.loop.run_until_complete(flush())
+
+    def _connect(self, user):
+        websocket = FakeWebSocket()
+        self._run(self.engine.connect(websocket, user))
+        return websocket
+
+    def _types(self, websocket):
+        return [message["type"] for message in websocket.sent]
+
+    def test_initial_state_on_connect(self):
+        """Test that a new connection gets its user, orders and portfolio"""
+        websocket = self._connect(FakeUser(2, "maker"))
+        self.assertEqual(self._types(websocket), ["authenticated", "orders", "portfolio"])
+        self.assertEqual(len(websocket.sent[1]["data"]), 2)
+        self.assertEqual(websocket.sent[2]["positions"], [])
+
+    def test_fill_pushed_to_both_sides(self):
+        """Test that an execution reaches the taker and the maker right away"""
+        taker = self._connect(FakeUser(1, "taker"))
+        maker = self._connect(FakeUser(2, "maker"))
+        self.order_book.match_order(
+            OrderModel(
+                price=101, quantity=4, ticker="AAPL", user_id="1", side=OrderSide.BUY
+            )
+        )
+        self._run()
+
+        taker_fill = [message for message in taker.sent if message["type"] == "fill"]
+        maker_fill = [message for message in maker.sent if message["type"] == "fill"]
+        self.assertEqual(taker_fill[0]["liquidity"], "taker")
+        self.assertEqual(taker_fill[0]["side"], "buy")
+        self.assertEqual(maker_fill[0]["liquidity"], "maker")
+        self.assertEqual(maker_fill[0]["order_id"], str(self.ask.id))
+        self.assertEqual(maker_fill[0]["quantity"], 4)
+
+        maker_orders = maker.sent[-1]
+        self.assertEqual(maker_orders["type"], "orders")
+        self.assertEqual(maker_orders["data"][0]["status"], "partially_filled")
+
+    def test_cancel_shows_up_in_orders(self):
+        """Test that order transitions outside matching are picked up from the log"""
+        websocket = self._connect(FakeUser(2, "maker"))
+        self.order_book.remove_order(self.ask)
+        self._run(self.engine.publish_orders())
+        self.assertEqual(websocket.sent[-1]["type"], "orders")
+        self.assertEqual(websocket.sent[-1]["data"][0]["status"], "cancelled")
+
+        self._run(self.engine.publish_orders())
+        self.assertEqual(len(websocket.sent), 4)
+
+    def test_portfolio_only_when_changed(self):
+        """Test that portfolio frames are skipped while nothing moved"""
+        websocket = self._connect(FakeUser(1, "taker"))
+        self._run(self.engine.publish_portfolios())
+        self._run(self.engine.publish_portfolios())
+        self.assertEqual(self._types(websocket).count("portfolio"), 1)
+
+        self.order_book.match_order(
+            OrderModel(
+                price=101, quantity=4, ticker="AAPL", user_id="1", side=OrderSide.BUY
+            )
+        )
+        self._run()
+        self._run(self.engine.publish_portfolios())
+        portfolio = websocket.sent[-1]
+        self.assertEqual(portfolio["type"], "portfolio")
+        self.assertEqual(portfolio["positions"][0]["quantity"], 4)
+
+    def test_portfolio_pushes_keep_previous_mid(self):
+        """Test that marking portfolios doesn't move the mid the spread clamp starts from"""
+        self._connect(FakeUser(2, "maker"))
+        self.order_book.previous_mid.pop("AAPL", None)
+        self._run(self.engine.publish_portfolios())
+        self.assertNotIn("AAPL", self.order_book.previous_mid)
+
+    def test_rejects_missing_or_bad_token(self):
+        """Test that a connection without a valid token is not authenticated"""
+        websocket = FakeWebSocket([json.dumps({"action": "subscribe"})])
+        self.assertIsNone(self._run(self.engine.authenticate(websocket)))
+        self.assertIsNone(self._run(self.engine.authenticate(websocket, "not-a-jwt")))
+
+    def test_disconnect_unsubscribes(self):
+        """Test that the last connection of a user releases its execution subscription"""
+        websocket = self._connect(FakeUser(1, "taker"))
+        self.assertIn("1", self.order_book.executions.user_subscribers)
+        self.engine.disconnect(websocket)
+        self.assertNotIn("1", self.order_book.executions.user_subscribers)
+        self.assertEqual(self.engine.sessions, {})
+
+    def test_failed_connect_cleans_up(self):
+        """Test that a connect whose initial state can't be loaded leaves nothing behind"""
+        async def unavailable(*args, **kwargs):
+            raise ConnectionError("engine unavailable")
+
+        self.engine.trading.orders = unavailable
+        with self.assertRaises(ConnectionError):
+            self._connect(FakeUser(1, "taker"))
+        self.assertEqual(self.engine.sessions, {})
+        self.assertEqual(self.engine.connections, {})
+        self.assertNotIn("1", self.order_book.executions.user_subscribers)
+
+    def _send(self, websocket, **message):
+        return self._run(self.engine.handle_message(websocket, json.dumps(message)))
+
+    def test_new_order_acked(self):
+        """Test that an order entered on the socket is acked with the client id"""
+        websocket = self._connect(FakeUser(1, "taker"))
+        reply = self._send(
+            websocket, action="new", client_order_id="c1", symbol="AAPL",
+            side="buy", order_type="limit", quantity=4, price=101,
+        )
+        self.assertEqual(reply["type"], "ack")
+        self.assertEqual(reply["client_order_id"], "c1")
+        self.assertEqual(reply["status"], "filled")
+        self.assertEqual(reply["price"], 101)
+        self.assertIn("fill", self._types(websocket))
+        self.assertEqual(self.order_book.find_order(self.ask.id).quantity, 6)
+
+    def test_new_order_rejected(self):
+        """Test that invalid and risk rejected orders come back as rejects"""
+        websocket = self._connect(FakeUser(1, "taker"))
+        reply = self._send(
+            websocket, action="new", client_order_id="c1", symbol="AAPL",
+            side="buy", order_type="limit", quantity=-1, price=101,
+        )
+        self.assertEqual(reply["type"], "reject")
+        self.assertEqual(reply["reason"], "INVALID_ORDER")
+
+        reply = self._send(
+            websocket, action="new", client_order_id="c2", symbol="AAPL",
+            side="buy", order_type="limit", quantity=501, price=101,
+        )
+        self.assertEqual(reply["type"], "reject")
+        self.assertEqual(reply["client_order_id"], "c2")
+        self.assertEqual(reply["reason"], "ORDER_SIZE_EXCEEDED")
+
+        reply = self._send(
+            websocket, action="new", symbol="AAPL", side="buy",
+            order_type="limit", quantity=1, price=101,
+        )
+        self.assertEqual(reply["type"], "reject")
+
+    def test_cancel_and_amend(self):
+        """Test that only the owner can cancel, amend replaces with a new order id"""
+        maker = self._connect(FakeUser(2, "maker"))
+        taker = self._connect(FakeUser(1, "taker"))
+        order_id = str(self.ask.id)
+
+        reply = self._send(taker, action="cancel", client_order_id="x", order_id=order_id)
+        self.assertEqual(reply["reason"], "NOT_FOUND")
+
+        reply = self._send(
+            maker, action="amend", client_order_id="a1", order_id=order_id, price=102
+        )
+        self.assertEqual(reply["type"], "ack")
+        self.assertEqual(reply["replaced_order_id"], order_id)
+        self.assertNotEqual(reply["order_id"], order_id)
+        self.assertEqual(self.order_book.best_ask("AAPL").price, 102)
+        self.assertEqual(self.order_book.best_ask("AAPL").quantity, 10)
+
+        reply = self._send(
+            maker, action="cancel", client_order_id="c1", order_id=reply["order_id"]
+        )
+        self.assertEqual(reply["type"], "ack")
+        self.assertEqual(reply["status"], "cancelled")
+        self.assertIsNone(self.order_book.best_ask("AAPL"))
+
+    def test_rejected_amend_keeps_original(self):
+        """Test that an amend failing the risk checks leaves the original resting"""
+        maker = self._connect(FakeUser(2, "maker"))
+        order_id = str(self.ask.id)
+
+        reply = self._send(
+            maker, action="amend", client_order_id="a1", order_id=order_id, quantity=501
+        )
+        self.assertEqual(reply["reason"], "ORDER_SIZE_EXCEEDED")
+        best_ask = self.order_book.best_ask("AAPL")
+        self.assertEqual(str(best_ask.external_id), order_id)
+        self.assertEqual(best_ask.quantity, 10)
+
+    def test_amend_counts_only_added_volume(self):
+        """Test that re-pricing an order does not use up the volume limit again"""
+        maker = self._connect(FakeUser(2, "maker"))
+        user_state = self.order_book._get_user_state("2")
+        order_id = str(self.ask.id)
+        for price in (102, 103, 104):
+            reply = self._send(
+                maker, action="amend", client_order_id="a", order_id=order_id, price=price
+            )
+            self.assertEqual(reply["type"], "ack")
+            order_id = reply["order_id"]
+        self.assertEqual(user_state.get_recent_volume("AAPL", 60, time.time()), 0)
+
+        reply = self._send(
+            maker, action="amend", client_order_id="a", order_id=order_id, quantity=15
+        )
+        self.assertEqual(reply["type"], "ack")
+        self.assertEqual(user_state.get_recent_volume("AAPL", 60, time.time()), 5)
+
+    def test_order_entry_through_matching_engine(self):
+        """Test that socket orders are applied by the matching engine when one is set"""
+        matching_engine = MatchingEngine(max_queue=1)
+        self.engine.trading.matching_engine = matching_engine
+        websocket = self._connect(FakeUser(1, "taker"))
+        runner = self.loop.create_task(matching_engine.run())
+        self.addCleanup(runner.cancel)
+
+        reply = self._send(
+            websocket, action="new", client_order_id="c1", symbol="AAPL",
+            side="buy", order_type="limit", quantity=4, price=101,
+        )
+        self.assertEqual(reply["type"], "ack")
+        self.assertEqual(matching_engine.metrics()["processed"], 1)
@@ -132,10 +132,10 @@ export default function OrderBook({
                     <div className="grid grid-cols-3 gap-4 items-center">
                       <div className="flex items-center gap-3">
                         <div className="w-10 h-10 bg-gray-100 dark:bg-gray-800 rounded flex items-center justify-center shrink-0">
-                          <span className="text-xs font-bold text-gray-700 dark:text-gray-300">{order.ticker}</span>
+                          <span className="text-xs font-bold text-gray-700 dark:text-gray-300">{ticker}</span>
                         </div>
                         <div className="min-w-0">
-                          <div className="text-gray-900 dark:text-white font-semibold text-sm">{order.ticker}</div>
+                          <div className="text-gray-900 dark:text-white font-semibold text-sm">{ticker}</div>
                         </div>
                       </div>
                       <div className="text-gray-600 dark:text-white text-center font-medium text-sm">
@@ -161,10 +161,10 @@ export default function OrderBook({
                     <div className="grid grid-cols-3 gap-4 items-center">
                       <div className="flex items-center gap-3">
                         <div className="w-10 h-10 bg-gray-100 dark:bg-gray-800 rounded flex items-center justify-center shrink-0">
-                          <span className="text-xs font-bold text-gray-700 dark:text-gray-300">{order.ticker}</span>
+                          <span className="text-xs font-bold text-gray-700 dark:text-gray-300">{ticker}</span>
                         </div>
                         <div className="min-w-0">
-                          <div className="text-gray-900 dark:text-white font-semibold text-sm">{order.ticker}</div>
+                          <div className="text-gray-900 dark:text-white font-semibold text-sm">{ticker}</div>
                         </div>
                       </div>
                       <div className="text-gray-600 dark:text-white text-center font-medium text-sm">
@@ -1,18 +1,17 @@
 import useSWR from "swr";
 import { getApiBaseUrl } from "../config/api";
 
-export interface Order {
-  ticker: string;
+export interface OrderbookLevel {
   price: number;
   quantity: number;
-  user_id: string;
-  order_id: string;
+  orders: number;
 }
 
 export interface OrderbookResponse {
   ticker: string;
-  bids: Order[];
-  asks: Order[];
+  version: number;
+  bids: OrderbookLevel[];
+  asks: OrderbookLevel[];
 }
 
 const fetcher = (url: string) =>
@@ -89,9 +89,9 @@ function OrderBookPage() {
             {limitedBids.map((order, idx) => (
               <div className="orderbook-row" key={`bid-${idx}`}>
                 <div className="orderbook-name">
-                  <div className="orderbook-avatar">{order.ticker.slice(0, 3)}</div>
+                  <div className="orderbook-avatar">{ticker.slice(0, 3)}</div>
                   <div>
-                    <div className="orderbook-ticker">{order.ticker}</div>
+                    <div className="orderbook-ticker">{ticker}</div>
                     <div className="orderbook-sub">Instrument</div>
                   </div>
                 </div>
@@ -116,9 +116,9 @@ function OrderBookPage() {
             {limitedAsks.map((order, idx) => (
               <div className="orderbook-row" key={`ask-${idx}`}>
                 <div className="orderbook-name">
-                  <div className="orderbook-avatar">{order.ticker.slice(0, 3)}</div>
+                  <div className="orderbook-avatar">{ticker.slice(0, 3)}</div>
                   <div>
-                    <div className="orderbook-ticker">{order.ticker}</div>
+                    <div className="orderbook-ticker">{ticker}</div>
                     <div className="orderbook-sub">Instrument</div>
                   </div>
                 </div>
@@ -137,7 +137,7 @@ function TradesPage() {
     const fetchOrders = async () => {
       try {
         setOrdersError(null);
-        const response = await fetch(`${getApiBaseUrl()}/trading/orders`, {
+        const response = await fetch(`${getApiBaseUrl()}/trading/orders?limit=10`, {
           headers: {
             Authorization: `Bearer ${token}`,
             "Content-Type": "application/json",